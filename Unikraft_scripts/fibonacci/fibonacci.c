@@ -1,7 +1,12 @@
+#include <ctype.h>
 #include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
 #include <uk/plat/time.h>
 #include <uk/print.h>
 
+#define MAX_INPUTS 64
+
 int fibbonacci(int n)
 {
    if (n == 0)
@@ -18,10 +23,9 @@ int fibbonacci(int n)
    }
 }
 
-int main()
+void run(int n)
 {
    __nsec start = ukplat_monotonic_clock();
-   int n = 30;
 
    printf("Fibbonacci of %d:\n\n", n);
 
@@ -34,4 +38,41 @@ int main()
    uk_pr_info("Elapsed time: %llu ns\n", (unsigned long long)(end - start));
    printf("Elapsed time: %llu ns\n", (unsigned long long)(end - start));
    printf("\n");
-}
\ No newline at end of file
+   fflush(stdout);
+}
+
+// fibonacci [-i iterations] [n ...], the arguments come from the kernel command line
+// (kraft run . -- -i 5 5 30 50); anything else there is ignored
+int main(int argc, char *argv[])
+{
+   int inputs[MAX_INPUTS];
+   int count = 0;
+   int iterations = 1;
+
+   for (int a = 1; a < argc; a++)
+   {
+      if (strcmp(argv[a], "-i") == 0 && a + 1 < argc)
+      {
+         iterations = atoi(argv[++a]);
+      }
+      else if (isdigit((unsigned char)argv[a][0]) && count < MAX_INPUTS)
+      {
+         inputs[count++] = atoi(argv[a]);
+      }
+   }
+   if (count == 0)
+   {
+      inputs[count++] = 30;
+   }
+
+   for (int k = 0; k < count; k++)
+   {
+      for (int it = 0; it < iterations; it++)
+      {
+         run(inputs[k]);
+      }
+   }
+   // harness/batch.py shuts the VM down once it sees this
+   printf("Batch done\n");
+   fflush(stdout);
+}
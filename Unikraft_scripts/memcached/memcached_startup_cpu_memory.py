@@ -3,71 +3,106 @@ import psutil
 import time
 import os
 import csv
-import socket
 import threading
 import signal
+import sys
 
-LOG_DIR = "metrics"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "harness"))
+from proctree import enable_child_subreaper, from_popen, wait_for_qemu_child
+from probe import wait_until_ready
+from sampler import ResourceSampler, steady_averages, usage_averages, usage_rows
+from memacct import MemoryAccountant
+from apptelemetry import AppScraper
+from schedstat import SchedCollector
+from console import ConsoleReader, UNIKRAFT_MARKERS, UNIKRAFT_PHASES, write_boot_phases
+from runmeta import qemu_cmdline, update_run_metadata, write_run_metadata
+from snapshot import boot_mode, load_state_file, restore_command, save_state_file, state_paths
+from kraftcmd import direct_command, learn, load, qmp_socket, record
+from netbackend import GUEST_IP, backend, netdev_args, queues, unikraft_ip_args
+
+LOG_DIR = os.environ.get("METRICS_DIR", "metrics")
+SAMPLER_HZ = int(os.environ.get("SAMPLER_HZ", "100"))
+SAMPLER_CPU = int(os.environ["SAMPLER_CPU"]) if os.environ.get("SAMPLER_CPU") else None
+GUEST_MEM_MB = int(os.environ.get("GUEST_MEM_MB", "64"))
+MEMORY_INTERVAL = float(os.environ.get("MEMORY_INTERVAL", "1"))
+APP_STATS_HZ = float(os.environ.get("APP_STATS_HZ", "1"))
+SCHED_HZ = float(os.environ.get("SCHED_HZ", "10"))
+HOST_PORT = int(os.environ.get("HOST_PORT", "11211"))
+BOOT_MODE = boot_mode()
+NET_BACKEND = backend()
+NET_QUEUES = queues()
 os.makedirs(LOG_DIR, exist_ok=True)
 METRICS_FILE = os.path.join(LOG_DIR, "unikraft_memcached_metrics.csv")
 TEED_LOG_FILE = os.path.join(LOG_DIR, "memcached_full_output.log")
 CPU_LOG_FILE = os.path.join(LOG_DIR, "cpu_usage_unikraft.log")
+CONSOLE_LOG_FILE = os.path.join(LOG_DIR, "console_unikraft.log")
+BOOT_PHASES_FILE = os.path.join(LOG_DIR, "boot_phases.csv")
+MEMORY_LOG_FILE = os.path.join(LOG_DIR, "memory_unikraft.log")
+CPU_STORE_FILE = os.path.join(LOG_DIR, "cpu_unikraft.umx")
+MEMORY_STORE_FILE = os.path.join(LOG_DIR, "memory_unikraft.umx")
+APP_STATS_LOG_FILE = os.path.join(LOG_DIR, "app_stats_unikraft.log")
+APP_STATS_STORE_FILE = os.path.join(LOG_DIR, "app_stats_unikraft.umx")
+SCHED_LOG_FILE = os.path.join(LOG_DIR, "sched_unikraft.log")
+SCHED_STORE_FILE = os.path.join(LOG_DIR, "sched_unikraft.umx")
+MEMORY_SUMMARY_FILE = os.path.join(LOG_DIR, "memory_summary.csv")
+RUN_META_FILE = os.path.join(LOG_DIR, "run_meta.json")
+QMP_SOCKET = os.path.abspath(os.path.join(LOG_DIR, "qmp.sock"))
+STATE_FILE, _ = state_paths(os.getcwd(), GUEST_MEM_MB, "-tap" if NET_BACKEND == "tap" else "")
+GUEST_ADDRESS = (GUEST_IP, 11211) if NET_BACKEND == "tap" else ("127.0.0.1", HOST_PORT)
 
-start_time = None  
-full_log_lines = []
+# written through line by line, a killed run still leaves its output behind
+teed_log = open(TEED_LOG_FILE, "a", buffering=1)
 
 def buffered_print(message):
     print(message)
-    full_log_lines.append(message)
+    teed_log.write(message + "\n")
 
-def tee_print_all():
-    with open(TEED_LOG_FILE, "a") as f:
-        for line in full_log_lines:
-            f.write(line + "\n")
+def wait_for_memcached_ready(host="127.0.0.1", port=11211, timeout=15):
+    # ready means the application answered (a memcached VERSION line), not just that slirp accepted the connection
+    return wait_until_ready(host, port, "memcached", timeout)
 
-def find_qemu_proc_by_port(port="11211", timeout=10):
-    deadline = time.time() + timeout
-    while time.time() < deadline:
-        for proc in psutil.process_iter(['pid', 'cmdline']):
-            try:
-                if proc.name().startswith("qemu-system") and any(f"hostfwd=tcp::{port}-" in arg for arg in proc.cmdline()):
-                    print("QEMU process found")
-                    return proc
-            except (psutil.NoSuchProcess, psutil.AccessDenied):
-                continue
-        time.sleep(0.1)
-    return None
+def monitor_resource_usage_live(pid, stop_event, start_ns=None):
+    # sampling happens in a separate process that streams every sample to CPU_STORE_FILE
+    sampler = ResourceSampler(pid, hz=SAMPLER_HZ, cpu=SAMPLER_CPU, store_path=CPU_STORE_FILE, start_ns=start_ns)
+    sampler.start()
+    stop_event.wait()
+    sampler.stop()
+    try:
+        sampler.write_csv(CPU_LOG_FILE)
+    except Exception as e:
+        buffered_print(f"Failed to write CPU log: {e}")
+    buffered_print(sampler.overhead_report())
+    sampler.close()
 
-def wait_for_memcached_ready(host="127.0.0.1", port=11211, timeout=15):
-    start = time.time()
-    while time.time() - start < timeout:
-        try:
-            with socket.create_connection((host, port), timeout=0.5):
-                return time.time()
-        except (OSError, ConnectionRefusedError):
-            time.sleep(0.1)
-    return None
-
-def monitor_resource_usage_live(proc, usage_log, stop_event, interval=1):
-    proc.cpu_percent(interval=None)  # warm-up call
-    log_lines = ["Time Elapsed,CPU (%),Memory (KB)\n"]
-    while not stop_event.is_set() and proc.is_running():
-        cpu = proc.cpu_percent(interval=interval)
-        mem = proc.memory_info().rss // 1024
-        elapsed = round(time.time() - start_time, 2)
-        log_lines.append(f"{elapsed},{cpu},{mem}\n")
-        usage_log.append((elapsed, cpu, mem))
+def save_ready_state(qemu_pid):
+    # saved before the readiness line is printed, the benchmark never sees the paused guest
+    args = qemu_cmdline(qemu_pid)
+    control = qmp_socket(args)
+    if not control:
+        buffered_print("No QMP socket on kraft's QEMU command line, not saving a snapshot")
+        return None
     try:
-        with open(CPU_LOG_FILE, "w") as cpu_log:
-            cpu_log.writelines(log_lines)
+        paused = save_state_file(control, STATE_FILE, args, os.readlink(f"/proc/{qemu_pid}/cwd"))
     except Exception as e:
-        print(f"Failed to write CPU log: {e}")
+        buffered_print(f"Saving the snapshot failed: {e}")
+        return None
+    if paused is None:
+        buffered_print(f"Another run saved {STATE_FILE} first")
+        return None
+    buffered_print(f"Saved snapshot to {STATE_FILE} (guest paused {round(paused, 3)}s)")
+    return round(paused, 6)
 
 def run_and_monitor_memcached():
-    global start_time
     kraft_proc = None
+    vm_proc = None
+    restore = None
+    snapshot_save_s = None
+    console = None
+    accountant = None
+    scraper = None
+    sched = None
     qemu_proc = None
-    usage_log = []
+    qemu = None
     startup_time = None
     stop_event = threading.Event()
     end_time = None
@@ -78,6 +113,30 @@ def run_and_monitor_memcached():
         buffered_print("Interrupt signal received, cleaning up")
         stop_event.set()
 
+        if scraper:
+            scraper.stop()
+            scraper.write_log(APP_STATS_LOG_FILE)
+            buffered_print(scraper.report())
+
+        if sched:
+            sched.stop()
+            sched.write_log(SCHED_LOG_FILE)
+            buffered_print(sched.report())
+
+        if accountant:
+            accountant.stop()
+            accountant.write_log(MEMORY_LOG_FILE)
+            accountant.append_summary(MEMORY_SUMMARY_FILE, run_id, "unikraft", "memcached")
+            buffered_print(accountant.report())
+
+        if console and not restore:
+            write_boot_phases(BOOT_PHASES_FILE, run_id, "unikraft", "memcached", console.phases(UNIKRAFT_PHASES), kraft_start_ns)
+
+        if qemu:
+            # read back from the QEMU command line while it still runs, after the measured part
+            write_run_metadata(RUN_META_FILE, qemu.pid, run_id=run_id, app="memcached", platform="unikraft", startup_time=startup_time,
+                               boot_mode="restore" if restore else "cold", snapshot_save_s=snapshot_save_s)
+
         if kraft_proc:
             try:
                 kraft_proc.terminate()
@@ -85,6 +144,9 @@ def run_and_monitor_memcached():
             except Exception:
                 pass
 
+        if qemu and not qemu.terminate():
+            buffered_print(f"QEMU (PID: {qemu.pid}) did not exit")
+
         if monitor_thread and monitor_thread.is_alive():
             buffered_print("Waiting for monitor thread to finish")
             monitor_thread.join(timeout=10)
@@ -97,17 +159,22 @@ def run_and_monitor_memcached():
             if not file_exists:
                 writer.writerow(["Time (s)", "CPU Usage (%)", "Memory Usage (KB)"])
             if startup_time is not None and isinstance(startup_time, float):
-                for t, cpu, mem in usage_log:
+                for t, cpu, mem in usage_rows(CPU_STORE_FILE):
                     writer.writerow([t, cpu, mem])
 
-        tee_print_all()
         qemu_duration = round(end_time - qemu_start, 3) if qemu_proc else 0
         total_duration = round(end_time - kraft_start, 3)
         buffered_print(f"QEMU total duration: {qemu_duration}s")
         buffered_print(f"Total runtime: {total_duration}s")
-        if usage_log:
-            cpu_avg = round(sum(cpu for _, cpu, _ in usage_log) / len(usage_log), 2)
-            mem_avg = round(sum(mem for _, _, mem in usage_log) / len(usage_log), 2)
+        samples, cpu_avg, mem_avg = usage_averages(CPU_STORE_FILE)
+        window, steady_samples, steady_cpu, steady_mem = steady_averages(CPU_STORE_FILE, SAMPLER_HZ)
+        if window:
+            # boot and teardown excluded, the whole-run figures are kept for comparison
+            buffered_print(f"Avg CPU: {steady_cpu}% (steady state {window[0]}-{window[1]}s, whole run {cpu_avg}%)")
+            buffered_print(f"Avg Memory: {steady_mem} KB (steady state, whole run {mem_avg} KB)")
+            update_run_metadata(RUN_META_FILE, steady_window_s=list(window), steady_samples=steady_samples,
+                                cpu_avg=cpu_avg, mem_avg_kb=mem_avg, steady_cpu_avg=steady_cpu, steady_mem_avg_kb=steady_mem)
+        elif samples:
             buffered_print(f"Avg CPU: {cpu_avg}%")
             buffered_print(f"Avg Memory: {mem_avg} KB")
         exit(0)
@@ -116,25 +183,72 @@ def run_and_monitor_memcached():
     signal.signal(signal.SIGTERM, cleanup)
 
     try:
-        print("Starting Unikraft unikernel for Memcached")
+        # QEMU may daemonize away from kraft, as a subreaper it still ends up in our process tree
+        enable_child_subreaper()
         kraft_start = time.time()
-        kraft_proc = subprocess.Popen(
-            ["kraft", "run", "--log-level", "debug", "--log-type", "basic", "-p", "11211:11211", "--plat", "qemu", "--arch", "x86_64", "."],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            bufsize=1
-        )
+        kraft_start_ns = time.monotonic_ns()
+        run_id = time.strftime("%Y%m%d-%H%M%S", time.localtime(kraft_start))
+        restore = load_state_file(STATE_FILE) if BOOT_MODE == "snapshot" else None
+        if restore:
+            print(f"Restoring Unikraft unikernel for Memcached from {STATE_FILE}")
+            vm_proc = subprocess.Popen(
+                restore_command(restore, STATE_FILE, HOST_PORT, QMP_SOCKET),
+                cwd=restore["cwd"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                stdin=subprocess.DEVNULL
+            )
+            qemu = from_popen(vm_proc)
+            console = ConsoleReader(vm_proc.stdout, UNIKRAFT_MARKERS, CONSOLE_LOG_FILE)
+            console.start()
+        elif NET_BACKEND == "tap":
+            # kraft cannot set up a vhost-net multiqueue tap, QEMU is started from its recorded command line
+            kraft_cmd = load(os.getcwd(), GUEST_MEM_MB) or learn(os.getcwd(), GUEST_MEM_MB, HOST_PORT, 11211)
+            if not kraft_cmd:
+                buffered_print("Could not record kraft's QEMU command line.")
+                return
+            print(f"Starting Unikraft unikernel for Memcached on a tap device ({NET_QUEUES} queues)")
+            vm_proc = subprocess.Popen(
+                direct_command(kraft_cmd, QMP_SOCKET, network=netdev_args("net0", "tap", queue_count=NET_QUEUES), append=unikraft_ip_args),
+                cwd=kraft_cmd["cwd"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                stdin=subprocess.DEVNULL
+            )
+            qemu = from_popen(vm_proc)
+            console = ConsoleReader(vm_proc.stdout, UNIKRAFT_MARKERS, CONSOLE_LOG_FILE)
+            console.start()
+        else:
+            print("Starting Unikraft unikernel for Memcached")
+            kraft_proc = subprocess.Popen(
+                ["kraft", "run", "--log-level", "debug", "--log-type", "basic", "-p", f"{HOST_PORT}:11211", "-M", f"{GUEST_MEM_MB}M", "--plat", "qemu", "--arch", "x86_64", "."],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT
+            )
+            # keep draining kraft's output, an unread pipe eventually blocks it
+            console = ConsoleReader(kraft_proc.stdout, UNIKRAFT_MARKERS, CONSOLE_LOG_FILE)
+            console.mark("kraft_start", kraft_start_ns)
+            console.start()
 
-        print("Waiting for QEMUUUUUUUU")
-        qemu_proc = find_qemu_proc_by_port("11211")
-        if not qemu_proc:
-            buffered_print("QEMU not found.")
-            kraft_proc.kill()
-            return
+            print("Waiting for QEMUUUUUUUU")
+            qemu = wait_for_qemu_child()
+            if not qemu:
+                buffered_print("QEMU not found.")
+                kraft_proc.kill()
+                return
+            # kept for starting QEMU without kraft later on (tap networking)
+            try:
+                record(os.getcwd(), GUEST_MEM_MB, qemu_cmdline(qemu.pid), os.readlink(f"/proc/{qemu.pid}/cwd"))
+            except OSError as e:
+                buffered_print(f"Could not record kraft's QEMU command line: {e}")
+        buffered_print(f"Boot mode: {'restore' if restore else 'cold'}")
+        buffered_print(f"Network: {NET_BACKEND}, guest at {GUEST_ADDRESS[0]}:{GUEST_ADDRESS[1]}")
 
-        qemu_start = time.time()
-        qemu_pid = qemu_proc.pid
-        buffered_print(f"QEMU started after +{round(qemu_start - kraft_start, 3)}s (PID: {qemu_pid})")
+        qemu_proc = psutil.Process(qemu.pid)
+        qemu_start = qemu.wall_time()
+        console.mark("qemu_exec", qemu.exec_ns)
+        qemu_pid = qemu.pid
+        buffered_print(f"QEMU started after +{round(qemu.seconds_since(kraft_start_ns), 6)}s (PID: {qemu_pid})")
 
         # print("Waiting for Memcached to accept connections")
         # memcached_ready = wait_for_memcached_ready("127.0.0.1", 11211)
@@ -154,29 +268,43 @@ def run_and_monitor_memcached():
         #     )
         #     monitor_thread.start()
         # Start resource monitoring immediately after QEMU is detected
-        start_time = time.time()
+        # one time base for the resource samples and the application stats
+        clock_ns = time.monotonic_ns()
         monitor_thread = threading.Thread(
             target=monitor_resource_usage_live,
-            args=(qemu_proc, usage_log, stop_event),
+            args=(qemu.pid, stop_event, clock_ns),
             daemon=True
         )
         monitor_thread.start()
+        accountant = MemoryAccountant(qemu.pid, GUEST_MEM_MB, MEMORY_INTERVAL, store_path=MEMORY_STORE_FILE)
+        accountant.start()
+        if SCHED_HZ > 0:
+            sched = SchedCollector(qemu.pid, SCHED_HZ, clock_ns, SCHED_STORE_FILE)
+            sched.start()
         buffered_print("Started resource monitoring immediately after QEMU detection.")
 
         # Then wait for Memcached to be ready
         print("Waiting for Memcached to accept connections")
-        memcached_ready = wait_for_memcached_ready("127.0.0.1", 11211)
-        if not memcached_ready:
+        probe = wait_for_memcached_ready(*GUEST_ADDRESS)
+        if probe.ready_ns is None:
             buffered_print("Memcached did not start in time.")
             startup_time = "timeout"
         else:
-            startup_time = round(memcached_ready - qemu_start, 3)
+            milestones = probe.since(qemu.exec_ns)
+            startup_time = round(milestones["ready"], 6)
+            console.mark("first_request", probe.ready_ns)
+            buffered_print(f"Memcached accepted after +{round(milestones['accept'], 6)}s, first byte after +{round(milestones['first_byte'], 6)}s ({probe.attempts} probes)")
+            if BOOT_MODE == "snapshot" and not restore:
+                snapshot_save_s = save_ready_state(qemu.pid)
+            if APP_STATS_HZ > 0:
+                scraper = AppScraper("memcached", *GUEST_ADDRESS, APP_STATS_HZ, clock_ns, APP_STATS_STORE_FILE)
+                scraper.start()
             print(f"Memcached ready after +{startup_time}s")
             buffered_print(f"Memcached startup time {startup_time}s")
 
         print("Memcached is running. Press ctrl+c to stop the unikernel and exit.")
 
-        while kraft_proc.poll() is None:
+        while (kraft_proc or vm_proc).poll() is None:
             time.sleep(1)
 
     except Exception as e:
@@ -0,0 +1,136 @@
+# Adaptive repetitions for A/B platform comparisons.
+#
+# Instead of a fixed number of repetitions run platform by platform, the orchestrator runs one
+# repetition of every platform per round in a freshly shuffled order (ABBA BAAB ...), so thermal
+# and background drift hits both sides alike, and after every round asks this module whether the
+# difference is already known well enough:
+#
+#   resolved  the bootstrap CI of the relative difference of the means is narrower than +-precision
+#   budget    max_runs rounds or budget_s seconds are used up
+#
+# and keeps going otherwise, never stopping before min_runs rounds. A clear-cut, quiet cell stops
+# after min_runs; a noisy one gets up to max_runs. Every decision comes with the Mann-Whitney U
+# p-value, which makes no assumption about the distribution of the runs.
+
+import bisect
+import math
+import random
+import statistics
+
+DEFAULTS = {
+    "metrics": {"nginx": "requests_per_sec", "memcached": "totals_ops_per_sec_steady"},
+    "min_runs": 3,
+    "max_runs": 15,
+    "precision": 0.05,
+    "confidence": 0.95,
+    "resamples": 2000,
+    "budget_s": None,
+    "seed": 0,
+}
+EXACT_LIMIT = 400  # n1 * n2 up to which the Mann-Whitney p-value is computed exactly
+
+
+def bootstrap_relative_difference(a, b, resamples=2000, confidence=0.95, rng=None):
+    # (point, low, high) for mean(b) / mean(a) - 1
+    rng = rng or random.Random(0)
+    point = statistics.fmean(b) / statistics.fmean(a) - 1
+    draws = []
+    for _ in range(resamples):
+        mean_a = statistics.fmean(rng.choices(a, k=len(a)))
+        mean_b = statistics.fmean(rng.choices(b, k=len(b)))
+        if mean_a:
+            draws.append(mean_b / mean_a - 1)
+    draws.sort()
+    alpha = (1 - confidence) / 2
+    low = draws[min(len(draws) - 1, int(alpha * len(draws)))]
+    high = draws[min(len(draws) - 1, int((1 - alpha) * len(draws)))]
+    return point, low, high
+
+
+def u_distribution(n1, n2):
+    # number of rankings giving each U for samples of size n1 and n2 without ties
+    counts = [[[1] + [0] * (n1 * n2) for _ in range(n2 + 1)] for _ in range(n1 + 1)]
+    for i in range(1, n1 + 1):
+        for j in range(1, n2 + 1):
+            for u in range(i * j + 1):
+                # the largest value is either from the first sample (it beats all j of the second) or not
+                counts[i][j][u] = (counts[i - 1][j][u - j] if u >= j else 0) + counts[i][j - 1][u]
+            for u in range(i * j + 1, n1 * n2 + 1):
+                counts[i][j][u] = 0
+    return counts[n1][n2]
+
+
+def mann_whitney(a, b):
+    # (U of a, two-sided p-value)
+    n1, n2 = len(a), len(b)
+    ranked = sorted(b)
+    u = sum(bisect.bisect_left(ranked, x) + 0.5 * (bisect.bisect_right(ranked, x) - bisect.bisect_left(ranked, x)) for x in a)
+    ties = len(set(a) | set(b)) < n1 + n2
+    if not ties and n1 * n2 <= EXACT_LIMIT:
+        counts = u_distribution(n1, n2)
+        total = math.comb(n1 + n2, n1)
+        tail = sum(counts[:int(min(u, n1 * n2 - u)) + 1])
+        return u, min(1.0, 2 * tail / total)
+    values = sorted(a + b)
+    tie_term = sum(t ** 3 - t for t in (values.count(v) for v in set(values)))
+    n = n1 + n2
+    sigma = math.sqrt(n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1))))
+    if not sigma:
+        return u, 1.0
+    z = (abs(u - n1 * n2 / 2) - 0.5) / sigma
+    return u, min(1.0, math.erfc(max(z, 0) / math.sqrt(2)))
+
+
+class ABComparison:
+    # state of one app x level comparison between a baseline platform and the others
+
+    def __init__(self, platforms, settings=None, seed=0):
+        self.settings = dict(DEFAULTS, **(settings or {}))
+        self.platforms = list(platforms)
+        self.values = {platform: [] for platform in self.platforms}
+        self.orders = []
+        self.rng = random.Random(seed)
+        self.decision = None
+
+    def next_order(self):
+        order = self.platforms[:]
+        self.rng.shuffle(order)
+        self.orders.append(order)
+        return order
+
+    def add(self, platform, value):
+        if value is not None:
+            self.values[platform].append(value)
+
+    def summary(self):
+        baseline = self.platforms[0]
+        out = {"baseline": baseline, "values": self.values, "orders": self.orders, "rounds": len(self.orders), "comparisons": {}}
+        for platform in self.platforms[1:]:
+            a, b = self.values[baseline], self.values[platform]
+            if len(a) < 2 or len(b) < 2:
+                continue
+            point, low, high = bootstrap_relative_difference(a, b, self.settings["resamples"], self.settings["confidence"],
+                                                             random.Random(self.settings["seed"]))
+            u, p = mann_whitney(a, b)
+            out["comparisons"][platform] = {
+                "relative_difference": point, "ci_low": low, "ci_high": high,
+                "mann_whitney_u": u, "p_value": p,
+                "mean": statistics.fmean(b), "baseline_mean": statistics.fmean(a),
+            }
+        if self.decision:
+            out["decision"] = self.decision
+        return out
+
+    def decide(self, elapsed_s):
+        # None to keep going, otherwise the reason to stop
+        s = self.settings
+        rounds = min(len(v) for v in self.values.values())
+        if rounds >= s["max_runs"] or len(self.orders) >= s["max_runs"] * 2:
+            self.decision = "budget"
+        elif s["budget_s"] is not None and elapsed_s >= s["budget_s"]:
+            self.decision = "budget"
+        elif rounds >= s["min_runs"]:
+            comparisons = self.summary()["comparisons"]
+            if comparisons and all((c["ci_high"] - c["ci_low"]) / 2 <= s["precision"] for c in comparisons.values()):
+                self.decision = "resolved"
+        return self.decision
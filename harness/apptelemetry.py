@@ -0,0 +1,194 @@
+# Application telemetry: what memcached and nginx report about themselves during a run.
+#
+# A scraper thread keeps one dedicated connection to the guest's application and polls it at a
+# low, configurable rate (APP_STATS_HZ, 1 Hz by default):
+#
+#   memcached  "stats" and "stats slabs": connections, gets/sets, hits/misses, evictions, items,
+#              bytes, rusage of the server
+#   nginx      the stub_status page (APP_STATUS_PATH, /nginx_status by default), which the nginx
+#              configuration of the guest has to serve: location = /nginx_status { stub_status; }
+#
+# Samples carry the same time base as the resource sampler (seconds since start_ns) and are only
+# streamed to a metrics store file; the CSV log for resultsdb.py is read back from it at the end,
+# and the report needs nothing but the first and the last sample. The scraper's own
+# connection is included in the connection counts of both servers. Counters that a server does
+# not report are NaN; an nginx without stub_status is noted once and no longer polled.
+
+import csv
+import math
+import os
+import socket
+import threading
+import time
+
+from metricstore import MetricsWriter, stored_rows
+
+MEMCACHED_STATS = [
+    "curr_connections", "total_connections", "rejected_connections", "connection_structures",
+    "cmd_get", "cmd_set", "get_hits", "get_misses", "evictions", "curr_items", "bytes",
+    "bytes_read", "bytes_written", "rusage_user", "rusage_system", "threads", "listen_disabled_num",
+]
+MEMCACHED_SLABS = ["active_slabs", "total_malloced"]
+NGINX_STATS = ["active", "accepts", "handled", "requests", "reading", "writing", "waiting"]
+COLUMNS = {
+    "memcached": ["t"] + MEMCACHED_STATS + MEMCACHED_SLABS,
+    "nginx": ["t"] + NGINX_STATS,
+}
+# monotonic counters, reported as their increase over the run
+COUNTERS = {
+    "memcached": ["total_connections", "rejected_connections", "cmd_get", "cmd_set", "get_hits", "get_misses",
+                  "evictions", "bytes_read", "bytes_written", "rusage_user", "rusage_system", "listen_disabled_num"],
+    "nginx": ["accepts", "handled", "requests"],
+}
+STATUS_PATH = os.environ.get("APP_STATUS_PATH", "/nginx_status")
+
+
+def parse_memcached_stats(text):
+    stats = {}
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) == 3 and parts[0] == "STAT":
+            try:
+                stats[parts[1]] = float(parts[2])
+            except ValueError:
+                pass
+    return stats
+
+
+def parse_stub_status(text):
+    # Active connections: 2 / server accepts handled requests / 16 16 31 / Reading: 0 Writing: 1 Waiting: 1
+    lines = [line.split() for line in text.strip().splitlines()]
+    stats = {"active": float(lines[0][2])}
+    stats.update(zip(("accepts", "handled", "requests"), map(float, lines[2][:3])))
+    fields = lines[3]
+    for i in range(0, len(fields) - 1, 2):
+        stats[fields[i].rstrip(":").lower()] = float(fields[i + 1])
+    return stats
+
+
+class AppScraper(threading.Thread):
+    def __init__(self, app, host, port, hz=1.0, start_ns=None, store_path=None):
+        super().__init__(daemon=True)
+        self.app = app
+        self.host = host
+        self.port = port
+        self.interval = 1 / hz
+        self.start_ns = start_ns or time.monotonic_ns()
+        self.store_path = store_path
+        self.columns = COLUMNS[app]
+        self.stop_event = threading.Event()
+        self.count = 0
+        self.first = self.last = None
+        self.sock = None
+        self.reader = None
+        self.unavailable = None
+
+    def _connect(self):
+        self.sock = socket.create_connection((self.host, self.port), timeout=2)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile("rb")
+
+    def _close(self):
+        for handle in (self.reader, self.sock):
+            if handle:
+                handle.close()
+        self.sock = self.reader = None
+
+    def _memcached(self, command):
+        self.sock.sendall(command + b"\r\n")
+        lines = []
+        while True:
+            line = self.reader.readline()
+            if not line:
+                raise ConnectionError("memcached closed the stats connection")
+            if line.startswith(b"END") or line.startswith(b"ERROR"):
+                break
+            lines.append(line.decode(errors="replace"))
+        return parse_memcached_stats("".join(lines))
+
+    def _nginx(self):
+        self.sock.sendall(f"GET {STATUS_PATH} HTTP/1.1\r\nHost: {self.host}\r\n\r\n".encode())
+        status = self.reader.readline().split()
+        length = 0
+        while True:
+            line = self.reader.readline()
+            if not line:
+                raise ConnectionError("nginx closed the status connection")
+            if line in (b"\r\n", b"\n"):
+                break
+            name, _, value = line.decode(errors="replace").partition(":")
+            if name.strip().lower() == "content-length":
+                length = int(value.strip())
+        body = self.reader.read(length).decode(errors="replace")
+        if len(status) < 2 or status[1] != b"200":
+            self.unavailable = f"{STATUS_PATH} answered {status[1].decode() if len(status) > 1 else 'nothing'}"
+            return None
+        return parse_stub_status(body)
+
+    def scrape(self):
+        if not self.sock:
+            self._connect()
+        if self.app == "memcached":
+            stats = self._memcached(b"stats")
+            stats.update(self._memcached(b"stats slabs"))
+            return stats
+        return self._nginx()
+
+    def run(self):
+        store = None
+        if self.store_path:
+            if os.path.exists(self.store_path):
+                os.remove(self.store_path)
+            store = MetricsWriter(self.store_path, self.columns, flush_records=1)
+        while not self.stop_event.is_set() and not self.unavailable:
+            try:
+                stats = self.scrape()
+            except (OSError, ValueError, IndexError):
+                self._close()  # reconnected on the next poll
+                stats = None
+            if stats:
+                stats["t"] = (time.monotonic_ns() - self.start_ns) / 1e9
+                row = [stats.get(name, math.nan) for name in self.columns]
+                self.count += 1
+                self.first = self.first or row
+                self.last = row
+                if store:
+                    store.append(row)
+            self.stop_event.wait(self.interval)
+        self._close()
+        if store:
+            store.close()
+
+    def stop(self, timeout=5):
+        self.stop_event.set()
+        self.join(timeout)
+
+    def write_log(self, path):
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(self.columns)
+            for row in stored_rows(self.store_path):
+                writer.writerow(["" if math.isnan(value) else round(value, 6) for value in row])
+
+    def deltas(self):
+        # increase of every counter between the first and the last sample
+        if self.count < 2:
+            return {}
+        first, last = self.first, self.last
+        index = {name: i for i, name in enumerate(self.columns)}
+        return {name: last[index[name]] - first[index[name]] for name in COUNTERS[self.app]
+                if not (math.isnan(first[index[name]]) or math.isnan(last[index[name]]))}
+
+    def report(self):
+        if self.unavailable:
+            return f"App stats: {self.unavailable}, not polled"
+        deltas = self.deltas()
+        if not deltas:
+            return f"App stats: {self.count} samples"
+        if self.app == "memcached":
+            lookups = deltas.get("get_hits", 0) + deltas.get("get_misses", 0)
+            ratio = f"{deltas['get_hits'] / lookups:.1%}" if lookups else "-"
+            return (f"App stats: {int(deltas.get('cmd_get', 0))} gets (hit ratio {ratio}), "
+                    f"{int(deltas.get('evictions', 0))} evictions, {int(deltas.get('total_connections', 0))} connections opened")
+        return (f"App stats: {int(deltas.get('accepts', 0))} connections accepted, {int(deltas.get('handled', 0))} handled, "
+                f"{int(deltas.get('requests', 0))} requests")
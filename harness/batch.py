@@ -0,0 +1,250 @@
+# Batch runner for the compute benchmarks (fibonacci): one boot runs every input of a batch.
+#
+# The inputs and the number of iterations go to the guest program as arguments, fibonacci
+# [-i iterations] [n ...]:
+#
+#   unikraft  on the kernel command line, kraft run . -- -i 5 5 30 50
+#   ubuntu    in a fw_cfg blob (opt/ueval/args). The seed ISO carries a static build of
+#             linux_scripts/fibonacci/fibonacci.c, and its runcmd passes the blob to it, writes
+#             to the serial console and powers the VM off
+#
+# The serial console is read as it streams. Every "Elapsed time: <ns> ns" line is attributed to
+# the n of the "Fibonacci of <n>:" line before it and handed to on_result right away. The VM is
+# shut down once the program prints "Batch done", or when the batch times out. Unikraft's
+# uk_pr_info copy of each result carries a log prefix and is not counted twice.
+#
+# Several batches run in parallel VMs, each on its own CPUs when given:
+#
+#   python3 harness/batch.py unikraft ~/unikraft-apps/fibonacci 5 30 50 --iterations 10 --batches 4 \
+#       --out results/fibonacci/metadata
+
+import argparse
+import base64
+import os
+import re
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from overlay import discard, seed_iso, take
+from proctree import descendants, proc_comm
+
+HARNESS_DIR = os.path.dirname(os.path.abspath(__file__))
+UBUNTU_SOURCE = os.path.join(HARNESS_DIR, "..", "linux_scripts", "fibonacci", "fibonacci.c")
+FW_CFG_NAME = "opt/ueval/args"
+GUEST_MEM_MB = 128
+DEFAULT_TIMEOUT = 3600
+# seconds between "Batch done" and pulling the plug, Ubuntu powers itself off
+SHUTDOWN_GRACE = {"unikraft": 1, "ubuntu": 60}
+
+HEADER_RE = re.compile(r"^Fib+onacci of (\d+):")
+ELAPSED_RE = re.compile(r"^Elapsed time:\s+(\d+)\s+n")
+DONE_RE = re.compile(r"^Batch done")
+ANSI_RE = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]")
+seed_lock = threading.Lock()
+
+USER_DATA = """#cloud-config
+write_files:
+  - path: /usr/local/bin/fibonacci
+    permissions: '0755'
+    encoding: b64
+    content: {binary}
+
+runcmd:
+  - [sh, -c, 'modprobe qemu_fw_cfg; /usr/local/bin/fibonacci $(cat /sys/firmware/qemu_fw_cfg/by_name/{fw_cfg}/raw) > /dev/ttyS0 2>&1; poweroff']
+"""
+
+
+def program_args(inputs, iterations):
+    return ["-i", str(iterations)] + [str(n) for n in inputs]
+
+
+def ubuntu_seed(app_dir):
+    # the seed ISO with a static build of fibonacci.c, rebuilt when the source changes; parallel
+    # batches of one app directory share it
+    cache = os.path.join(os.path.abspath(app_dir), ".batch")
+    binary = os.path.join(cache, "fibonacci")
+    user_data = os.path.join(cache, "user-data")
+    with seed_lock:
+        os.makedirs(cache, exist_ok=True)
+        if not os.path.exists(binary) or os.path.getmtime(binary) < os.path.getmtime(UBUNTU_SOURCE):
+            partial = f"{binary}.{os.getpid()}.partial"
+            subprocess.run(["gcc", "-O2", "-static", "-o", partial, UBUNTU_SOURCE], check=True, capture_output=True, timeout=120)
+            os.replace(partial, binary)
+        with open(binary, "rb") as f:
+            content = USER_DATA.format(binary=base64.b64encode(f.read()).decode(), fw_cfg=FW_CFG_NAME)
+        # rewritten only when it changed, seed_iso() caches the ISO by content
+        previous = None
+        if os.path.exists(user_data):
+            with open(user_data) as f:
+                previous = f.read()
+        if previous != content:
+            with open(f"{user_data}.{os.getpid()}.partial", "w") as f:
+                f.write(content)
+            os.replace(f"{user_data}.{os.getpid()}.partial", user_data)
+        return seed_iso(user_data)
+
+
+class Batch:
+    def __init__(self, platform, app_dir, inputs, iterations=1, cpus=None, mem_mb=GUEST_MEM_MB, console_log=None,
+                 on_result=None):
+        self.platform = platform
+        self.app_dir = os.path.abspath(os.path.expanduser(app_dir))
+        self.inputs = list(inputs)
+        self.iterations = iterations
+        self.cpus = cpus
+        self.mem_mb = mem_mb
+        self.console_log = console_log
+        self.on_result = on_result
+        self.results = []
+        self.done = False
+        self.timed_out = False
+        self.proc = None
+        self.disk = None
+        self.started = None
+        self.lock = threading.Lock()
+
+    @property
+    def complete(self):
+        return self.done and len(self.results) == len(self.inputs) * self.iterations
+
+    def command(self, work_dir):
+        args = program_args(self.inputs, self.iterations)
+        if self.platform == "unikraft":
+            return ["kraft", "run", "-M", f"{self.mem_mb}M", "--plat", "qemu", "--arch", "x86_64", ".", "--"] + args
+        self.disk, _ = take(os.path.join(self.app_dir, "ubuntu.qcow2"), os.path.join(work_dir, "disk.qcow2"))
+        return [
+            "qemu-system-x86_64",
+            "-m", f"{self.mem_mb}M",
+            "-smp", "cpus=1,threads=1,sockets=1",
+            "-cpu", "host,+x2apic,-pmu",
+            "-name", "ubuntu,debug-threads=on",
+            "-netdev", "user,id=net0",
+            "-device", "virtio-net-pci,netdev=net0",
+            "-drive", f"file={self.disk},format=qcow2,id=disk0",
+            "-cdrom", ubuntu_seed(self.app_dir),
+            "-fw_cfg", f"name={FW_CFG_NAME},string={' '.join(args)}",
+            "-enable-kvm",
+            "-nographic",
+            "-serial", "mon:stdio",
+        ]
+
+    def _preexec(self):
+        os.setsid()
+        if self.cpus:
+            os.sched_setaffinity(0, self.cpus)
+
+    def run(self, timeout=DEFAULT_TIMEOUT):
+        with tempfile.TemporaryDirectory(prefix=f"batch_{self.platform}_") as work_dir:
+            self.started = time.monotonic()
+            self.proc = subprocess.Popen(self.command(work_dir), cwd=self.app_dir, stdin=subprocess.DEVNULL,
+                                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT, preexec_fn=self._preexec)
+            timers = [threading.Timer(timeout, self._expire)]
+            timers[0].start()
+            log_file = open(self.console_log, "w", buffering=1) if self.console_log else None
+            current = None
+            try:
+                for raw in iter(self.proc.stdout.readline, b""):
+                    line = ANSI_RE.sub("", raw.decode(errors="replace")).strip()
+                    if log_file:
+                        log_file.write(f"{time.monotonic_ns()} {line}\n")
+                    match = HEADER_RE.match(line)
+                    if match:
+                        current = int(match.group(1))
+                        continue
+                    match = ELAPSED_RE.match(line)
+                    if match and current is not None:
+                        self.results.append((current, int(match.group(1))))
+                        if self.on_result:
+                            self.on_result(current, int(match.group(1)))
+                        current = None
+                    elif DONE_RE.match(line) and not self.done:
+                        self.done = True
+                        timers.append(threading.Timer(SHUTDOWN_GRACE[self.platform], self.stop))
+                        timers[-1].start()
+            finally:
+                for timer in timers:
+                    timer.cancel()
+                if log_file:
+                    log_file.close()
+                self.stop()
+                discard(self.disk)
+        return self.results
+
+    def _expire(self):
+        self.timed_out = True
+        self.stop()
+
+    def stop(self):
+        # the QEMU (kraft's child, or ours) and everything else in the session we started
+        with self.lock:
+            if not self.proc or self.proc.poll() is not None:
+                return
+            for pid in descendants(self.proc.pid):
+                if proc_comm(pid).startswith("qemu-system"):
+                    try:
+                        os.kill(pid, signal.SIGTERM)
+                    except ProcessLookupError:
+                        pass
+            try:
+                os.killpg(self.proc.pid, signal.SIGTERM)
+                self.proc.wait(timeout=10)
+            except ProcessLookupError:
+                pass
+            except subprocess.TimeoutExpired:
+                os.killpg(self.proc.pid, signal.SIGKILL)
+                self.proc.wait()
+
+
+def run_batches(batches, parallel=None, timeout=DEFAULT_TIMEOUT):
+    # every batch in a VM of its own, at most `parallel` at a time
+    with ThreadPoolExecutor(max_workers=parallel or len(batches)) as pool:
+        list(pool.map(lambda batch: batch.run(timeout), batches))
+    return batches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run fibonacci inputs in batches, one boot per batch")
+    parser.add_argument("platform", choices=("unikraft", "ubuntu"))
+    parser.add_argument("app_dir", help="kraft project (unikraft) or directory with ubuntu.qcow2 (ubuntu)")
+    parser.add_argument("inputs", nargs="+", type=int)
+    parser.add_argument("--iterations", type=int, default=1, help="runs of every input in each batch")
+    parser.add_argument("--batches", type=int, default=1, help="VMs, each running all inputs")
+    parser.add_argument("--parallel", type=int, default=0, help="VMs at a time, 0 = all batches at once")
+    parser.add_argument("--cpus", type=int, default=1, help="CPUs each VM is pinned to, 0 = no pinning")
+    parser.add_argument("--mem", type=int, default=GUEST_MEM_MB, help="guest memory in MB")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="seconds per batch")
+    parser.add_argument("--out", help="append results to fibonacci_<n>_<platform>.txt in this directory")
+    args = parser.parse_args()
+
+    lock = threading.Lock()
+
+    def record(index):
+        def on_result(n, elapsed_ns):
+            with lock:
+                print(f"batch {index}: n={n} {elapsed_ns} ns", flush=True)
+                if args.out:
+                    with open(os.path.join(args.out, f"fibonacci_{n}_{args.platform}.txt"), "a") as f:
+                        f.write(f"Elapsed time: {elapsed_ns} ns\n")
+        return on_result
+
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+    cpus = sorted(os.sched_getaffinity(0))
+    batches = []
+    for i in range(args.batches):
+        pinned = [cpus[(i * args.cpus + k) % len(cpus)] for k in range(args.cpus)] if args.cpus else None
+        batches.append(Batch(args.platform, args.app_dir, args.inputs, args.iterations, pinned, args.mem, on_result=record(i)))
+    start = time.time()
+    run_batches(batches, args.parallel or None, args.timeout)
+    for i, batch in enumerate(batches):
+        state = "complete" if batch.complete else "timed out" if batch.timed_out else "incomplete"
+        print(f"batch {i}: {len(batch.results)}/{len(args.inputs) * args.iterations} results, {state}")
+    print(f"{len(batches)} batch(es) in {time.time() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
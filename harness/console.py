@@ -0,0 +1,106 @@
+# Streams the kraft / QEMU serial console while the VM runs, timestamps every line with the
+# monotonic clock as it arrives and turns known boot markers into a phase timeline.
+#
+# Draining the pipe continuously also matters on its own: an unread stdout=PIPE eventually fills
+# up and blocks kraft (and the guest console behind it).
+
+import csv
+import os
+import re
+import threading
+import time
+
+# (milestone, regex) in boot order; the phase that starts at a milestone is named in *_PHASES.
+# kraft echoes its QEMU command line (9pfs, netdev, ...) before the guest runs, so a marker only
+# counts once it shows up after the QEMU exec.
+UNIKRAFT_MARKERS = [
+    ("firmware", re.compile(r"SeaBIOS|Booting from ROM|iPXE")),
+    ("ukplat", re.compile(r"libkvmplat|libukplat|ukplat|libukboot")),
+    ("netdev", re.compile(r"en\d+: (?:Added|Interface is up)|libuknetdev|liblwip")),
+    ("rootfs", re.compile(r"9pfs|lib9pfs|libvfscore|[Mm]ount")),
+    ("app_main", re.compile(r"Powered by|Unikraft\s+\S+\s+\d")),
+]
+UNIKRAFT_PHASES = {
+    "kraft_start": "kraft_cli",
+    "qemu_exec": "qemu_init",
+    "firmware": "firmware",
+    "ukplat": "ukplat_init",
+    "netdev": "netdev_up",
+    "rootfs": "9pfs_mount",
+    "app_main": "app_main",
+}
+
+UBUNTU_MARKERS = [
+    ("firmware", re.compile(r"SeaBIOS|Booting from")),
+    ("kernel", re.compile(r"Linux version|\[\s*0\.000000\]")),
+    ("userspace", re.compile(r"Run /init|Freeing unused kernel|systemd\[1\]|Welcome to")),
+    ("network", re.compile(r"Reached target .*Network|systemd-networkd|cloud-init.*init-local")),
+    ("app_main", re.compile(r"Started .*(?:nginx|memcached|web server|memory object cache)")),
+]
+UBUNTU_PHASES = {
+    "qemu_exec": "qemu_init",
+    "firmware": "firmware",
+    "kernel": "kernel_init",
+    "userspace": "userspace_init",
+    "network": "network_up",
+    "app_main": "app_main",
+}
+
+MAX_HITS = 8
+BOOT_PHASES_HEADER = ["Run", "Platform", "App", "Phase", "Start (s)", "Duration (s)"]
+
+
+class ConsoleReader(threading.Thread):
+    def __init__(self, stream, markers, log_path=None):
+        super().__init__(daemon=True)
+        self.stream = stream
+        self.markers = markers
+        self.milestones = {}
+        self.hits = {name: [] for name, _ in markers}
+        self.lock = threading.Lock()
+        self.log_file = open(log_path, "w", buffering=1) if log_path else None
+
+    def run(self):
+        for raw in iter(self.stream.readline, b""):
+            ns = time.monotonic_ns()
+            line = raw.decode(errors="replace").rstrip()
+            if self.log_file:
+                self.log_file.write(f"{ns} {line}\n")
+            for name, pattern in self.markers:
+                hits = self.hits[name]
+                if len(hits) < MAX_HITS and pattern.search(line):
+                    with self.lock:
+                        hits.append(ns)
+        if self.log_file:
+            self.log_file.close()
+
+    def mark(self, name, ns):
+        with self.lock:
+            self.milestones.setdefault(name, ns)
+
+    def phases(self, phase_names, end="first_request"):
+        # consecutive milestones in time order; each interval is named after the phase its start opens
+        with self.lock:
+            points = dict(self.milestones)
+            gate = points.get("qemu_exec", 0)
+            for name, hits in self.hits.items():
+                after = [ns for ns in hits if ns >= gate]
+                if after and name not in points:
+                    points[name] = after[0]
+        points = sorted(points.items(), key=lambda item: item[1])
+        timeline = []
+        for (name, start_ns), (_, end_ns) in zip(points, points[1:]):
+            if name == end:
+                break
+            timeline.append((phase_names.get(name, name), start_ns, end_ns - start_ns))
+        return timeline
+
+
+def write_boot_phases(path, run_id, platform, app, timeline, origin_ns):
+    file_exists = os.path.exists(path)
+    with open(path, "a", newline="") as f:
+        writer = csv.writer(f)
+        if not file_exists:
+            writer.writerow(BOOT_PHASES_HEADER)
+        for phase, start_ns, duration_ns in timeline:
+            writer.writerow([run_id, platform, app, phase, round((start_ns - origin_ns) / 1e9, 6), round(duration_ns / 1e9, 6)])
@@ -0,0 +1,277 @@
+# Density: how many instances of one app fit on this host.
+#
+# One asyncio supervisor launches instances side by side, every one on a port of its own, and
+# ramps their number (1, 2, 4, ... by default) while keeping the earlier ones running. For every
+# step it records the boot times of the instances it just started (launch to the first valid
+# application reply, probe.py), the memory footprint of every QEMU (memacct.py) and the host's
+# available memory, and it stops as soon as the boot-time p99 of a step or the host memory
+# crosses its threshold, or instances fail to come up. The largest step that stayed within the
+# thresholds is the maximum number of instances per host.
+#
+#   python3 harness/density.py nginx unikraft --app-dir ~/unikraft-apps/nginx --max-boot-p99 2
+#   python3 harness/density.py nginx ubuntu --app-dir ~/ubuntu-vms/nginx --max 64
+#
+# Unikraft instances are started with kraft run, Ubuntu VMs with QEMU directly, each on its own
+# overlay of ubuntu.qcow2 (overlay.py). The result goes to results/density/ as JSON.
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import time
+
+from memacct import memory_sample
+from overlay import seed_for, take
+from probe import wait_until_ready_async
+from proctree import QemuHandle, descendants, enable_child_subreaper, proc_comm
+from runmeta import host_fingerprint, qemu_cmdline
+
+HARNESS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_OUT = os.path.join(HARNESS_DIR, "..", "results", "density")
+GUEST_PORTS = {"nginx": 80, "memcached": 11211}
+PROTOCOLS = {"nginx": "http", "memcached": "memcached"}
+BASE_PORTS = {"nginx": 20000, "memcached": 30000}
+DEFAULT_MEM_MB = {"unikraft": 64, "ubuntu": 128}
+
+
+def percentile(values, q):
+    # nearest rank
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))]
+
+
+def mem_available_kb():
+    with open("/proc/meminfo") as f:
+        fields = {line.split(":")[0]: int(line.split()[1]) for line in f}
+    return fields["MemAvailable"], fields["MemTotal"]
+
+
+def port_free(port):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        try:
+            sock.bind(("127.0.0.1", port))
+            return True
+        except OSError:
+            return False
+
+
+class Ports:
+    def __init__(self, base):
+        self.next = base
+
+    def allocate(self):
+        while not port_free(self.next):
+            self.next += 1
+        self.next += 1
+        return self.next - 1
+
+
+class Instance:
+    def __init__(self, index, port):
+        self.index = index
+        self.port = port
+        self.proc = None
+        self.qemu = None
+        self.disk = None
+        self.boot_s = None
+        self.memory = None
+
+
+class Density:
+    def __init__(self, args):
+        self.args = args
+        self.ports = Ports(args.base_port or BASE_PORTS[args.app])
+        self.work_dir = tempfile.mkdtemp(prefix=f"density_{args.app}_{args.platform}_")
+        self.instances = []
+        self.seed = seed_for(args.app_dir) if args.platform == "ubuntu" else None
+
+    def command(self, instance):
+        a = self.args
+        if a.platform == "unikraft":
+            return ["kraft", "run", "-p", f"{instance.port}:{GUEST_PORTS[a.app]}", "-M", f"{a.mem}M",
+                    "--plat", "qemu", "--arch", "x86_64", "."]
+        return [
+            "qemu-system-x86_64",
+            "-m", f"{a.mem}M",
+            "-smp", "cpus=1,threads=1,sockets=1",
+            "-cpu", "host,+x2apic,-pmu",
+            "-netdev", f"user,id=net0,hostfwd=tcp::{instance.port}-:{GUEST_PORTS[a.app]}",
+            "-device", "virtio-net-pci,netdev=net0",
+            "-drive", f"file={instance.disk},format=qcow2",
+            "-cdrom", self.seed,
+            "-enable-kvm",
+            "-display", "none",
+            "-serial", "null",
+        ]
+
+    async def find_qemu(self, instance, timeout):
+        # kraft's QEMU may daemonize; as subreaper it stays below us, recognised by its port
+        deadline = time.monotonic() + timeout
+        forward = f":{instance.port}-"
+        while time.monotonic() < deadline:
+            for pid in descendants(os.getpid()):
+                if proc_comm(pid).startswith("qemu-system"):
+                    try:
+                        if any(forward in arg for arg in qemu_cmdline(pid)):
+                            return QemuHandle(pid, time.monotonic_ns())
+                    except OSError:
+                        pass
+            await asyncio.sleep(0.01)
+        return None
+
+    async def launch(self, index):
+        a = self.args
+        instance = Instance(index, self.ports.allocate())
+        self.instances.append(instance)
+        if a.platform == "ubuntu":
+            instance.disk, _ = await asyncio.to_thread(take, os.path.join(a.app_dir, "ubuntu.qcow2"),
+                                                       os.path.join(self.work_dir, f"disk_{index}.qcow2"), 0)
+        start_ns = time.monotonic_ns()
+        instance.proc = await asyncio.create_subprocess_exec(
+            *self.command(instance), cwd=a.app_dir,
+            stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+        if a.platform == "ubuntu":
+            instance.qemu = QemuHandle(instance.proc.pid, start_ns)
+        probe = asyncio.ensure_future(wait_until_ready_async("127.0.0.1", instance.port, PROTOCOLS[a.app], a.ready_timeout))
+        if a.platform == "unikraft":
+            instance.qemu = await self.find_qemu(instance, a.ready_timeout)
+        result = await probe
+        if result.ready_ns is not None:
+            instance.boot_s = (result.ready_ns - start_ns) / 1e9
+        return instance
+
+    async def footprints(self, instances):
+        # PSS and QEMU overhead of every instance once it settled
+        for instance in instances:
+            if instance.qemu:
+                try:
+                    instance.memory = await asyncio.to_thread(memory_sample, instance.qemu.pid, self.args.mem * 1024)
+                except OSError:
+                    instance.memory = None
+
+    async def step(self, target):
+        new = await asyncio.gather(*(self.launch(i) for i in range(len(self.instances), target)))
+        await asyncio.sleep(self.args.settle)
+        await self.footprints(self.instances)
+        available, total = mem_available_kb()
+        boots = [i.boot_s for i in new if i.boot_s is not None]
+        pss = [i.memory["pss"] for i in self.instances if i.memory]
+        overhead = [i.memory["overhead"] for i in self.instances if i.memory]
+        return {
+            "instances": target,
+            "started": len(new),
+            "failed": len(new) - len(boots),
+            "boot_s": boots,
+            "boot_p50_s": percentile(boots, 50) if boots else None,
+            "boot_p99_s": percentile(boots, 99) if boots else None,
+            "boot_max_s": max(boots) if boots else None,
+            "pss_kb_mean": statistics.fmean(pss) if pss else None,
+            "pss_kb_total": sum(pss),
+            "qemu_overhead_kb_mean": statistics.fmean(overhead) if overhead else None,
+            "mem_available_kb": available,
+            "mem_total_kb": total,
+        }
+
+    def verdict(self, step):
+        a = self.args
+        if step["failed"]:
+            return f"{step['failed']} instance(s) did not become ready"
+        if step["boot_p99_s"] is not None and step["boot_p99_s"] > a.max_boot_p99:
+            return f"boot p99 {step['boot_p99_s']:.3f}s above {a.max_boot_p99}s"
+        if step["mem_available_kb"] < a.min_available * step["mem_total_kb"]:
+            return f"available memory below {a.min_available:.0%} of the host"
+        return None
+
+    async def stop(self, instance):
+        if instance.proc and instance.proc.returncode is None:
+            instance.proc.terminate()
+        if instance.qemu:
+            await asyncio.to_thread(instance.qemu.terminate)
+            if self.args.platform == "unikraft":
+                try:
+                    os.waitpid(instance.qemu.pid, os.WNOHANG)  # a QEMU that left kraft is our child now
+                except ChildProcessError:
+                    pass
+            instance.qemu.close()
+        if instance.proc:
+            try:
+                await asyncio.wait_for(instance.proc.wait(), 10)
+            except asyncio.TimeoutError:
+                instance.proc.kill()
+
+    async def run(self):
+        a = self.args
+        steps, limit, reason, target = [], 0, None, a.start
+        try:
+            while True:
+                step = await self.step(target)
+                reason = self.verdict(step)
+                steps.append(step)
+                print(f"{step['instances']:>5} instances  boot p50 {fmt(step['boot_p50_s'])}s p99 {fmt(step['boot_p99_s'])}s  "
+                      f"PSS/instance {fmt(step['pss_kb_mean'], 0)} KB  available {step['mem_available_kb'] // 1024} MB"
+                      + (f"  -> {reason}" if reason else ""), flush=True)
+                if reason:
+                    break
+                limit = target
+                if target >= a.max:
+                    reason = f"reached --max {a.max}"
+                    break
+                target = min(a.max, max(target + 1, int(target * a.growth)))
+        finally:
+            await asyncio.gather(*(self.stop(i) for i in self.instances))
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+        return {
+            "app": a.app,
+            "platform": a.platform,
+            "app_dir": a.app_dir,
+            "memory_mb": a.mem,
+            "thresholds": {"max_boot_p99_s": a.max_boot_p99, "min_available": a.min_available},
+            "max_instances": limit,
+            "stopped": reason,
+            "steps": steps,
+            "host": host_fingerprint(),
+        }
+
+
+def fmt(value, digits=3):
+    return "-" if value is None else f"{value:.{digits}f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Launch instances side by side until boot time or host memory gives out")
+    parser.add_argument("app", choices=sorted(GUEST_PORTS))
+    parser.add_argument("platform", choices=sorted(DEFAULT_MEM_MB))
+    parser.add_argument("--app-dir", default=".", help="kraft app directory, or the folder holding ubuntu.qcow2")
+    parser.add_argument("--mem", type=int, help="guest memory in MB (64 for unikraft, 128 for ubuntu)")
+    parser.add_argument("--start", type=int, default=1, help="instances in the first step")
+    parser.add_argument("--growth", type=float, default=2.0, help="factor from one step to the next")
+    parser.add_argument("--max", type=int, default=1024, help="never launch more instances than this")
+    parser.add_argument("--max-boot-p99", type=float, default=5.0, help="stop once a step's boot p99 exceeds this (s)")
+    parser.add_argument("--min-available", type=float, default=0.1,
+                        help="stop once available host memory drops below this fraction of the total")
+    parser.add_argument("--ready-timeout", type=float, default=60)
+    parser.add_argument("--settle", type=float, default=2, help="seconds between a step's boots and its memory reading")
+    parser.add_argument("--base-port", type=int, help="first host port to forward (20000 for nginx, 30000 for memcached)")
+    parser.add_argument("--out", default=DEFAULT_OUT)
+    args = parser.parse_args()
+    args.app_dir = os.path.abspath(os.path.expanduser(args.app_dir))
+    args.mem = args.mem or DEFAULT_MEM_MB[args.platform]
+
+    enable_child_subreaper()
+    result = asyncio.run(Density(args).run())
+    print(f"max instances per host: {result['max_instances']} ({result['stopped']})")
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"density_{args.app}_{args.platform}_{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"written to {path}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,388 @@
+# Static file serving by nginx over the root filesystem backends of the unikernel, against Ubuntu.
+#
+# nginx_manual serves its content from 9pfs, so every static file request crosses the 9p protocol
+# to the host. This script compares that with the other ways the same nginx kernel can get its
+# root filesystem, and with Ubuntu serving the same files:
+#
+#   9pfs      the document root directory shared over virtio-9p, as start_nginx.sh does
+#   initrd    the document root as a newc cpio, loaded with -initrd and extracted into ramfs
+#   blk       the document root in an ext2 image on virtio-blk, read through lwext4
+#   ubuntu    linux_scripts/nginx/nginx.py with the same files in an ext2 image on a second
+#             virtio-blk disk, mounted by cloud-init at /var/www/html/sweep
+#
+# build merges nginx_manual/fsbench.config over nginx_manual/.config and builds a single kernel
+# into nginx_manual/build-fsbench. That kernel picks its backend at boot from vfs.fstab on the
+# command line. run generates a document root per file count, with that many files of every size
+# under /sweep/<size>/ (capped at --max-bytes per size). It boots every backend once per document
+# root and drives httpload over all files of one size at a time. Results go to
+# results/nginx_fs/<backend>_<count>/fs_<backend>_<count>_run_<size>_<rep>.json, which resultsdb.py
+# loads as app nginx_fs with the file size as level.
+#
+#   python3 harness/fsbench.py build
+#   python3 harness/fsbench.py run --sizes 1K 10K 100K 1M 10M --counts 1 100 --ubuntu-dir ~/ubuntu-vms/nginx
+
+import argparse
+import http.client
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from console import ConsoleReader, UNIKRAFT_MARKERS
+from orchestrator import HARNESS_SCRIPTS, HarnessRun
+from overlay import user_data_path
+from probe import wait_until_ready
+from proctree import from_popen
+
+HARNESS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(HARNESS_DIR)
+NGINX_DIR = os.path.join(REPO_ROOT, "nginx_manual")
+CONFIG_FRAGMENT = os.path.join(NGINX_DIR, "fsbench.config")
+BUILD_DIR = os.path.join(NGINX_DIR, "build-fsbench")
+KERNEL = os.path.join(BUILD_DIR, "nginx_qemu-x86_64")
+DEFAULT_ROOTFS = os.path.join(NGINX_DIR, "fs0")
+DEFAULT_RESULTS = os.path.join(REPO_ROOT, "results", "nginx_fs")
+
+BACKENDS = ("9pfs", "initrd", "blk", "ubuntu")
+# vfs.fstab entry of each backend: device, mount point, driver, flags, options
+FSTAB = {
+    "9pfs": "fs0:/:9pfs:::",
+    "initrd": "initrd0:/:extract::ramfs=1:",
+    "blk": "virtio0:/:ext4:::",
+}
+GUEST_IP = "172.44.0.2"
+HTML_DIR = "nginx/html"  # where the configuration in the rootfs serves from
+UBUNTU_MOUNT = "/var/www/html/sweep"
+VOLUME_LABEL = "sweep"
+DEFAULT_SIZES = ("1K", "10K", "100K", "1M", "10M")
+DEFAULT_COUNTS = (1, 100)
+MAX_BYTES = 64 << 20
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+CONFIG_LINE_RE = re.compile(r"^(?:# )?(CONFIG_\w+)(?:=| is not set)")
+
+# for a rootfs template without one: enough of nginx to serve the document root
+MINIMAL_CONF = """worker_processes 1;
+daemon off;
+master_process off;
+
+events {
+    worker_connections 1024;
+}
+
+http {
+    access_log off;
+    keepalive_requests 1000000;
+    server {
+        listen 80;
+        location / {
+            root /nginx/html;
+        }
+    }
+}
+"""
+
+
+def parse_size(text):
+    match = re.fullmatch(r"(\d+)([KMG]?)B?", text.strip().upper())
+    if not match:
+        raise argparse.ArgumentTypeError(f"not a size: {text}")
+    return int(match.group(1)) * SIZE_UNITS[match.group(2)]
+
+
+def files_for(size, count, max_bytes=MAX_BYTES):
+    return max(1, min(count, max_bytes // size))
+
+
+def make_docroot(template, root, sizes, count, max_bytes=MAX_BYTES):
+    # the rootfs template plus files_for(size, count) files of every size under <html>/sweep/<size>/
+    if template and os.path.isdir(template):
+        shutil.copytree(template, root, symlinks=True)
+    else:
+        os.makedirs(os.path.join(root, "nginx", "conf"))
+        os.makedirs(os.path.join(root, "nginx", "logs"))
+        with open(os.path.join(root, "nginx", "conf", "nginx.conf"), "w") as f:
+            f.write(MINIMAL_CONF)
+    html = os.path.join(root, HTML_DIR)
+    os.makedirs(html, exist_ok=True)
+    if not os.path.exists(os.path.join(html, "index.html")):
+        with open(os.path.join(html, "index.html"), "w") as f:
+            f.write("<html><body>fsbench</body></html>\n")
+    for size in sizes:
+        directory = os.path.join(html, "sweep", str(size))
+        os.makedirs(directory, exist_ok=True)
+        # incompressible, and one buffer per size is enough
+        content = os.urandom(size)
+        for i in range(files_for(size, count, max_bytes)):
+            with open(os.path.join(directory, f"{i}.bin"), "wb") as f:
+                f.write(content)
+    return os.path.join(html, "sweep")
+
+
+def write_cpio(root, path):
+    # newc archive of root, the format the initrd extraction reads
+    inode = 0
+
+    def entry(f, name, mode, size=0, source=None, nlink=1):
+        nonlocal inode
+        inode += 1
+        name = name.encode() + b"\0"
+        fields = (inode, mode, 0, 0, nlink, 0, size, 0, 0, 0, 0, len(name), 0)
+        f.write(b"070701" + "".join(f"{v:08X}" for v in fields).encode() + name)
+        f.write(b"\0" * (-(110 + len(name)) % 4))
+        if source:
+            with open(source, "rb") as src:
+                shutil.copyfileobj(src, f)
+        f.write(b"\0" * (-size % 4))
+
+    with open(path, "wb") as f:
+        for directory, dirs, files in os.walk(root):
+            dirs.sort()
+            relative = os.path.relpath(directory, root)
+            if relative != ".":
+                entry(f, relative, 0o040755, nlink=2)
+            for name in sorted(files):
+                source = os.path.join(directory, name)
+                entry(f, os.path.normpath(os.path.join(relative, name)), 0o100644, os.path.getsize(source), source)
+        entry(f, "TRAILER!!!", 0)
+    return path
+
+
+def make_ext2(root, path, label=VOLUME_LABEL):
+    # an ext2 image holding root, sized to its content plus headroom for the metadata
+    data, entries = 0, 0
+    for directory, _dirs, files in os.walk(root):
+        entries += 1 + len(files)
+        data += sum(os.path.getsize(os.path.join(directory, name)) for name in files)
+    size_kb = (data * 5 // 4 + entries * 4096) // 1024 + 16384
+    subprocess.run(["mke2fs", "-q", "-F", "-t", "ext2", "-b", "4096", "-L", label, "-N", str(entries + 128), "-d", root,
+                    path, f"{size_kb}k"], check=True, capture_output=True, timeout=600)
+    return path
+
+
+def merge_config(base, fragment, out):
+    # the fragment's CONFIG_ lines replace the base's, the rest of the base stays as it is
+    with open(fragment) as f:
+        overrides = {m.group(1): line.rstrip("\n") for line in f if (m := CONFIG_LINE_RE.match(line))}
+    lines = []
+    with open(base) as f:
+        for line in f:
+            match = CONFIG_LINE_RE.match(line)
+            lines.append(overrides.pop(match.group(1)) if match and match.group(1) in overrides else line.rstrip("\n"))
+    lines += overrides.values()
+    with open(out, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return out
+
+
+def build(jobs):
+    config = merge_config(os.path.join(NGINX_DIR, ".config"), CONFIG_FRAGMENT, os.path.join(NGINX_DIR, ".config.fsbench"))
+    # the Makefile finds .unikraft through $(PWD), so it runs from nginx_manual rather than with -C
+    make = ["make", f"C={config}", f"O={BUILD_DIR}"]
+    libs = os.path.join(NGINX_DIR, ".unikraft", "libs")
+    if os.path.isdir(os.path.join(libs, "lwext4")):
+        make.append(f"LIBS={libs}/musl:{libs}/lwip:{libs}/nginx:{libs}/lwext4")
+    else:
+        print(f"No lwext4 in {libs}, the kernel is built without the blk backend")
+    env = dict(os.environ, PWD=NGINX_DIR)
+    subprocess.run(make + ["olddefconfig"], cwd=NGINX_DIR, env=env, check=True)
+    subprocess.run(make + [f"-j{jobs}"], cwd=NGINX_DIR, env=env, check=True)
+    return KERNEL
+
+
+def unikraft_command(backend, image, port, mem_mb):
+    # writable: nginx opens its logs under the root, and every image is a scratch copy
+    devices = {
+        "9pfs": ["-fsdev", f"local,id=fs0dev,path={image},security_model=none",
+                 "-device", "virtio-9p-pci,fsdev=fs0dev,mount_tag=fs0,disable-modern=on,disable-legacy=off"],
+        "initrd": ["-initrd", image],
+        "blk": ["-drive", f"file={image},format=raw,if=none,id=blk0", "-device", "virtio-blk-pci,drive=blk0"],
+    }[backend]
+    return [
+        "qemu-system-x86_64",
+        "-m", f"{mem_mb}M",
+        "-cpu", "host,+x2apic,-pmu",
+        "-enable-kvm",
+        "-name", "unikraft,debug-threads=on",
+        # slirp on the subnet of the static address start_nginx.sh gives the guest
+        "-netdev", f"user,id=net0,net=172.44.0.0/24,host=172.44.0.1,hostfwd=tcp:127.0.0.1:{port}-{GUEST_IP}:80",
+        "-device", "virtio-net-pci,netdev=net0",
+        "-kernel", KERNEL,
+        "-append", f'netdev.ipv4_addr={GUEST_IP} netdev.ipv4_gw_addr=172.44.0.1 netdev.ipv4_subnet_mask=255.255.255.0 '
+                   f'vfs.fstab=[ "{FSTAB[backend]}" ] --',
+        "-display", "none",
+        "-serial", "stdio",
+    ] + devices
+
+
+class UnikraftServer:
+    def __init__(self, backend, image, port, mem_mb, console_log):
+        self.proc = subprocess.Popen(unikraft_command(backend, image, port, mem_mb), stdin=subprocess.DEVNULL,
+                                     stdout=subprocess.PIPE, stderr=subprocess.STDOUT, start_new_session=True)
+        self.qemu = from_popen(self.proc)
+        self.console = ConsoleReader(self.proc.stdout, UNIKRAFT_MARKERS, console_log)
+        self.console.start()
+        self.address = ("127.0.0.1", port)
+
+    def wait_ready(self, timeout):
+        return wait_until_ready(*self.address, "http", timeout).ready_ns is not None
+
+    def stop(self):
+        self.qemu.terminate()
+        self.qemu.close()
+        self.proc.wait()
+        self.console.join(timeout=5)
+
+
+def ubuntu_user_data(app_dir, out):
+    # the app's user-data plus the mount of the document root volume
+    with open(user_data_path(app_dir)) as f:
+        content = f.read().rstrip("\n")
+    with open(out, "w") as f:
+        f.write(f'{content}\n\nmounts:\n  - [ "LABEL={VOLUME_LABEL}", "{UBUNTU_MOUNT}", "ext2", "ro,nofail", "0", "0" ]\n')
+    return out
+
+
+def start_ubuntu(app_dir, volume, port, mem_mb, work_dir):
+    # cold boots only, a saved snapshot has no second disk
+    env = dict(os.environ, METRICS_DIR=work_dir, HOST_PORT=str(port), GUEST_MEM_MB=str(mem_mb), APP_STATS_HZ="0",
+               SCHED_HZ="0", BOOT_MODE="cold", DOCROOT_DISK=volume,
+               USER_DATA=ubuntu_user_data(app_dir, os.path.join(work_dir, "user-data")))
+    return HarnessRun(HARNESS_SCRIPTS[("nginx", "ubuntu")], app_dir, env, sorted(os.sched_getaffinity(0)),
+                      os.path.join(work_dir, "harness.log"), port, 80)
+
+
+def wait_for_path(host, port, path, timeout):
+    # readiness of the content itself: the mount may come up after nginx answers /
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection(host, port, timeout=5)
+            conn.request("HEAD", path)
+            status = conn.getresponse().status
+            conn.close()
+            if status == 200:
+                return True
+        except (OSError, http.client.HTTPException):
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def run_load(address, size, files, args, out_file):
+    cmd = [sys.executable, os.path.join(HARNESS_DIR, "httpload.py"), f"http://{address[0]}:{address[1]}/sweep/{size}/{{i}}.bin",
+           f"--connections={args.connections}", f"--processes={args.processes}", f"--duration={args.duration}",
+           f"--warmup={args.warmup}", f"--timeout={args.timeout}", f"--files={files}", f"--json-out-file={out_file}"]
+    return subprocess.run(cmd, stdout=subprocess.DEVNULL).returncode == 0
+
+
+def result_path(results, backend, count, size, rep):
+    directory = os.path.join(results, f"{backend}_{count}")
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"fs_{backend}_{count}_run_{size}_{rep}.json")
+
+
+def sweep(args):
+    # {(count, size): {backend: (requests/s, bytes/s)}}
+    table = {}
+    backends = [b for b in args.backends if b != "ubuntu" or args.ubuntu_dir]
+    if "ubuntu" in args.backends and not args.ubuntu_dir:
+        print("No --ubuntu-dir, skipping the ubuntu backend")
+    if any(b != "ubuntu" for b in backends) and not os.path.exists(KERNEL):
+        sys.exit(f"{KERNEL} not found, run 'fsbench.py build' first")
+    for count in args.counts:
+        with tempfile.TemporaryDirectory(prefix=f"fsbench_{count}_") as work_dir:
+            root = os.path.join(work_dir, "rootfs")
+            sweep_dir = make_docroot(args.rootfs, root, args.sizes, count, args.max_bytes)
+            images = {"9pfs": root}
+            if "initrd" in backends:
+                images["initrd"] = write_cpio(root, os.path.join(work_dir, "rootfs.cpio"))
+            if "blk" in backends:
+                images["blk"] = make_ext2(root, os.path.join(work_dir, "rootfs.ext2"))
+            if "ubuntu" in backends:
+                images["ubuntu"] = make_ext2(sweep_dir, os.path.join(work_dir, "sweep.ext2"))
+            total = sum(files_for(size, count, args.max_bytes) * size for size in args.sizes)
+            print(f"{count} file(s) per size: document root of {total / 2**20:.1f} MB")
+            for backend in backends:
+                run_dir = os.path.join(work_dir, backend)
+                os.makedirs(run_dir)
+                if backend == "ubuntu":
+                    server = start_ubuntu(os.path.abspath(os.path.expanduser(args.ubuntu_dir)), images[backend], args.port,
+                                          args.mem, run_dir)
+                else:
+                    server = UnikraftServer(backend, images[backend], args.port, args.mem, os.path.join(run_dir, "console.log"))
+                try:
+                    probe = f"/sweep/{args.sizes[0]}/0.bin"
+                    if not server.wait_ready(args.ready_timeout) or not wait_for_path(*server.address, probe, args.ready_timeout):
+                        print(f"  {backend}: not serving {probe} after {args.ready_timeout}s, skipped")
+                        continue
+                    for size in args.sizes:
+                        for rep in range(args.reps):
+                            out_file = result_path(args.results, backend, count, size, rep)
+                            if not run_load(server.address, size, files_for(size, count, args.max_bytes), args, out_file):
+                                print(f"  {backend} {size} B: httpload failed")
+                                continue
+                            with open(out_file) as f:
+                                data = json.load(f)
+                            table.setdefault((count, size), {}).setdefault(backend, []).append(
+                                (data["requests_per_sec"], data["transfer_per_sec"]))
+                finally:
+                    server.stop()
+    return table
+
+
+def print_table(table, backends):
+    # medians over repetitions, and every backend relative to ubuntu (or 9pfs without it)
+    reference = "ubuntu" if any("ubuntu" in row for row in table.values()) else "9pfs"
+    print(f"{'files':>6} {'size':>9}  " + "  ".join(f"{b:>22}" for b in backends) + f"   (req/s, MB/s, x {reference})")
+    for (count, size), row in sorted(table.items()):
+        medians = {b: sorted(v)[len(v) // 2] for b, v in row.items()}
+        base = medians.get(reference, (0, 0))[0]
+        cells = []
+        for backend in backends:
+            if backend not in medians:
+                cells.append(f"{'-':>22}")
+                continue
+            rps, bps = medians[backend]
+            ratio = f"{rps / base:.2f}x" if base else "-"
+            cells.append(f"{rps:>9.0f} {bps / 2**20:>6.1f} {ratio:>5}")
+        print(f"{count:>6} {size:>9}  " + "  ".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="nginx static file serving over 9pfs, initrd, virtio-blk and Ubuntu")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_parser = sub.add_parser("build", help="build the nginx kernel that can boot every backend")
+    build_parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1)
+    run_parser = sub.add_parser("run", help="sweep file sizes and counts over the backends")
+    run_parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    run_parser.add_argument("--sizes", nargs="+", type=parse_size, default=[parse_size(s) for s in DEFAULT_SIZES])
+    run_parser.add_argument("--counts", nargs="+", type=int, default=list(DEFAULT_COUNTS), help="files of every size")
+    run_parser.add_argument("--max-bytes", type=parse_size, default=MAX_BYTES, help="cap on the files of one size")
+    run_parser.add_argument("--rootfs", default=DEFAULT_ROOTFS, help="rootfs template with the nginx configuration")
+    run_parser.add_argument("--ubuntu-dir", help="Ubuntu nginx app directory (ubuntu.qcow2, user-data)")
+    run_parser.add_argument("--reps", type=int, default=1)
+    run_parser.add_argument("--duration", type=float, default=10)
+    run_parser.add_argument("--warmup", type=float, default=2)
+    run_parser.add_argument("--connections", type=int, default=50)
+    run_parser.add_argument("--processes", type=int, default=4)
+    run_parser.add_argument("--timeout", type=float, default=10, help="seconds before a request counts as timed out")
+    run_parser.add_argument("--mem", type=int, default=512, help="guest memory in MB, the initrd lives in it twice")
+    run_parser.add_argument("--port", type=int, default=8090)
+    run_parser.add_argument("--ready-timeout", type=float, default=120)
+    run_parser.add_argument("--results", default=DEFAULT_RESULTS)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        print(build(args.jobs))
+        return
+    args.sizes = sorted(set(args.sizes))
+    table = sweep(args)
+    print_table(table, [b for b in args.backends if any(b in row for row in table.values())])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+# HDR (high dynamic range) latency histogram.
+#
+# Same bucket layout and "HISTF..." compressed log encoding (V2, zigzag LEB128 counts, zlib,
+# base64) as HdrHistogram, so histograms written by the native load generators and the
+# "Compressed Histogram" memtier_benchmark puts in its JSON can be decoded and merged the same
+# way. Values are integers, the load generators record microseconds like memtier does.
+
+import base64
+import math
+import struct
+import zlib
+
+ENCODING_COOKIE = 0x1C849303 | 0x10
+COMPRESSION_COOKIE = 0x1C849304 | 0x10
+ENCODING_HEADER = struct.Struct(">iiiiqqd")
+COMPRESSION_HEADER = struct.Struct(">ii")
+
+
+def zigzag_encode(value, out):
+    value = ((value << 1) ^ (value >> 63)) & 0xFFFFFFFFFFFFFFFF
+    for _ in range(8):
+        if value < 0x80:
+            out.append(value)
+            return
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def zigzag_decode(buf, pos):
+    value = shift = 0
+    for _ in range(8):
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            break
+        shift += 7
+    else:
+        value |= buf[pos] << 56
+        pos += 1
+    return (value >> 1) ^ -(value & 1), pos
+
+
+class Histogram:
+    def __init__(self, lowest=1, highest=3_600_000_000, significant_figures=3):
+        if lowest < 1 or highest < 2 * lowest or not 1 <= significant_figures <= 5:
+            raise ValueError("invalid histogram range")
+        self.lowest = lowest
+        self.highest = highest
+        self.significant_figures = significant_figures
+
+        single_unit = 2 * 10 ** significant_figures
+        sub_bucket_count_magnitude = math.ceil(math.log2(single_unit))
+        self.sub_bucket_half_count_magnitude = max(sub_bucket_count_magnitude, 1) - 1
+        self.sub_bucket_count = 1 << (self.sub_bucket_half_count_magnitude + 1)
+        self.sub_bucket_half_count = self.sub_bucket_count // 2
+        self.unit_magnitude = int(math.floor(math.log2(lowest)))
+        self.sub_bucket_mask = (self.sub_bucket_count - 1) << self.unit_magnitude
+
+        smallest_untrackable = self.sub_bucket_count << self.unit_magnitude
+        bucket_count = 1
+        while smallest_untrackable <= highest:
+            smallest_untrackable <<= 1
+            bucket_count += 1
+        self.bucket_count = bucket_count
+        self.counts = [0] * ((bucket_count + 1) * self.sub_bucket_half_count)
+
+        self.total = 0
+        self.min = 0
+        self.max = 0
+        self.sum = 0
+
+    def _index(self, value):
+        bucket = (value | self.sub_bucket_mask).bit_length() - self.unit_magnitude - (self.sub_bucket_half_count_magnitude + 1)
+        sub_bucket = value >> (bucket + self.unit_magnitude)
+        return ((bucket + 1) << self.sub_bucket_half_count_magnitude) + sub_bucket - self.sub_bucket_half_count
+
+    def _value_at(self, index):
+        bucket = (index >> self.sub_bucket_half_count_magnitude) - 1
+        sub_bucket = (index & (self.sub_bucket_half_count - 1)) + self.sub_bucket_half_count
+        if bucket < 0:
+            sub_bucket -= self.sub_bucket_half_count
+            bucket = 0
+        return sub_bucket << (bucket + self.unit_magnitude)
+
+    def _highest_equivalent(self, value):
+        index = self._index(value)
+        bucket = (index >> self.sub_bucket_half_count_magnitude) - 1
+        size = 1 << (self.unit_magnitude + max(bucket, 0))
+        return self._value_at(index) + size - 1
+
+    def record(self, value, count=1):
+        value = min(max(int(value), 0), self.highest)
+        self.counts[self._index(value)] += count
+        if not self.total or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.total += count
+        self.sum += value * count
+
+    def merge(self, other):
+        if (other.lowest, other.significant_figures) != (self.lowest, self.significant_figures) or other.highest > self.highest:
+            for value, count in other.recorded():
+                self.record(value, count)
+            return self
+        for i, count in enumerate(other.counts):
+            if count:
+                self.counts[i] += count
+        if other.total:
+            self.min = min(self.min, other.min) if self.total else other.min
+            self.max = max(self.max, other.max)
+        self.total += other.total
+        self.sum += other.sum
+        return self
+
+    def recorded(self):
+        # (value, count) for every non-empty bucket, the value being the bucket's lowest equivalent
+        for i, count in enumerate(self.counts):
+            if count:
+                yield self._value_at(i), count
+
+    def mean(self):
+        return self.sum / self.total if self.total else 0.0
+
+    def stddev(self):
+        if not self.total:
+            return 0.0
+        mean = self.mean()
+        variance = sum(count * (value - mean) ** 2 for value, count in self.recorded()) / self.total
+        return math.sqrt(variance)
+
+    def value_at_percentile(self, percentile):
+        if not self.total:
+            return 0
+        wanted = max(1, int(min(percentile, 100.0) / 100.0 * self.total + 0.5))
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= wanted:
+                return min(self._highest_equivalent(self._value_at(i)), self.max)
+        return self.max
+
+    def percentiles(self, wanted=(50.0, 90.0, 99.0, 99.9, 99.99)):
+        return {f"p{p:.2f}": self.value_at_percentile(p) for p in wanted}
+
+    def encode(self):
+        payload = bytearray()
+        last = max((i for i, c in enumerate(self.counts) if c), default=-1)
+        zeros = 0
+        for count in self.counts[:last + 1]:
+            if count:
+                if zeros:
+                    zigzag_encode(-zeros, payload)
+                    zeros = 0
+                zigzag_encode(count, payload)
+            else:
+                zeros += 1
+        raw = ENCODING_HEADER.pack(ENCODING_COOKIE, len(payload), 0, self.significant_figures,
+                                   self.lowest, self.highest, 1.0) + payload
+        compressed = zlib.compress(bytes(raw))
+        return base64.b64encode(COMPRESSION_HEADER.pack(COMPRESSION_COOKIE, len(compressed)) + compressed).decode()
+
+    @classmethod
+    def decode(cls, text):
+        data = base64.b64decode(text)
+        cookie, length = COMPRESSION_HEADER.unpack_from(data)
+        if cookie & ~0xF0 != COMPRESSION_COOKIE & ~0xF0:
+            raise ValueError("not a compressed HdrHistogram")
+        raw = zlib.decompress(data[COMPRESSION_HEADER.size:COMPRESSION_HEADER.size + length])
+        cookie, payload_len, _, figures, lowest, highest, _ = ENCODING_HEADER.unpack_from(raw)
+        if cookie & ~0xF0 != ENCODING_COOKIE & ~0xF0:
+            raise ValueError("unsupported HdrHistogram encoding")
+        hist = cls(lowest, highest, figures)
+        pos, end, index = ENCODING_HEADER.size, ENCODING_HEADER.size + payload_len, 0
+        while pos < end:
+            count, pos = zigzag_decode(raw, pos)
+            if count < 0:
+                index += -count
+                continue
+            if count:
+                hist.counts[index] += count
+                value = hist._value_at(index)
+                if not hist.total:
+                    hist.min = value
+                hist.max = hist._highest_equivalent(value)
+                hist.total += count
+                hist.sum += value * count
+            index += 1
+        return hist
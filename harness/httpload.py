@@ -0,0 +1,324 @@
+# Native HTTP/1.1 load generator for nginx.
+#
+# Connections run as asyncio tasks spread over --processes worker processes. Requests use
+# keep-alive by default; --no-keepalive opens a fresh connection (and sends Connection: close)
+# for every request, so the TCP handshake through slirp is part of each measurement. With --rate
+# the load is a fixed schedule like wrk2: every connection has due times first + k * interval and
+# latency is measured from the due time, so a stalled server cannot hide its stall by slowing the
+# client down. Without --rate each connection sends its next request as soon as the previous one
+# is answered, like wrk. With --files N a {i} in the URL path is replaced by 0 .. N-1 and every
+# connection walks through the N paths from its own offset, so a whole document root is served
+# instead of one hot file.
+#
+# Latency goes into HDR histograms (microseconds, harness/hdr.py). A wrk-style summary is printed
+# (so the old "Requests/sec" / "Latency" scraping keeps working, always in ms) and the full result
+# (percentiles, errors by kind and status, per-second series, encoded histogram) goes to
+# --json-out-file.
+#
+#   python3 harness/httpload.py http://localhost:8080/ -c 100 -d 30 --rate 20000 --json-out-file run.json
+
+import argparse
+import asyncio
+import collections
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import time
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from hdr import Histogram
+
+PERCENTILES = (50.0, 75.0, 90.0, 99.0, 99.9, 99.99)
+ERROR_KINDS = ("connect", "read", "write", "timeout", "status")
+START_DELAY = 0.5  # seconds the workers get to connect before the common start time
+RESULT_GRACE = 30  # seconds past the end of the run a worker has to report before it is given up
+
+
+class Stats:
+    def __init__(self, warmup_ns, start_ns):
+        self.start_ns = start_ns
+        self.record_from = start_ns + warmup_ns
+        self.hist = Histogram()
+        self.seconds = {}
+        self.errors = collections.Counter()
+        self.status = collections.Counter()
+        self.bytes_rx = 0
+
+    def record(self, scheduled_ns, done_ns, status, size):
+        if scheduled_ns < self.record_from:
+            return
+        self.status[status] += 1
+        self.bytes_rx += size
+        if status >= 400:
+            self.errors["status"] += 1
+        latency_us = (done_ns - scheduled_ns) // 1000
+        self.hist.record(latency_us)
+        second = (scheduled_ns - self.record_from) // 1_000_000_000
+        per_second = self.seconds.get(second)
+        if per_second is None:
+            per_second = self.seconds[second] = Histogram()
+        per_second.record(latency_us)
+
+    def error(self, kind, scheduled_ns):
+        if scheduled_ns >= self.record_from:
+            self.errors[kind] += 1
+
+    def export(self):
+        return {
+            "hist": self.hist.encode(),
+            "seconds": {s: h.encode() for s, h in self.seconds.items()},
+            "errors": dict(self.errors),
+            "status": dict(self.status),
+            "bytes_rx": self.bytes_rx,
+        }
+
+
+class RequestError(Exception):
+    def __init__(self, kind):
+        super().__init__(kind)
+        self.kind = kind
+
+
+async def read_response(reader):
+    # (status, bytes read, server keeps the connection open)
+    status_line = await reader.readline()
+    if not status_line:
+        raise RequestError("read")
+    size = len(status_line)
+    parts = status_line.split(None, 2)
+    if len(parts) < 2 or not parts[0].startswith(b"HTTP/"):
+        raise RequestError("read")
+    status = int(parts[1])
+    length, chunked, keep_alive = None, False, parts[0] != b"HTTP/1.0"
+    while True:
+        line = await reader.readline()
+        size += len(line)
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.partition(b":")
+        name, value = name.strip().lower(), value.strip().lower()
+        if name == b"content-length":
+            length = int(value)
+        elif name == b"transfer-encoding" and b"chunked" in value:
+            chunked = True
+        elif name == b"connection":
+            keep_alive = value == b"keep-alive" or (keep_alive and value != b"close")
+    if chunked:
+        while True:
+            line = await reader.readline()
+            chunk = int(line.split(b";")[0], 16)
+            size += len(line) + chunk + 2
+            await reader.readexactly(chunk + 2)
+            if not chunk:
+                break
+    elif length is not None:
+        size += len(await reader.readexactly(length))
+    elif status >= 200 and status not in (204, 304):
+        size += len(await reader.read())
+        keep_alive = False
+    return status, size, keep_alive
+
+
+async def connection(args, conn_index, stats, start_ns, end_ns, interval_ns, target):
+    host, port, requests = target
+    reader = writer = None
+    first = start_ns + (interval_ns * conn_index // max(1, args.connections) if interval_ns else 0)
+    k = 0
+    while True:
+        due = first + k * interval_ns if interval_ns else max(first, time.monotonic_ns())
+        if due >= end_ns:
+            break
+        now = time.monotonic_ns()
+        if due > now:
+            await asyncio.sleep((due - now) / 1e9)
+        request = requests[(conn_index + k) % len(requests)]
+        k += 1
+        try:
+            if writer is None:
+                try:
+                    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), args.timeout)
+                except (OSError, asyncio.TimeoutError):
+                    raise RequestError("connect")
+            try:
+                writer.write(request)
+                await writer.drain()
+            except OSError:
+                raise RequestError("write")
+            try:
+                status, size, keep_alive = await asyncio.wait_for(read_response(reader), args.timeout)
+            except asyncio.TimeoutError:
+                raise RequestError("timeout")
+            except (OSError, ValueError, asyncio.IncompleteReadError):
+                raise RequestError("read")
+            stats.record(due, time.monotonic_ns(), status, size)
+            if not keep_alive or not args.keepalive:
+                writer.close()
+                writer = None
+        except RequestError as e:
+            stats.error(e.kind, due)
+            if writer is not None:
+                writer.close()
+                writer = None
+            if e.kind == "connect" and not interval_ns:
+                await asyncio.sleep(0.01)
+    if writer is not None:
+        writer.close()
+
+
+async def worker_main(args, conn_indexes, start_ns, result):
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    path = (url.path or "/") + (f"?{url.query}" if url.query else "")
+    paths = [path.replace("{i}", str(i)) for i in range(args.files)] if "{i}" in path else [path]
+    headers = [f"Host: {url.netloc}", "User-Agent: httpload"]
+    headers.append("Connection: keep-alive" if args.keepalive else "Connection: close")
+    headers += args.header
+    requests = [("\r\n".join([f"GET {p} HTTP/1.1"] + headers) + "\r\n\r\n").encode() for p in paths]
+
+    stats = Stats(int(args.warmup * 1e9), start_ns)
+    end_ns = start_ns + int((args.warmup + args.duration) * 1e9)
+    interval_ns = int(args.connections * 1e9 / args.rate) if args.rate else 0
+    try:
+        await asyncio.gather(*(connection(args, i, stats, start_ns, end_ns, interval_ns, (host, port, requests))
+                               for i in conn_indexes))
+    finally:
+        # the parent waits for one export per worker, whatever happened here
+        result.put(stats.export())
+
+
+def worker(args, conn_indexes, start_ns, result):
+    asyncio.run(worker_main(args, conn_indexes, start_ns, result))
+
+
+def run(args):
+    ctx = multiprocessing.get_context("fork")
+    result = ctx.Queue()
+    start_ns = time.monotonic_ns() + int(START_DELAY * 1e9)
+    started = time.time() + START_DELAY
+    processes = min(args.processes, args.connections)
+    workers = [ctx.Process(target=worker, args=(args, list(range(p, args.connections, processes)), start_ns, result), daemon=True)
+               for p in range(processes)]
+    for w in workers:
+        w.start()
+    deadline = time.monotonic() + START_DELAY + args.warmup + args.duration + args.timeout + RESULT_GRACE
+    exports = []
+    for _ in workers:
+        try:
+            exports.append(result.get(timeout=max(0.1, deadline - time.monotonic())))
+        except queue.Empty:
+            break
+    for w in workers:
+        w.join(timeout=1)
+        if w.is_alive():
+            w.terminate()
+            w.join()
+    # a worker that raised still reports what it measured, but its run is not a clean one
+    failed = sum(1 for w in workers if w.exitcode != 0)
+    if failed:
+        print(f"{failed} of {len(workers)} worker processes failed or did not report", file=sys.stderr)
+
+    hist = Histogram()
+    seconds = {}
+    errors = collections.Counter({kind: 0 for kind in ERROR_KINDS})
+    status = collections.Counter()
+    bytes_rx = 0
+    for export in exports:
+        hist.merge(Histogram.decode(export["hist"]))
+        for second, encoded in export["seconds"].items():
+            seconds.setdefault(second, Histogram()).merge(Histogram.decode(encoded))
+        errors.update(export["errors"])
+        status.update({str(code): n for code, n in export["status"].items()})
+        bytes_rx += export["bytes_rx"]
+
+    ms = lambda us: round(us / 1000, 3)
+    return {
+        "configuration": {
+            "url": args.url, "mode": "fixed-rate" if args.rate else "closed-loop", "rate": args.rate,
+            "connections": args.connections, "processes": processes, "keepalive": args.keepalive,
+            "duration": args.duration, "warmup": args.warmup, "timeout": args.timeout, "files": args.files,
+        },
+        "failed_processes": failed,
+        "requests": hist.total,
+        "duration": args.duration,
+        # wall clock time of second 0 of time_series, to line it up with collectors on the host
+        "start_time_ms": int((started + args.warmup) * 1000),
+        "requests_per_sec": round(hist.total / args.duration, 2),
+        "transfer_per_sec": round(bytes_rx / args.duration, 2),
+        "bytes": bytes_rx,
+        "latency_ms": {
+            "mean": ms(hist.mean()), "stdev": ms(hist.stddev()), "min": ms(hist.min), "max": ms(hist.max),
+            "percentiles": {k: ms(v) for k, v in hist.percentiles(PERCENTILES).items()},
+        },
+        "errors": dict(errors),
+        "status": dict(status),
+        "time_series": [
+            {"second": s, "requests": h.total, "mean_ms": ms(h.mean()), "max_ms": ms(h.max),
+             **{f"{k}_ms": ms(v) for k, v in h.percentiles((50.0, 99.0, 99.9)).items()}, "histogram": h.encode()}
+            for s, h in sorted(seconds.items())
+        ],
+        "histogram": hist.encode(),
+    }
+
+
+def human_bytes(n):
+    for unit in ("B", "KB", "MB"):
+        if n < 1024:
+            return f"{n:.2f}{unit}"
+        n /= 1024
+    return f"{n:.2f}GB"
+
+
+def print_summary(report):
+    # wrk's layout, with latency always in ms
+    c = report["configuration"]
+    lat = report["latency_ms"]
+    pct = lat["percentiles"]
+    errors = report["errors"]
+    print(f"Running {c['duration']:g}s test @ {c['url']}")
+    print(f"  {c['processes']} processes and {c['connections']} connections, {c['mode']}"
+          + (f" at {c['rate']:g} req/s" if c["rate"] else "") + ("" if c["keepalive"] else ", no keep-alive"))
+    print(f"    Latency   {lat['mean']:.2f}ms  stdev {lat['stdev']:.2f}ms  max {lat['max']:.2f}ms")
+    print("  Latency Distribution")
+    for key in ("p50.00", "p75.00", "p90.00", "p99.00", "p99.90", "p99.99"):
+        print(f"    {key[1:]:>6}%  {pct[key]:.3f}ms")
+    print(f"  {report['requests']} requests in {c['duration']:g}s, {human_bytes(report['bytes'])} read")
+    if errors["connect"] or errors["read"] or errors["write"] or errors["timeout"]:
+        print(f"  Socket errors: connect {errors['connect']}, read {errors['read']}, write {errors['write']}, timeout {errors['timeout']}")
+    if errors["status"]:
+        print(f"  Non-2xx or 3xx responses: {errors['status']}")
+    print(f"Requests/sec: {report['requests_per_sec']:>10.2f}")
+    print(f"Transfer/sec: {human_bytes(report['transfer_per_sec']):>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP/1.1 load generator with HDR latency histograms")
+    parser.add_argument("url")
+    parser.add_argument("-c", "--connections", type=int, default=100, help="total connections over all processes")
+    parser.add_argument("-t", "--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("-d", "--duration", type=float, default=30, help="seconds of recorded load")
+    parser.add_argument("-R", "--rate", type=float, default=0, help="fixed request rate over all connections, 0 = closed loop")
+    parser.add_argument("--warmup", type=float, default=0, help="seconds of load before recording starts")
+    parser.add_argument("--no-keepalive", dest="keepalive", action="store_false", help="new connection for every request")
+    parser.add_argument("-H", "--header", action="append", default=[], help="extra request header")
+    parser.add_argument("--timeout", type=float, default=2, help="seconds before a request counts as timed out")
+    parser.add_argument("--files", type=int, default=1, help="paths to cycle through, {i} in the URL path is replaced by 0 .. files-1")
+    parser.add_argument("--json-out-file")
+    args = parser.parse_args()
+    if args.connections < 1 or args.processes < 1 or args.files < 1:
+        parser.error("connections, processes and files must be at least 1")
+
+    report = run(args)
+    print_summary(report)
+    if args.json_out_file:
+        with open(args.json_out_file, "w") as f:
+            json.dump(report, f, indent=2)
+    # no response at all (only connect errors, or nothing sent) or a failed worker: the caller must not take this run
+    if report["failed_processes"] or not report["requests"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
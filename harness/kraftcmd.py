@@ -0,0 +1,137 @@
+# kraft's QEMU command line, reused to start Unikraft guests without kraft.
+#
+# kraft builds the QEMU command line itself and offers no way to add to it. Where the harness needs
+# something kraft cannot express (-incoming for snapshot restores, a vhost-net multiqueue tap), the
+# command line of one ordinary kraft boot is recorded and QEMU is started directly from it, with
+# kraft's control, console and network plumbing swapped for ours. The guest devices otherwise stay
+# exactly as kraft set them up.
+#
+# The recording sits next to the snapshots (.snapshots/kraft-<mem>m.json) and is redone once the
+# kernel it points at changes.
+
+import json
+import os
+import re
+import subprocess
+import time
+
+from proctree import wait_for_qemu_child
+from runmeta import file_fingerprint, option_values, qemu_cmdline
+
+RECORD_DIR = ".snapshots"
+HOSTFWD_RE = re.compile(r"(hostfwd=tcp:[^:]*:)\d+(-)")
+# options without a value argument, everything else kraft passes takes one
+FLAG_OPTIONS = {"-daemonize", "-nographic", "-no-reboot", "-no-shutdown", "-enable-kvm", "-S", "-snapshot",
+                "-nodefaults", "-no-user-config", "-no-hpet", "-no-acpi"}
+# control, daemon and console plumbing that belongs to kraft's run
+DROPPED_OPTIONS = {"-daemonize", "-nographic", "-S", "-pidfile", "-qmp", "-monitor", "-mon", "-display",
+                   "-incoming", "-loadvm", "-name"}
+
+
+def qmp_socket(args):
+    # the unix socket of a QMP monitor on a QEMU command line, given as -qmp or as -chardev + -mon
+    for value in option_values(args, "-qmp"):
+        if value.startswith("unix:"):
+            return value[5:].split(",")[0]
+    chardevs = {}
+    for value in option_values(args, "-chardev"):
+        fields = value.split(",")
+        options = dict(f.split("=", 1) for f in fields[1:] if "=" in f)
+        if fields[0] == "socket" and "path" in options:
+            chardevs[options.get("id")] = options["path"]
+    for value in option_values(args, "-mon"):
+        options = dict(f.split("=", 1) for f in value.split(",") if "=" in f)
+        if options.get("mode") == "control" and options.get("chardev") in chardevs:
+            return chardevs[options["chardev"]]
+    return None
+
+
+def kernel_fingerprint(args, cwd):
+    kernels = option_values(args, "-kernel")
+    return file_fingerprint(os.path.join(cwd, kernels[-1])) if kernels else None
+
+
+def record_path(app_dir, mem_mb):
+    return os.path.join(os.path.abspath(app_dir), RECORD_DIR, f"kraft-{mem_mb}m.json")
+
+
+def record(app_dir, mem_mb, args, cwd):
+    path = record_path(app_dir, mem_mb)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = f"{path}.{os.getpid()}.partial"
+    with open(partial, "w") as f:
+        json.dump({"args": args, "cwd": cwd, "kernel_fingerprint": kernel_fingerprint(args, cwd),
+                   "recorded_at": time.time()}, f, indent=2)
+    os.replace(partial, path)
+
+
+def load(app_dir, mem_mb):
+    # the recorded command line, None when there is none or the kernel was rebuilt since
+    path = record_path(app_dir, mem_mb)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        meta = json.load(f)
+    if kernel_fingerprint(meta["args"], meta["cwd"]) != meta["kernel_fingerprint"]:
+        return None
+    return meta
+
+
+def learn(app_dir, mem_mb, port, guest_port, timeout=30):
+    # one throwaway kraft boot on slirp, only to record the command line it builds
+    kraft = subprocess.Popen(
+        ["kraft", "run", "-p", f"{port}:{guest_port}", "-M", f"{mem_mb}M", "--plat", "qemu", "--arch", "x86_64", "."],
+        cwd=app_dir, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    qemu = wait_for_qemu_child(kraft.pid, timeout=timeout)
+    try:
+        if not qemu:
+            return None
+        args = qemu_cmdline(qemu.pid)
+        record(app_dir, mem_mb, args, os.readlink(f"/proc/{qemu.pid}/cwd"))
+    finally:
+        kraft.terminate()
+        if qemu:
+            qemu.terminate()
+            qemu.close()
+        try:
+            kraft.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            kraft.kill()
+    return load(app_dir, mem_mb)
+
+
+def direct_command(meta, qmp_path, port=None, network=None, append=None):
+    # the recorded command line with our plumbing: console on stdout, QMP on qmp_path, and either
+    # kraft's forward moved to port or its NIC replaced by network (netdev_args) with -append
+    args = meta["args"]
+    netdev_ids = {value.split("id=")[1].split(",")[0] for value in option_values(args, "-netdev") if "id=" in value}
+    out = [args[0]]
+    serials = 0
+    i = 1
+    while i < len(args):
+        arg = args[i]
+        value = None if arg in FLAG_OPTIONS or i + 1 >= len(args) else args[i + 1]
+        i += 1 if value is None else 2
+        if arg in DROPPED_OPTIONS:
+            continue
+        if arg == "-serial":
+            # the first serial port is the guest console, read from stdout like kraft's output
+            value = "stdio" if not serials else "null"
+            serials += 1
+        elif arg == "-chardev" and value.split(",")[0] == "socket":
+            continue
+        elif arg == "-netdev":
+            if network:
+                out += network
+                continue
+            if port is not None:
+                value = HOSTFWD_RE.sub(rf"\g<1>{port}\g<2>", value)
+        elif arg == "-device" and network and any(f"netdev={n}" in value.split(",") for n in netdev_ids):
+            continue
+        elif arg == "-append" and append:
+            value = append(value)
+        out += [arg] if value is None else [arg, value]
+    if not serials:
+        out += ["-serial", "stdio"]
+    # -name is kraft's, replaced by one that names the vCPU threads (placement.py)
+    return out + ["-name", "unikraft,debug-threads=on", "-display", "none", "-qmp", f"unix:{qmp_path},server=on,wait=off"]
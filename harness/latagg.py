@@ -0,0 +1,283 @@
+# Latency aggregation across runs and time windows from full distributions.
+#
+# Percentiles cannot be averaged: the mean of five per-run p99s is not the p99 of the five runs.
+# This merges the HDR histograms memtier_benchmark writes ("Percentile Latencies" -> "Histogram log
+# format") and the ones mcload.py / httpload.py write (whole run and per second) into one
+# distribution per operation and window, and reads exact percentiles off the merged counts.
+# Confidence bands come from a bootstrap over runs: runs are resampled with replacement, their
+# histograms merged and the percentile read again, all as matrix operations over a common bucket grid.
+#
+# memtier only keeps p50/p99/p99.9 per second, not a histogram, so its per-second windows cannot be
+# merged; for those the median of the per-run values is reported with the min/max across runs as
+# the band and the window is marked inexact. Whole-run percentiles are always exact.
+#
+# --steady cuts every run to its steady-state window first (harness/steady.py). Runs with per-second
+# histograms get their whole-run distribution rebuilt from that window; memtier's whole-run
+# histogram cannot be cut and is used as is.
+#
+#   python3 harness/latagg.py results/memcached/memcached1000/metadata/unikraft_run1_*.json --op Gets Sets --window 5
+
+import argparse
+import csv
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from hdr import Histogram
+from steady import memtier_window
+
+PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+OPS = ("Gets", "Sets", "Totals")
+BOOTSTRAP = 2000
+CONFIDENCE = 0.95
+
+
+class Distribution:
+    # latency distribution as parallel (value, count) arrays; values are the highest equivalent
+    # value of each HDR bucket in microseconds, which is what HdrHistogram reports percentiles as
+
+    def __init__(self, values, counts):
+        self.values = np.asarray(values, dtype=np.int64)
+        self.counts = np.asarray(counts, dtype=np.int64)
+
+    @classmethod
+    def from_histogram(cls, hist):
+        counts = np.asarray(hist.counts, dtype=np.int64)
+        index = np.flatnonzero(counts)
+        bucket = (index >> hist.sub_bucket_half_count_magnitude) - 1
+        sub_bucket = (index & (hist.sub_bucket_half_count - 1)) + hist.sub_bucket_half_count
+        sub_bucket = np.where(bucket < 0, sub_bucket - hist.sub_bucket_half_count, sub_bucket)
+        bucket = np.maximum(bucket, 0)
+        lowest = sub_bucket << (bucket + hist.unit_magnitude)
+        values = lowest + (1 << (bucket + hist.unit_magnitude)) - 1
+        return cls(values, counts[index])
+
+    @classmethod
+    def decode(cls, encoded):
+        return cls.from_histogram(Histogram.decode(encoded))
+
+    @property
+    def total(self):
+        return int(self.counts.sum())
+
+    def mean(self):
+        return float(np.average(self.values, weights=self.counts)) if self.total else float("nan")
+
+    def percentiles(self, wanted=PERCENTILES):
+        if not self.total:
+            return np.full(len(wanted), np.nan)
+        cumulative = np.cumsum(self.counts)
+        targets = np.maximum(1, np.floor(np.asarray(wanted) / 100.0 * self.total + 0.5)).astype(np.int64)
+        return self.values[np.searchsorted(cumulative, targets)].astype(float)
+
+
+def merge(distributions):
+    distributions = [d for d in distributions if d.total]
+    if not distributions:
+        return Distribution([], [])
+    values, inverse = np.unique(np.concatenate([d.values for d in distributions]), return_inverse=True)
+    counts = np.bincount(inverse, weights=np.concatenate([d.counts for d in distributions]), minlength=len(values))
+    return Distribution(values, counts.astype(np.int64))
+
+
+def count_matrix(distributions):
+    # (common bucket values, runs x buckets count matrix)
+    values = np.unique(np.concatenate([d.values for d in distributions] or [np.empty(0, np.int64)]))
+    matrix = np.zeros((len(distributions), len(values)), dtype=np.float64)
+    for row, d in enumerate(distributions):
+        matrix[row, np.searchsorted(values, d.values)] = d.counts
+    return values, matrix
+
+
+def matrix_percentiles(values, counts, wanted):
+    # percentiles of every row of a (n x buckets) count matrix -> (n x len(wanted))
+    cumulative = np.cumsum(counts, axis=1)
+    totals = cumulative[:, -1:]
+    targets = np.maximum(1, np.floor(np.asarray(wanted)[None, :] / 100.0 * totals + 0.5))
+    index = np.empty(targets.shape, dtype=np.int64)
+    for column in range(targets.shape[1]):
+        index[:, column] = (cumulative >= targets[:, column:column + 1]).argmax(axis=1)
+    result = values[index].astype(float)
+    result[totals[:, 0] == 0] = np.nan
+    return result
+
+
+def bootstrap_band(distributions, wanted=PERCENTILES, resamples=BOOTSTRAP, confidence=CONFIDENCE, seed=0):
+    # (low, high) arrays for the merged percentiles when the set of runs is resampled
+    distributions = [d for d in distributions if d.total]
+    if len(distributions) < 2:
+        return np.full(len(wanted), np.nan), np.full(len(wanted), np.nan)
+    values, matrix = count_matrix(distributions)
+    runs = len(distributions)
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, runs, size=(resamples, runs))
+    weights = np.zeros((resamples, runs))
+    np.add.at(weights, (np.arange(resamples)[:, None], picks), 1.0)
+    merged = matrix_percentiles(values, weights @ matrix, wanted)
+    alpha = (1.0 - confidence) / 2
+    return np.nanquantile(merged, alpha, axis=0), np.nanquantile(merged, 1.0 - alpha, axis=0)
+
+
+def percentile_key(p):
+    return f"p{p:.2f}"
+
+
+def load_runs(paths):
+    runs = []
+    for path in paths:
+        with open(path) as f:
+            data = json.load(f)
+        if "ALL STATS" not in data:
+            # httpload: a single operation, stored as Totals in memtier's layout
+            series = {}
+            for entry in data.get("time_series", []):
+                series[str(entry["second"])] = {"Count": entry["requests"], "Compressed Histogram": entry.get("histogram"),
+                                                **{key[:-3]: value for key, value in entry.items() if key.startswith("p")}}
+                if series[str(entry["second"])]["Compressed Histogram"] is None:
+                    del series[str(entry["second"])]["Compressed Histogram"]
+            histogram = {"Compressed Histogram": data["histogram"]} if data.get("histogram") else {}
+            data = {"ALL STATS": {"Totals": {"Percentile Latencies": {"Histogram log format": histogram}, "Time-Serie": series}}}
+        runs.append((path, data["ALL STATS"]))
+    return runs
+
+
+def summary_distribution(stats):
+    encoded = ((stats.get("Percentile Latencies") or {}).get("Histogram log format") or {}).get("Compressed Histogram")
+    return Distribution.decode(encoded) if encoded else None
+
+
+def steady_distribution(stats, window):
+    # whole-run distribution rebuilt from the per-second histograms inside the steady window,
+    # None when the run has no per-second histograms (memtier)
+    entries = [e for second, e in (stats.get("Time-Serie") or {}).items() if window[0] <= int(second) <= window[1]]
+    if not entries or not all("Compressed Histogram" in e for e in entries):
+        return None
+    return merge(Distribution.decode(e["Compressed Histogram"]) for e in entries)
+
+
+def aggregate(paths, op="Gets", wanted=PERCENTILES, window=1, max_time=None, resamples=BOOTSTRAP, confidence=CONFIDENCE,
+              steady=False):
+    # merged percentiles (ms) for one operation over all runs, overall and per time window; with
+    # steady, every run is cut to its steady-state window (harness/steady.py) first
+    runs = []
+    for path, all_stats in load_runs(paths):
+        stats = all_stats.get(op)
+        if stats:
+            runs.append((path, stats, memtier_window(all_stats.get("Totals") or stats) if steady else None))
+    whole = []
+    for _, stats, steady_window in runs:
+        distribution = steady_distribution(stats, steady_window) if steady_window else None
+        whole.append(distribution or summary_distribution(stats))
+    whole = [d for d in whole if d is not None]
+    merged = merge(whole)
+    low, high = bootstrap_band(whole, wanted, resamples, confidence)
+    per_run = np.array([d.percentiles(wanted) for d in whole]) if whole else np.empty((0, len(wanted)))
+    result = {
+        "op": op,
+        "runs": len(runs),
+        "count": merged.total,
+        "mean_ms": merged.mean() / 1000,
+        "percentiles_ms": {percentile_key(p): v / 1000 for p, v in zip(wanted, merged.percentiles(wanted))},
+        "band_ms": {percentile_key(p): (lo / 1000, hi / 1000) for p, lo, hi in zip(wanted, low, high)},
+        "per_run_ms": {percentile_key(p): list(per_run[:, i] / 1000) for i, p in enumerate(wanted)},
+        "steady_windows": [w for _, _, w in runs] if steady else None,
+        "windows": [],
+    }
+
+    buckets = {}
+    for run_index, (_, stats, steady_window) in enumerate(runs):
+        for second, entry in (stats.get("Time-Serie") or {}).items():
+            second = int(second)
+            if max_time is not None and second > max_time:
+                continue
+            if steady_window and not steady_window[0] <= second <= steady_window[1]:
+                continue
+            buckets.setdefault(second // window, {}).setdefault(run_index, []).append(entry)
+
+    for index in sorted(buckets):
+        by_run = buckets[index]
+        entries = [e for run_entries in by_run.values() for e in run_entries]
+        window_result = {"start": index * window, "end": (index + 1) * window, "runs": len(by_run),
+                         "count": sum(e.get("Count", 0) for e in entries)}
+        if all("Compressed Histogram" in e for e in entries):
+            per_run = [merge(Distribution.decode(e["Compressed Histogram"]) for e in run_entries) for run_entries in by_run.values()]
+            values = merge(per_run).percentiles(wanted)
+            low, high = bootstrap_band(per_run, wanted, resamples, confidence)
+            window_result["exact"] = True
+        else:
+            # only the summary percentiles memtier keeps per second: per-run values (count weighted
+            # inside a run when the window spans several seconds), median and range across runs
+            rows = []
+            for run_entries in by_run.values():
+                weights = np.array([e.get("Count", 0) for e in run_entries], dtype=float)
+                row = []
+                for p in wanted:
+                    column = np.array([e.get(percentile_key(p), np.nan) for e in run_entries], dtype=float)
+                    ok = ~np.isnan(column)
+                    row.append(np.average(column[ok], weights=weights[ok]) * 1000 if ok.any() and weights[ok].sum() else np.nan)
+                rows.append(row)
+            rows = np.array(rows)
+            values, low, high = (np.full(len(wanted), np.nan) for _ in range(3))
+            kept = ~np.isnan(rows).all(axis=0)  # memtier has no p90 per second
+            values[kept] = np.nanmedian(rows[:, kept], axis=0)
+            low[kept], high[kept] = np.nanmin(rows[:, kept], axis=0), np.nanmax(rows[:, kept], axis=0)
+            window_result["exact"] = False
+        window_result["percentiles_ms"] = {percentile_key(p): v / 1000 for p, v in zip(wanted, values)}
+        window_result["band_ms"] = {percentile_key(p): (lo / 1000, hi / 1000) for p, lo, hi in zip(wanted, low, high)}
+        window_result["ops_per_sec"] = window_result["count"] / (window * max(1, len(by_run)))
+        result["windows"].append(window_result)
+    return result
+
+
+def write_windows_csv(path, results, wanted=PERCENTILES):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        header = ["op", "start", "end", "runs", "count", "ops_per_sec", "exact"]
+        for p in wanted:
+            key = percentile_key(p)
+            header += [f"{key}_ms", f"{key}_low_ms", f"{key}_high_ms"]
+        writer.writerow(header)
+        for result in results:
+            for w in result["windows"]:
+                row = [result["op"], w["start"], w["end"], w["runs"], w["count"], round(w["ops_per_sec"], 2), int(w["exact"])]
+                for p in wanted:
+                    key = percentile_key(p)
+                    row += [round(w["percentiles_ms"][key], 4), *(round(v, 4) for v in w["band_ms"][key])]
+                writer.writerow(row)
+
+
+def print_result(result, confidence=CONFIDENCE):
+    print(f"{result['op']}: {result['count']} requests over {result['runs']} runs, mean {result['mean_ms']:.3f}ms")
+    for key, value in result["percentiles_ms"].items():
+        low, high = result["band_ms"][key]
+        per_run = " ".join(f"{v:.3f}" for v in result["per_run_ms"][key])
+        print(f"  {key[1:]:>6}%  {value:8.3f}ms  [{low:.3f}, {high:.3f}] {int(confidence * 100)}% CI   per run: {per_run}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge memtier / mcload / httpload latency histograms across runs")
+    parser.add_argument("files", nargs="+", help="json outputs of the runs to merge")
+    parser.add_argument("--op", nargs="+", default=["Gets", "Sets"], choices=OPS)
+    parser.add_argument("--percentiles", type=float, nargs="+", default=list(PERCENTILES))
+    parser.add_argument("--window", type=int, default=1, help="seconds per time window")
+    parser.add_argument("--max-time", type=int)
+    parser.add_argument("--resamples", type=int, default=BOOTSTRAP)
+    parser.add_argument("--confidence", type=float, default=CONFIDENCE)
+    parser.add_argument("--steady", action="store_true", help="only use every run's steady-state window")
+    parser.add_argument("--csv", help="write the per-window series here")
+    args = parser.parse_args()
+
+    results = [aggregate(args.files, op, args.percentiles, args.window, args.max_time, args.resamples, args.confidence,
+                         args.steady)
+               for op in args.op]
+    for result in results:
+        print_result(result, args.confidence)
+    if args.csv:
+        write_windows_csv(args.csv, results, args.percentiles)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+# Native load generator for the memcache text protocol.
+#
+# memtier_benchmark is closed-loop: a client only sends its next request after the previous
+# answer came back, so a stalled server also stalls the load and the stall never shows up in
+# the latency numbers (coordinated omission). With --rate this generator runs open-loop instead:
+# every connection sends on a fixed schedule whether or not earlier requests were answered, and
+# latency is measured from the time a request was *scheduled*, not from when it was written.
+# Without --rate it runs closed-loop with --pipeline requests in flight per connection.
+#
+# Connections are pipelined asyncio streams spread over --processes worker processes. Latency
+# goes into HDR histograms (microseconds). The JSON output mirrors the parts of memtier's
+# --json-out-file the plot scripts read ("ALL STATS" -> Gets/Sets/Totals with Time-Serie and
+# Percentile Latencies, latencies in ms), so both tools' files can be used side by side.
+#
+#   python3 harness/mcload.py -p 11211 --connections 100 --rate 50000 --test-time 30 --json-out-file run.json
+
+import argparse
+import asyncio
+import collections
+import json
+import multiprocessing
+import os
+import queue
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from hdr import Histogram
+
+PERCENTILES = (50.0, 90.0, 99.0, 99.9, 99.99)
+OPS = ("Gets", "Sets")
+START_DELAY = 0.5  # seconds the workers get to connect before the common start time
+PREFILL_BATCH = 200
+PREFILL_CONNECTIONS = 16
+CONNECT_TIMEOUT = 5
+RESULT_GRACE = 30  # seconds past the end of the run a worker has to report before it is given up
+
+
+def parse_ratio(text):
+    # memtier convention, "sets:gets"
+    sets, gets = (int(x) for x in text.split(":"))
+    if sets < 0 or gets < 0 or sets + gets == 0:
+        raise argparse.ArgumentTypeError(f"invalid ratio {text!r}")
+    return sets, gets
+
+
+def parse_value_size(text):
+    # "32", "uniform:16:1024" or "normal:512:128"
+    parts = text.split(":")
+    try:
+        if len(parts) == 1:
+            return ("fixed", int(parts[0]), 0)
+        if parts[0] in ("uniform", "normal") and len(parts) == 3:
+            return (parts[0], int(parts[1]), int(parts[2]))
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError(f"invalid value size {text!r}")
+
+
+def max_value_size(spec):
+    kind, a, b = spec
+    if kind == "fixed":
+        return a
+    if kind == "uniform":
+        return b
+    return a + 6 * b
+
+
+def value_size(spec, rng):
+    kind, a, b = spec
+    if kind == "fixed":
+        return a
+    if kind == "uniform":
+        return rng.randint(a, b)
+    return max(1, min(int(rng.gauss(a, b)), a + 6 * b))
+
+
+class Stats:
+    def __init__(self, warmup_ns, start_ns):
+        self.start_ns = start_ns
+        self.record_from = start_ns + warmup_ns
+        self.hists = {op: Histogram() for op in OPS}
+        self.seconds = {op: {} for op in OPS}
+        self.hits = self.misses = self.errors = self.connect_errors = 0
+        self.bytes_tx = self.bytes_rx = 0
+
+    def record(self, op, hit, scheduled_ns, done_ns):
+        if scheduled_ns < self.record_from:
+            return
+        if hit is not None:
+            self.hits += hit
+            self.misses += not hit
+        latency_us = (done_ns - scheduled_ns) // 1000
+        self.hists[op].record(latency_us)
+        second = (scheduled_ns - self.start_ns) // 1_000_000_000
+        per_second = self.seconds[op].get(second)
+        if per_second is None:
+            per_second = self.seconds[op][second] = Histogram()
+        per_second.record(latency_us)
+
+    def export(self):
+        return {
+            "hists": {op: h.encode() for op, h in self.hists.items()},
+            "seconds": {op: {s: h.encode() for s, h in per.items()} for op, per in self.seconds.items()},
+            "hits": self.hits, "misses": self.misses, "errors": self.errors, "connect_errors": self.connect_errors,
+            "bytes_tx": self.bytes_tx, "bytes_rx": self.bytes_rx,
+        }
+
+
+async def read_response(reader, line, op, stats):
+    # True / False for a get hit / miss, None for sets and error replies
+    stats.bytes_rx += len(line)
+    if op == "Sets":
+        if line != b"STORED\r\n":
+            stats.errors += 1
+        return None
+    if line == b"END\r\n":
+        return False
+    if not line.startswith(b"VALUE "):
+        stats.errors += 1
+        return None
+    length = int(line.split()[3])
+    stats.bytes_rx += len(await reader.readexactly(length + 2))
+    end = await reader.readline()
+    stats.bytes_rx += len(end)
+    return True
+
+
+def request(args, rng, value):
+    key = f"memtier-{rng.randrange(args.key_maximum)}".encode()
+    sets, gets = args.ratio
+    if rng.randrange(sets + gets) < sets:
+        size = value_size(args.data_size, rng)
+        return "Sets", b"set %s 0 0 %d\r\n%s\r\n" % (key, size, value[:size])
+    return "Gets", b"get %s\r\n" % key
+
+
+async def connection(args, conn_index, stats, start_ns, end_ns, interval_ns, seed):
+    rng = random.Random(seed)
+    value = b"x" * max_value_size(args.data_size)
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(args.server, args.port), CONNECT_TIMEOUT)
+    except (asyncio.TimeoutError, OSError):
+        # a refused or reset connect costs this connection, not the whole worker
+        stats.errors += 1
+        stats.connect_errors += 1
+        return
+    pending = collections.deque()  # (op, scheduled ns) of requests on the wire, in order
+    in_flight = asyncio.Semaphore(args.pipeline) if not interval_ns else None
+    finished = asyncio.Event()
+
+    async def receive():
+        while pending or not finished.is_set():
+            line = await reader.readline()
+            if not line or not pending:
+                raise ConnectionError("connection closed or unexpected reply")
+            op, scheduled_ns = pending[0]
+            hit = await read_response(reader, line, op, stats)
+            pending.popleft()
+            stats.record(op, hit, scheduled_ns, time.monotonic_ns())
+            if in_flight:
+                in_flight.release()
+
+    receiver = asyncio.ensure_future(receive())
+    try:
+        if interval_ns:
+            # open loop: request k of this connection is due at first + k * interval, late
+            # requests are sent as one batch and still measured from their due time
+            k = 0
+            first = start_ns + interval_ns * conn_index // max(1, args.connections)
+            while True:
+                due = first + k * interval_ns
+                if due >= end_ns:
+                    break
+                now = time.monotonic_ns()
+                if due > now:
+                    await asyncio.sleep((due - now) / 1e9)
+                    now = time.monotonic_ns()
+                batch = bytearray()
+                while due <= now and due < end_ns:
+                    op, data = request(args, rng, value)
+                    pending.append((op, due))
+                    batch += data
+                    k += 1
+                    due = first + k * interval_ns
+                stats.bytes_tx += len(batch)
+                writer.write(batch)
+                if writer.transport.get_write_buffer_size() > 1 << 20:
+                    await writer.drain()
+        else:
+            delay = start_ns - time.monotonic_ns()
+            if delay > 0:
+                await asyncio.sleep(delay / 1e9)
+            while time.monotonic_ns() < end_ns:
+                await in_flight.acquire()
+                op, data = request(args, rng, value)
+                pending.append((op, time.monotonic_ns()))
+                stats.bytes_tx += len(data)
+                writer.write(data)
+                await writer.drain()
+        finished.set()
+        if pending or receiver.done():
+            await asyncio.wait_for(receiver, timeout=args.drain_timeout)
+    except (asyncio.TimeoutError, ConnectionError, OSError, asyncio.IncompleteReadError):
+        stats.errors += len(pending)
+    finally:
+        receiver.cancel()
+        writer.close()
+
+
+async def prefill_keys(args, keys):
+    reader, writer = await asyncio.open_connection(args.server, args.port)
+    rng = random.Random(keys.start)
+    value = b"x" * max_value_size(args.data_size)
+    for first in range(0, len(keys), PREFILL_BATCH):
+        batch = keys[first:first + PREFILL_BATCH]
+        writer.write(b"".join(b"set memtier-%d 0 0 %d\r\n%s\r\n" % (n, size, value[:size])
+                              for n, size in ((n, value_size(args.data_size, rng)) for n in batch)))
+        for _ in batch:
+            await reader.readline()
+    writer.close()
+
+
+async def prefill(args):
+    streams = min(args.connections, PREFILL_CONNECTIONS)
+    await asyncio.gather(*(prefill_keys(args, range(i, args.key_maximum, streams)) for i in range(streams)))
+
+
+async def worker_main(args, conn_indexes, start_ns, result):
+    stats = Stats(int(args.warmup * 1e9), start_ns)
+    end_ns = start_ns + int((args.warmup + args.test_time) * 1e9)
+    interval_ns = int(args.connections * 1e9 / args.rate) if args.rate else 0
+    try:
+        await asyncio.gather(*(connection(args, i, stats, start_ns, end_ns, interval_ns, args.seed * 100003 + i)
+                               for i in conn_indexes))
+    finally:
+        # the parent waits for one export per worker, whatever happened here
+        result.put(stats.export())
+
+
+def worker(args, conn_indexes, start_ns, result):
+    asyncio.run(worker_main(args, conn_indexes, start_ns, result))
+
+
+def op_stats(hist, seconds, duration, hits=0, misses=0):
+    stats = {
+        "Count": hist.total,
+        "Ops/sec": round(hist.total / duration, 2) if duration else 0.0,
+        "Hits/sec": round(hits / duration, 2) if duration else 0.0,
+        "Misses/sec": round(misses / duration, 2) if duration else 0.0,
+        "Latency": round(hist.mean() / 1000, 3),
+        "Average Latency": round(hist.mean() / 1000, 3),
+        "Accumulated Latency": hist.sum // 1000,
+        "Min Latency": round(hist.min / 1000, 3),
+        "Max Latency": round(hist.max / 1000, 3),
+        "Time-Serie": {},
+        "Percentile Latencies": {k: round(v / 1000, 3) for k, v in hist.percentiles(PERCENTILES).items()},
+    }
+    stats["Percentile Latencies"]["Histogram log format"] = {"Compressed Histogram": hist.encode()}
+    for second in sorted(seconds):
+        h = seconds[second]
+        entry = {"Count": h.total, "Average Latency": round(h.mean() / 1000, 3),
+                 "Accumulated Latency": h.sum // 1000, "Min Latency": round(h.min / 1000, 3),
+                 "Max Latency": round(h.max / 1000, 3)}
+        entry.update({k: round(v / 1000, 3) for k, v in h.percentiles((50.0, 99.0, 99.9)).items()})
+        # per-second histogram, so windows can be merged across runs (harness/latagg.py)
+        entry["Compressed Histogram"] = h.encode()
+        stats["Time-Serie"][str(second)] = entry
+    return stats
+
+
+def distribution(hist):
+    # memtier's cumulative "<=msec / percent" list
+    out, seen = [], 0
+    for value, count in hist.recorded():
+        seen += count
+        out.append({"<=msec": round(hist._highest_equivalent(value) / 1000, 3), "percent": round(100.0 * seen / hist.total, 3)})
+    return out
+
+
+def run(args):
+    if args.prefill:
+        asyncio.run(prefill(args))
+    ctx = multiprocessing.get_context("fork")
+    result = ctx.Queue()
+    start_ns = time.monotonic_ns() + int(START_DELAY * 1e9)
+    started = time.time() + START_DELAY
+    processes = min(args.processes, args.connections)
+    workers = [ctx.Process(target=worker, args=(args, list(range(p, args.connections, processes)), start_ns, result), daemon=True)
+               for p in range(processes)]
+    for w in workers:
+        w.start()
+    deadline = time.monotonic() + START_DELAY + args.warmup + args.test_time + args.drain_timeout + RESULT_GRACE
+    exports = []
+    for _ in workers:
+        try:
+            exports.append(result.get(timeout=max(0.1, deadline - time.monotonic())))
+        except queue.Empty:
+            break
+    for w in workers:
+        w.join(timeout=1)
+        if w.is_alive():
+            w.terminate()
+            w.join()
+    missing = len(workers) - len(exports)
+    if missing:
+        print(f"{missing} of {len(workers)} worker processes did not report", file=sys.stderr)
+
+    hists = {op: Histogram() for op in OPS}
+    seconds = {op: {} for op in OPS}
+    totals = collections.Counter()
+    for export in exports:
+        for op in OPS:
+            hists[op].merge(Histogram.decode(export["hists"][op]))
+            for second, encoded in export["seconds"][op].items():
+                seconds[op].setdefault(second, Histogram()).merge(Histogram.decode(encoded))
+        for key in ("hits", "misses", "errors", "connect_errors", "bytes_tx", "bytes_rx"):
+            totals[key] += export[key]
+
+    duration = args.test_time
+    warm = int(args.warmup)
+    seconds = {op: {s - warm: h for s, h in per.items()} for op, per in seconds.items()}
+    all_hist = Histogram().merge(hists["Gets"]).merge(hists["Sets"])
+    all_seconds = {}
+    for op in OPS:
+        for second, h in seconds[op].items():
+            all_seconds.setdefault(second, Histogram()).merge(h)
+
+    report = {
+        "configuration": {
+            "server": args.server, "port": args.port, "protocol": "memcache_text",
+            "mode": "open-loop" if args.rate else "closed-loop", "rate": args.rate,
+            "connections": args.connections, "processes": processes, "pipeline": args.pipeline,
+            "ratio": "%d:%d" % args.ratio, "key_maximum": args.key_maximum,
+            "data_size": args.data_size_text, "warmup": args.warmup, "prefill": args.prefill,
+        },
+        "run information": {"Connections": args.connections, "Processes": processes, "Seconds": args.test_time, "Format version": 2,
+                            "Failed processes": missing},
+        "ALL STATS": {
+            "Runtime": {"Start time": int((started + args.warmup) * 1000), "Finish time": int((started + args.warmup + duration) * 1000),
+                        "Total duration": int(duration * 1000), "Time unit": "MILLISECONDS"},
+            "Sets": op_stats(hists["Sets"], seconds["Sets"], duration),
+            "Gets": op_stats(hists["Gets"], seconds["Gets"], duration, totals["hits"], totals["misses"]),
+            "Totals": op_stats(all_hist, all_seconds, duration, totals["hits"], totals["misses"]),
+            "Errors": totals["errors"],
+            "Connect errors": totals["connect_errors"],
+            "KB/sec TX": round(totals["bytes_tx"] / 1024 / (duration + args.warmup), 2),
+            "KB/sec RX": round(totals["bytes_rx"] / 1024 / (duration + args.warmup), 2),
+            "SET": distribution(hists["Sets"]),
+            "GET": distribution(hists["Gets"]),
+        },
+    }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Open/closed-loop memcached load generator with HDR latency histograms")
+    parser.add_argument("-s", "--server", default="127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, default=11211)
+    parser.add_argument("-c", "--connections", type=int, default=50, help="total connections over all processes")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--rate", type=float, default=0, help="offered load in ops/s over all connections, 0 = closed loop")
+    parser.add_argument("--pipeline", type=int, default=1, help="requests in flight per connection in closed loop")
+    parser.add_argument("--ratio", type=parse_ratio, default=(1, 10), help="sets:gets, memtier style (default 1:10)")
+    parser.add_argument("--key-maximum", type=int, default=10_000_000)
+    parser.add_argument("-d", "--data-size", dest="data_size_text", default="32", help="32, uniform:MIN:MAX or normal:MEAN:STDDEV")
+    parser.add_argument("--test-time", type=float, default=30)
+    parser.add_argument("--warmup", type=float, default=0, help="seconds of load before recording starts")
+    parser.add_argument("--prefill", action="store_true", help="set every key once before the run so gets hit")
+    parser.add_argument("--drain-timeout", type=float, default=10, help="seconds to wait for outstanding replies at the end")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json-out-file")
+    args = parser.parse_args()
+    args.data_size = parse_value_size(args.data_size_text)
+    if args.connections < 1 or args.processes < 1 or args.pipeline < 1:
+        parser.error("connections, processes and pipeline must be at least 1")
+
+    report = run(args)
+    stats = report["ALL STATS"]
+    for op in ("Gets", "Sets", "Totals"):
+        s = stats[op]
+        p = s["Percentile Latencies"]
+        print(f"{op:7} {s['Ops/sec']:>12.2f} ops/s  avg {s['Average Latency']:.3f} ms  p50 {p['p50.00']:.3f}  "
+              f"p99 {p['p99.00']:.3f}  p99.9 {p['p99.90']:.3f}  max {s['Max Latency']:.3f} ms")
+    print(f"errors {stats['Errors']} (connect {stats['Connect errors']})  TX {stats['KB/sec TX']} KB/s  RX {stats['KB/sec RX']} KB/s")
+    if args.json_out_file:
+        with open(args.json_out_file, "w") as f:
+            json.dump(report, f, indent=2)
+    # nothing measured, or only part of the workers reported: the caller must not take this run
+    if report["run information"]["Failed processes"] or not stats["Totals"]["Count"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+# Guest memory accounting for a QEMU process.
+#
+# Host RSS of QEMU mixes its own heap and shared libraries with guest RAM. This reads
+# /proc/<pid>/smaps_rollup for PSS/USS/shared and walks /proc/<pid>/smaps to find the guest RAM
+# mapping (the anonymous region the size of -m), whose resident + swapped pages are the pages the
+# guest has actually touched. QEMU's own overhead is what is left of the PSS. Optionally the balloon
+# and guest memory stats are queried over QMP, on a connection of their own per query so the monitor
+# stays free for other clients between samples. Samples are only streamed to the metrics store file at
+# store_path (balloon / free are NaN when not queried); the log and the summaries are read back from
+# it, so memory stays flat however long the run is.
+
+import csv
+import os
+import re
+import statistics
+import threading
+import time
+
+from metricstore import MetricsWriter, stored_rows
+from qmp import QMPClient, QMPError
+
+MAPPING_RE = re.compile(r"^([0-9a-f]+)-([0-9a-f]+) \S+ \S+ \S+ \S+\s*(.*)$")
+# QEMU rounds and pads the RAM block a little, anything up to this much larger still counts
+GUEST_REGION_SLACK_KB = 4096
+BALLOON_POLL_INTERVAL = 1
+QMP_TIMEOUT = 1  # seconds a balloon query may wait for the monitor before its sample goes without
+
+MEMORY_LOG_HEADER = [
+    "Time Elapsed", "RSS (KB)", "PSS (KB)", "USS (KB)", "Shared (KB)", "Swap (KB)",
+    "Guest Region (KB)", "Guest Touched (KB)", "QEMU Overhead (KB)", "Balloon (KB)", "Guest Free (KB)",
+]
+STORE_COLUMNS = ["t", "rss", "pss", "uss", "shared", "swap", "region", "touched", "overhead", "balloon", "free"]
+SUMMARY_HEADER = [
+    "Run", "Platform", "App", "Guest Memory (MB)",
+    "Peak PSS (KB)", "Steady PSS (KB)", "Peak USS (KB)", "Steady USS (KB)",
+    "Peak Guest Touched (KB)", "Steady Guest Touched (KB)", "Peak QEMU Overhead (KB)", "Steady QEMU Overhead (KB)",
+    "Shared (KB)",
+]
+
+
+def read_smaps_rollup(pid):
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return fields
+
+
+def guest_ram_region(pid, guest_kb):
+    # the largest anonymous (or memfd / memory-backend) mapping within [guest_kb, guest_kb + slack]
+    best, current = None, None
+    with open(f"/proc/{pid}/smaps") as f:
+        for line in f:
+            match = MAPPING_RE.match(line)
+            if match:
+                start, end, name = int(match.group(1), 16), int(match.group(2), 16), match.group(3)
+                size_kb = (end - start) // 1024
+                anonymous = not name or name.startswith(("/memfd:", "[anon", "/dev/zero", "/dev/shm", "/dev/hugepages"))
+                candidate = anonymous and guest_kb <= size_kb <= guest_kb + GUEST_REGION_SLACK_KB
+                current = {"size": size_kb, "Rss": 0, "Swap": 0} if candidate else None
+                if current and (best is None or size_kb > best["size"]):
+                    best = current
+                continue
+            if current is not None:
+                parts = line.split()
+                if parts and parts[0] in ("Rss:", "Swap:"):
+                    current[parts[0].rstrip(":")] = int(parts[1])
+    return best
+
+
+def memory_sample(pid, guest_kb):
+    rollup = read_smaps_rollup(pid)
+    uss = rollup.get("Private_Clean", 0) + rollup.get("Private_Dirty", 0)
+    shared = rollup.get("Shared_Clean", 0) + rollup.get("Shared_Dirty", 0)
+    region = guest_ram_region(pid, guest_kb)
+    touched = region["Rss"] + region["Swap"] if region else 0
+    pss = rollup.get("Pss", 0)
+    return {
+        "rss": rollup.get("Rss", 0),
+        "pss": pss,
+        "uss": uss,
+        "shared": shared,
+        "swap": rollup.get("Swap", 0),
+        "region": region["size"] if region else 0,
+        "touched": touched,
+        # guest RAM is private anonymous memory, so it is fully inside PSS
+        "overhead": max(0, pss + rollup.get("SwapPss", rollup.get("Swap", 0)) - touched),
+    }
+
+
+def peak_and_steady(values):
+    # steady state is the median of the second half of the run, after boot and warm-up
+    if not values:
+        return 0, 0
+    return max(values), int(statistics.median(values[len(values) // 2:]))
+
+
+class MemoryAccountant(threading.Thread):
+    def __init__(self, pid, guest_mb, interval=1.0, qmp_path=None, store_path=None):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.guest_mb = guest_mb
+        self.guest_kb = guest_mb * 1024
+        self.interval = interval
+        self.qmp_path = qmp_path
+        self.store_path = store_path
+        self.stop_event = threading.Event()
+        self.started_at = None
+        self.polling = False
+
+    def _balloon(self):
+        # a QMP connection per query: QEMU serves one client at a time, and the snapshot save and
+        # the vCPU thread lookup need the monitor during the run too
+        balloon, free = "", ""
+        qmp = QMPClient(self.qmp_path, timeout=QMP_TIMEOUT)
+        try:
+            qmp.connect(wait=QMP_TIMEOUT)
+            if not self.polling:
+                qmp.execute("qom-set", path="/machine/peripheral/balloon0",
+                            property="guest-stats-polling-interval", value=BALLOON_POLL_INTERVAL)
+                self.polling = True
+            balloon = qmp.execute("query-balloon").get("actual", 0) // 1024
+            stats = qmp.execute("qom-get", path="/machine/peripheral/balloon0", property="guest-stats")
+            free = stats.get("stats", {}).get("stat-free-memory", -1)
+            free = free // 1024 if free >= 0 else ""
+        except (QMPError, OSError, ValueError, AttributeError):
+            pass
+        finally:
+            qmp.close()
+        return balloon, free
+
+    def run(self):
+        self.started_at = time.monotonic()
+        store = None
+        if self.store_path:
+            if os.path.exists(self.store_path):
+                os.remove(self.store_path)
+            store = MetricsWriter(self.store_path, STORE_COLUMNS, flush_records=1)
+        while not self.stop_event.is_set():
+            try:
+                sample = memory_sample(self.pid, self.guest_kb)
+            except (OSError, ValueError):
+                break
+            sample["t"] = round(time.monotonic() - self.started_at, 3)
+            sample["balloon"], sample["free"] = self._balloon() if self.qmp_path else ("", "")
+            if store:
+                store.append([float("nan") if sample[key] == "" else sample[key] for key in STORE_COLUMNS])
+            self.stop_event.wait(self.interval)
+        if store:
+            store.close()
+
+    def stop(self, timeout=5):
+        self.stop_event.set()
+        self.join(timeout)
+
+    def write_log(self, path):
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(MEMORY_LOG_HEADER)
+            # same columns in the same order as the store
+            for row in stored_rows(self.store_path):
+                writer.writerow([row[0]] + ["" if value != value else int(value) for value in row[1:]])
+
+    def summary(self):
+        keys = ("pss", "uss", "touched", "overhead")
+        index = {key: STORE_COLUMNS.index(key) for key in keys + ("shared",)}
+        values = {key: [] for key in keys}
+        shared = 0
+        for row in stored_rows(self.store_path):
+            for key in keys:
+                values[key].append(int(row[index[key]]))
+            shared = int(row[index["shared"]])
+        out = {key: peak_and_steady(values[key]) for key in keys}
+        out["shared"] = shared
+        return out
+
+    def append_summary(self, path, run_id, platform, app):
+        s = self.summary()
+        file_exists = os.path.exists(path)
+        with open(path, "a", newline="") as f:
+            writer = csv.writer(f)
+            if not file_exists:
+                writer.writerow(SUMMARY_HEADER)
+            writer.writerow([run_id, platform, app, self.guest_mb, *s["pss"], *s["uss"], *s["touched"], *s["overhead"], s["shared"]])
+
+    def report(self):
+        s = self.summary()
+        return (f"Guest touched: peak {s['touched'][0]} KB, steady {s['touched'][1]} KB of {self.guest_kb} KB; "
+                f"QEMU overhead: peak {s['overhead'][0]} KB, steady {s['overhead'][1]} KB; "
+                f"USS steady {s['uss'][1]} KB, shared {s['shared']} KB")
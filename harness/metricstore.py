@@ -0,0 +1,185 @@
+# Append-only, memory-mappable columnar-row store for harness metrics (*.umx).
+#
+# Samples are streamed to disk while the run is going instead of being kept in lists until
+# cleanup(), so a SIGKILL, OOM or hung teardown loses at most one flush interval. Every record is
+# a fixed-width row of float64 values followed by a CRC32; a torn write at the tail simply fails
+# its checksum and is dropped on load. Loading maps the file and never parses text.
+#
+# layout: header  = b"UKMX" | u16 version | u16 column count | u32 names length | names (JSON) | pad to 8
+#         record  = <columns> x f64 | u32 crc32 of the values | u32 reserved
+
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+
+MAGIC = b"UKMX"
+VERSION = 1
+HEADER = struct.Struct("<4sHHI")
+TRAILER = struct.Struct("<II")
+
+
+def header_bytes(columns):
+    names = json.dumps(list(columns)).encode()
+    raw = HEADER.pack(MAGIC, VERSION, len(columns), len(names)) + names
+    return raw + b"\0" * (-len(raw) % 8)
+
+
+def read_header(buf):
+    if len(buf) < HEADER.size:
+        raise ValueError("not a metrics store file")
+    magic, version, ncols, names_len = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a metrics store file")
+    # a cut or corrupt header decodes to the wrong number of names, or not at all (ValueError too)
+    columns = json.loads(bytes(buf[HEADER.size:HEADER.size + names_len]))
+    if not isinstance(columns, list) or len(columns) != ncols:
+        raise ValueError("corrupt metrics store header")
+    size = HEADER.size + names_len
+    return columns, size + (-size % 8)
+
+
+class MetricsWriter:
+    def __init__(self, path, columns, flush_records=256, flush_interval=0.5, fsync=False):
+        self.path = path
+        self.columns = list(columns)
+        self.values = struct.Struct(f"<{len(self.columns)}d")
+        self.record_size = self.values.size + TRAILER.size
+        self.flush_records = flush_records
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.buffer = bytearray()
+        self.pending = 0
+        self.last_flush = time.monotonic()
+
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        size = os.fstat(fd).st_size
+        if size == 0:
+            os.write(fd, header_bytes(self.columns))
+        else:
+            with open(path, "rb") as f:
+                existing, header_size = read_header(f.read(64 * 1024))
+            if existing != self.columns:
+                os.close(fd)
+                raise ValueError(f"{path} holds columns {existing}, not {self.columns}")
+            # drop a torn record left by a crash before appending behind it
+            torn = (size - header_size) % self.record_size
+            if torn:
+                os.ftruncate(fd, size - torn)
+        self.fd = fd
+
+    def append(self, values):
+        packed = self.values.pack(*values)
+        self.buffer += packed
+        self.buffer += TRAILER.pack(zlib.crc32(packed), 0)
+        self.pending += 1
+        if self.pending >= self.flush_records or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            # whole records in one write, a crash can only tear the last one
+            os.write(self.fd, self.buffer)
+            if self.fsync:
+                os.fsync(self.fd)
+            self.buffer = bytearray()
+            self.pending = 0
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        if self.fd is not None:
+            self.flush()
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MetricsFile:
+    def __init__(self, path, verify=True):
+        self.path = path
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self.columns, self.offset = read_header(self.map)
+        self.values = struct.Struct(f"<{len(self.columns)}d")
+        self.record_size = self.values.size + TRAILER.size
+        self.count = (size - self.offset) // self.record_size
+        if verify:
+            self.count = self._valid_prefix()
+
+    def _valid_prefix(self):
+        view = memoryview(self.map)
+        for i in range(self.count):
+            start = self.offset + i * self.record_size
+            crc, _ = TRAILER.unpack_from(view, start + self.values.size)
+            if zlib.crc32(view[start:start + self.values.size]) != crc:
+                return i
+        return self.count
+
+    def row(self, i):
+        return self.values.unpack_from(self.map, self.offset + i * self.record_size)
+
+    def rows(self):
+        for i in range(self.count):
+            yield self.row(i)
+
+    def __iter__(self):
+        # a fresh pass over the records every time, for code that walks the rows more than once
+        return self.rows()
+
+    def column(self, name):
+        index = self.columns.index(name)
+        return [self.row(i)[index] for i in range(self.count)]
+
+    def to_numpy(self):
+        # zero-copy (count, columns) view over the mapped file
+        import numpy as np
+        return np.ndarray((self.count, len(self.columns)), dtype="<f8", buffer=self.map,
+                          offset=self.offset, strides=(self.record_size, 8))
+
+    def close(self):
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def stored_rows(path):
+    # the valid records of a store file one at a time, nothing when there is no store
+    if not path or not os.path.exists(path):
+        return
+    store = MetricsFile(path)
+    try:
+        yield from store.rows()
+    finally:
+        store.close()
+
+
+def dump_csv(path, out=sys.stdout):
+    store = MetricsFile(path)
+    out.write(",".join(store.columns) + "\n")
+    for row in store.rows():
+        out.write(",".join("" if v != v else repr(v) for v in row) + "\n")
+    store.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] not in ("dump", "info"):
+        sys.exit("usage: metricstore.py dump|info <file.umx>")
+    if sys.argv[1] == "dump":
+        dump_csv(sys.argv[2])
+    else:
+        store = MetricsFile(sys.argv[2])
+        print(f"{sys.argv[2]}: {store.count} records, columns {store.columns}")
@@ -0,0 +1,133 @@
+# Guest network backends.
+#
+#   user  slirp (-netdev user,hostfwd=...): the guest is reached on a forwarded host port. Slirp is a
+#         single-threaded userspace TCP stack and caps throughput well below what nginx or memcached
+#         can do, so at high concurrency it is slirp that gets measured.
+#   tap   a bridge and a multiqueue tap inside a network namespace of the run's own, with vhost-net
+#         moving packets in the host kernel. The guest is reached directly on 172.44.0.2, so the
+#         load generator has to run in the same namespace (ip netns exec).
+#
+# Every namespace is set up identically (br0 on 172.44.0.1/24, tap0, the guest on 172.44.0.2), so
+# runs side by side never collide. Unikraft takes its address on the kernel command line, Ubuntu
+# from a dnsmasq DHCP server on the bridge, and keeps slirp's default MAC, which is what the netplan
+# configuration in the image matches on.
+#
+#   python3 harness/netbackend.py up ueval0      # then: ip netns exec ueval0 python3 .../nginx.py
+#   python3 harness/netbackend.py down ueval0
+
+import argparse
+import os
+import shutil
+import signal
+import subprocess
+
+BACKENDS = ("user", "tap")
+BRIDGE = "br0"
+TAP = "tap0"
+HOST_IP = "172.44.0.1"
+GUEST_IP = "172.44.0.2"
+NETMASK = "255.255.255.0"
+PREFIX = 24
+GUEST_MAC = "52:54:00:12:34:56"
+DEFAULT_QUEUES = 2
+
+
+def backend():
+    name = os.environ.get("NET_BACKEND", "user")
+    if name not in BACKENDS:
+        raise ValueError(f"NET_BACKEND must be one of {', '.join(BACKENDS)}, not {name}")
+    return name
+
+
+def queues():
+    return int(os.environ.get("NET_QUEUES", DEFAULT_QUEUES))
+
+
+def netdev_args(netdev_id, name, host_port=None, guest_port=None, queue_count=DEFAULT_QUEUES):
+    # -netdev and -device of the guest NIC for backend name
+    if name == "user":
+        return ["-netdev", f"user,id={netdev_id},hostfwd=tcp::{host_port}-:{guest_port}",
+                "-device", f"virtio-net-pci,netdev={netdev_id}"]
+    netdev = f"tap,id={netdev_id},ifname={TAP},script=no,downscript=no,vhost=on"
+    device = f"virtio-net-pci,netdev={netdev_id},mac={GUEST_MAC}"
+    if queue_count > 1:
+        # one MSI-X vector per rx and tx queue, plus config and control
+        netdev += f",queues={queue_count}"
+        device += f",mq=on,vectors={2 * queue_count + 2}"
+    return ["-netdev", netdev, "-device", device]
+
+
+def unikraft_ip_args(append):
+    # static address for the unikernel, in front of its application arguments
+    params = f"netdev.ipv4_addr={GUEST_IP} netdev.ipv4_gw_addr={HOST_IP} netdev.ipv4_subnet_mask={NETMASK}"
+    kept = " ".join(arg for arg in append.split(" ") if not arg.startswith("netdev."))
+    if kept.startswith("--") or " -- " in kept:
+        return f"{params} {kept}".strip()
+    return f"{params} -- {kept}".strip()
+
+
+class Namespace:
+    def __init__(self, name, queue_count=DEFAULT_QUEUES):
+        self.name = name
+        self.queues = queue_count
+        self.pid_file = f"/run/{name}-dnsmasq.pid"
+
+    def ip(self, *args):
+        subprocess.run(["ip", "-n", self.name] + list(args), check=True, capture_output=True)
+
+    def exec_prefix(self):
+        return ["ip", "netns", "exec", self.name]
+
+    def up(self):
+        self.down()
+        subprocess.run(["ip", "netns", "add", self.name], check=True, capture_output=True)
+        self.ip("link", "set", "lo", "up")
+        self.ip("link", "add", BRIDGE, "type", "bridge")
+        self.ip("addr", "add", f"{HOST_IP}/{PREFIX}", "dev", BRIDGE)
+        self.ip("link", "set", BRIDGE, "up")
+        self.ip("tuntap", "add", "dev", TAP, "mode", "tap", *(["multi_queue"] if self.queues > 1 else []))
+        self.ip("link", "set", TAP, "master", BRIDGE)
+        self.ip("link", "set", TAP, "up")
+        if shutil.which("dnsmasq"):
+            # DHCP only (port 0 turns DNS off), one lease, the guest's address
+            subprocess.run(self.exec_prefix() + [
+                "dnsmasq", "--port=0", f"--interface={BRIDGE}", "--bind-interfaces",
+                f"--dhcp-range={GUEST_IP},{GUEST_IP},{NETMASK},1h", f"--dhcp-host={GUEST_MAC},{GUEST_IP}",
+                f"--pid-file={self.pid_file}", f"--dhcp-leasefile=/run/{self.name}-dnsmasq.leases",
+            ], check=True, capture_output=True)
+        return self
+
+    def down(self):
+        if os.path.exists(self.pid_file):
+            try:
+                with open(self.pid_file) as f:
+                    os.kill(int(f.read().strip()), signal.SIGTERM)
+            except (OSError, ValueError):
+                pass
+            os.unlink(self.pid_file)
+        # deleting the namespace removes the bridge and the tap with it
+        subprocess.run(["ip", "netns", "del", self.name], capture_output=True)
+
+    def __enter__(self):
+        return self.up()
+
+    def __exit__(self, *exc):
+        self.down()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Set up or tear down the tap/bridge namespace of one run")
+    parser.add_argument("action", choices=("up", "down"))
+    parser.add_argument("name")
+    parser.add_argument("--queues", type=int, default=DEFAULT_QUEUES)
+    args = parser.parse_args()
+    namespace = Namespace(args.name, args.queues)
+    if args.action == "up":
+        namespace.up()
+        print(f"{args.name}: {BRIDGE} {HOST_IP}/{PREFIX}, {TAP} ({args.queues} queues), guest {GUEST_IP}")
+    else:
+        namespace.down()
+
+
+if __name__ == "__main__":
+    main()
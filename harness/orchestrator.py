@@ -0,0 +1,727 @@
+# Runs a declarative experiment matrix (apps x platforms x load levels x repetitions) end to end:
+# boots the VM through the per-app harness script, waits for readiness, drives the load generator,
+# tears the VM down and files every artifact under results/ with the usual naming conventions.
+# Independent cells run in parallel on disjoint CPU sets when the host has enough cores.
+
+import argparse
+import itertools
+import json
+import os
+import queue
+import re
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from adaptive import DEFAULTS as ADAPTIVE_DEFAULTS, ABComparison
+from batch import Batch
+from netbackend import GUEST_IP, Namespace
+from overlay import fill as fill_overlays, seed_for
+from placement import place, slot_roles
+from resultsdb import ResultsDB, classify
+from runmeta import run_metadata
+
+HARNESS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(HARNESS_DIR)
+DEFAULT_MATRIX = os.path.join(HARNESS_DIR, "matrix.json")
+
+HARNESS_SCRIPTS = {
+    ("nginx", "unikraft"): os.path.join(REPO_ROOT, "Unikraft_scripts", "nginx", "nginx.py"),
+    ("nginx", "ubuntu"): os.path.join(REPO_ROOT, "linux_scripts", "nginx", "nginx.py"),
+    ("memcached", "unikraft"): os.path.join(REPO_ROOT, "Unikraft_scripts", "memcached", "memcached_startup_cpu_memory.py"),
+    ("memcached", "ubuntu"): os.path.join(REPO_ROOT, "linux_scripts", "memcached", "memcached.py"),
+}
+BASE_PORTS = {"nginx": 8080, "memcached": 11211}
+GUEST_PORTS = {"nginx": 80, "memcached": 11211}
+CPU_LOG_NAMES = {"unikraft": "cpu_usage_unikraft.log", "ubuntu": "cpu_usage_ubuntu.log"}
+
+READY_RE = re.compile(r"(?:startup time|is ready at) \+?([\d.]+)s")
+BOOT_MODE_RE = re.compile(r"Boot mode: (cold|restore)")
+QEMU_PID_RE = re.compile(r"QEMU started after .*\(PID: (\d+)\)")
+LOADGEN_GRACE = 120  # seconds a load generator may run past the configured duration
+FAILED_RE = re.compile(r"did not start in time|QEMU not found|Couldn't find QEMU|Exception occurred")
+
+print_lock = threading.Lock()
+stop_requested = threading.Event()
+active_runs = set()
+warm_pool = None
+
+
+def log(message):
+    with print_lock:
+        print(f"[{time.strftime('%H:%M:%S')}] {message}", flush=True)
+
+
+def load_matrix(path):
+    with open(path) as f:
+        matrix = json.load(f)
+    matrix.setdefault("repetitions", 5)
+    matrix.setdefault("duration", 30)
+    matrix.setdefault("threads", 4)
+    matrix.setdefault("results_dir", os.path.join(REPO_ROOT, "results"))
+    matrix.setdefault("cpus_per_cell", {"vm": 1, "loadgen": 2})
+    matrix["cpus_per_cell"].setdefault("io", 0)
+    matrix.setdefault("max_parallel", 0)
+    matrix.setdefault("ready_timeout", 60)
+    matrix.setdefault("sampler_hz", 100)
+    matrix.setdefault("app_stats_hz", 1)
+    matrix.setdefault("sched_hz", 10)
+    matrix.setdefault("housekeeping_cpu", None)
+    matrix.setdefault("adaptive", None)
+    matrix.setdefault("boot_mode", "cold")
+    matrix.setdefault("overlay_pool", 2)
+    matrix.setdefault("warm_pool", None)
+    matrix.setdefault("network", "user")
+    matrix.setdefault("net_queues", 2)
+    matrix.setdefault("sched_policy", None)
+    matrix.setdefault("sched_priority", 1)
+    return matrix
+
+
+def expand_cells(matrix):
+    cells = []
+    for app, spec in matrix["apps"].items():
+        for platform in matrix["platforms"]:
+            app_dir = spec.get("app_dirs", {}).get(platform)
+            if not app_dir:
+                log(f"Skipping {app}/{platform}: no app_dir configured")
+                continue
+            if app == "fibonacci":
+                # one boot per batch runs every input, batches run side by side like other cells
+                for batch in range(spec.get("batches", 1)):
+                    cells.append({
+                        "app": app,
+                        "platform": platform,
+                        "level": "batch",
+                        "rep": batch,
+                        "inputs": spec.get("inputs", []),
+                        "iterations": spec.get("iterations", matrix["repetitions"]),
+                        "app_dir": os.path.expanduser(app_dir),
+                    })
+                continue
+            for level in spec.get("concurrency") or []:
+                for rep in range(spec.get("repetitions", matrix["repetitions"])):
+                    cells.append({
+                        "app": app,
+                        "platform": platform,
+                        "level": level,
+                        "rep": rep,
+                        "app_dir": os.path.expanduser(app_dir.format(n=level)),
+                    })
+    return cells
+
+
+def cell_name(cell):
+    return f"{cell['app']}_{cell['platform']}_{cell['level']}_{cell['rep']}"
+
+
+def plan_slots(matrix):
+    cpus = sorted(os.sched_getaffinity(0))
+    if matrix["housekeeping_cpu"] in cpus and len(cpus) > 1:
+        # the resource samplers of all cells share the housekeeping core
+        cpus.remove(matrix["housekeeping_cpu"])
+    per_cell = matrix["cpus_per_cell"]
+    widths = [("vm_cpus", per_cell["vm"]), ("io_cpus", per_cell["io"]), ("loadgen_cpus", per_cell["loadgen"])]
+    count = matrix["max_parallel"] or len(cpus)
+    slots = [dict(roles, index=i) for i, roles in enumerate(slot_roles(cpus, widths, count))]
+    if not slots:
+        # not enough cores to isolate anything, let everything float
+        slots.append({"index": 0, "vm_cpus": cpus, "io_cpus": [], "loadgen_cpus": cpus})
+    return slots
+
+
+def standby_cpus(matrix, slots):
+    # CPUs no slot measures on, for instances waiting in the warm pool and their boots
+    cpus = set(os.sched_getaffinity(0))
+    used = {cpu for slot in slots for cpu in slot["vm_cpus"] + slot["io_cpus"] + slot["loadgen_cpus"]}
+    spare = sorted(cpus - used)
+    if spare:
+        return spare
+    if matrix["housekeeping_cpu"] in cpus:
+        return [matrix["housekeeping_cpu"]]
+    return sorted(cpus)
+
+
+def pinned(cpus):
+    def preexec():
+        os.setsid()
+        os.sched_setaffinity(0, cpus)
+    return preexec
+
+
+def output_paths(matrix, cell):
+    app, platform, level, rep = cell["app"], cell["platform"], cell["level"], cell["rep"]
+    if app == "nginx":
+        meta_dir = os.path.join(matrix["results_dir"], "nginx", f"nginx_{level}", "metadata")
+        bench_file = f"nginx_{platform}_run_{level}_{rep}.txt"
+    elif app == "memcached":
+        meta_dir = os.path.join(matrix["results_dir"], "memcached", f"memcached_{level}", "metadata")
+        bench_file = f"{platform}_run1_{rep}.json"
+    else:
+        meta_dir = os.path.join(matrix["results_dir"], "fibonacci", "metadata")
+        bench_file = f"fibonacci_{level}_{platform}.txt"
+    os.makedirs(meta_dir, exist_ok=True)
+    return meta_dir, os.path.join(meta_dir, bench_file)
+
+
+def benchmark_command(matrix, cell, host, port, out_file):
+    level = cell["level"]
+    threads = min(matrix["threads"], level)
+    spec = matrix["apps"][cell["app"]]
+    if cell["app"] == "nginx" and spec.get("loadgen") == "native":
+        # wrk-style summary on stdout as before, the full histogram next to it as json
+        return [
+            sys.executable, os.path.join(HARNESS_DIR, "httpload.py"), f"http://{host}:{port}/",
+            f"--connections={level}",
+            f"--processes={threads}",
+            f"--rate={spec.get('rate', 0)}",
+            f"--duration={matrix['duration']}",
+            f"--json-out-file={os.path.splitext(out_file)[0]}.json",
+        ]
+    if cell["app"] == "nginx":
+        return ["wrk", f"-t{threads}", f"-c{level}", f"-d{matrix['duration']}s", f"http://{host}:{port}/"]
+    if spec.get("loadgen") == "native":
+        # open loop at spec["rate"] ops/s when set, closed loop otherwise
+        return [
+            sys.executable, os.path.join(HARNESS_DIR, "mcload.py"),
+            "-s", host,
+            "-p", str(port),
+            f"--connections={level}",
+            f"--processes={threads}",
+            f"--rate={spec.get('rate', 0)}",
+            f"--test-time={matrix['duration']}",
+            f"--json-out-file={out_file}",
+        ]
+    return [
+        "memtier_benchmark",
+        "-s", host,
+        "-p", str(port),
+        "--protocol=memcache_text",
+        f"--threads={threads}",
+        f"--clients={max(1, level // threads)}",
+        f"--test-time={matrix['duration']}",
+        f"--json-out-file={out_file}",
+    ]
+
+
+class HarnessRun:
+    # Wraps one harness script (nginx.py, memcached.py, ...) running in its own session and
+    # follows its stdout so the orchestrator can react to the readiness line it prints. With tap
+    # networking the script runs in a network namespace of its own, torn down again in stop().
+
+    def __init__(self, script, app_dir, env, cpus, log_path, port, guest_port, netns=None):
+        self.ready = threading.Event()
+        self.failed = threading.Event()
+        self.startup_time = None
+        self.boot_mode = "cold"
+        self.qemu_pid = None
+        self.ready_at = None
+        self.taken_at = None
+        self.placement = None
+        self.port = port
+        self.netns = netns
+        # where the load generator finds the application
+        self.address = (GUEST_IP, guest_port) if netns else ("127.0.0.1", port)
+        self.log_file = open(log_path, "w")
+        self.proc = subprocess.Popen(
+            self.exec_prefix() + [sys.executable, "-u", script],
+            cwd=app_dir,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL,
+            text=True,
+            bufsize=1,
+            preexec_fn=pinned(cpus),
+        )
+        self.reader = threading.Thread(target=self._follow, daemon=True)
+        self.reader.start()
+        active_runs.add(self)
+
+    def exec_prefix(self):
+        return self.netns.exec_prefix() if self.netns else []
+
+    def _follow(self):
+        for line in self.proc.stdout:
+            self.log_file.write(line)
+            mode = BOOT_MODE_RE.search(line)
+            if mode:
+                self.boot_mode = mode.group(1)
+            pid = QEMU_PID_RE.search(line)
+            if pid:
+                self.qemu_pid = int(pid.group(1))
+            match = READY_RE.search(line)
+            if match and not self.ready.is_set():
+                self.startup_time = float(match.group(1))
+                self.ready_at = time.time()
+                self.ready.set()
+            elif FAILED_RE.search(line):
+                self.failed.set()
+        self.failed.set()
+
+    def wait_ready(self, timeout):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.ready.wait(0.05):
+                return True
+            if self.failed.is_set():
+                return False
+        return False
+
+    def stop(self, timeout=60):
+        if self.proc.poll() is None:
+            self.proc.send_signal(signal.SIGINT)
+            try:
+                self.proc.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                os.killpg(self.proc.pid, signal.SIGKILL)
+                self.proc.wait()
+        self.reader.join(timeout=5)
+        if not self.log_file.closed:
+            self.log_file.close()
+        if self.netns:
+            self.netns.down()
+        active_runs.discard(self)
+
+
+def append_csv(src_path, target):
+    if not os.path.exists(src_path):
+        return
+    with print_lock, open(src_path) as src:
+        lines = src.readlines()
+        with open(target, "a") as dst:
+            dst.writelines(lines if not os.path.getsize(target) else lines[1:])
+
+
+def write_cell_metadata(matrix, cell, target, harness_meta=None, **extra):
+    # what the harness read back from QEMU, plus how the orchestrator drove the cell
+    if harness_meta and os.path.exists(harness_meta):
+        with open(harness_meta) as f:
+            meta = json.load(f)
+    else:
+        meta = run_metadata(app_dir=cell["app_dir"])
+    spec = matrix["apps"][cell["app"]]
+    meta.setdefault("boot_mode", "cold")
+    meta.update(app=cell["app"], platform=cell["platform"], level=cell["level"], rep=cell["rep"],
+                loadgen=spec.get("loadgen"), rate=spec.get("rate"), duration=matrix["duration"],
+                sampler_hz=matrix["sampler_hz"], **extra)
+    with open(target, "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+def file_harness_artifacts(matrix, cell, work_dir, meta_dir, run):
+    app, platform, level, rep = cell["app"], cell["platform"], cell["level"], cell["rep"]
+    cpu_log = os.path.join(work_dir, CPU_LOG_NAMES[platform])
+    if os.path.exists(cpu_log):
+        shutil.move(cpu_log, os.path.join(meta_dir, f"cpu_usage_{platform}_run_{level}_{rep}.log"))
+    for name in ("console", "memory", "app_stats", "sched"):
+        per_run_log = os.path.join(work_dir, f"{name}_{platform}.log")
+        if os.path.exists(per_run_log):
+            shutil.move(per_run_log, os.path.join(meta_dir, f"{name}_{platform}_run_{level}_{rep}.log"))
+    for name in ("cpu", "memory", "app_stats", "sched"):
+        store = os.path.join(work_dir, f"{name}_{platform}.umx")
+        if os.path.exists(store):
+            shutil.move(store, os.path.join(meta_dir, f"{name}_{platform}_run_{level}_{rep}.umx"))
+    shutil.move(os.path.join(work_dir, "harness.log"), os.path.join(meta_dir, f"{app}_{platform}_run_{level}_{rep}_harness.log"))
+    # a pooled instance waited booted before its repetition took it
+    extra = {"warm_pool": True, "standby_s": round(run.taken_at - run.ready_at, 3)} if run.taken_at else {}
+    if run.placement:
+        extra["placement"] = run.placement
+    write_cell_metadata(matrix, cell, os.path.join(meta_dir, f"{app}_{platform}_run_{level}_{rep}_meta.json"),
+                        os.path.join(work_dir, "run_meta.json"), **extra)
+
+    startup_dir = os.path.join(matrix["results_dir"], app, "startup_avg")
+    os.makedirs(startup_dir, exist_ok=True)
+    if run.startup_time is not None:
+        # snapshot restores are a startup strategy of their own, kept apart from cold boots
+        suffix = "_restore" if run.boot_mode == "restore" else ""
+        with print_lock, open(os.path.join(startup_dir, f"startup_times_{app}_{platform}{suffix}.txt"), "a") as f:
+            f.write(f"{run.startup_time}\n")
+    # boot phase and memory summaries are kept next to the startup times, one csv per app and platform
+    append_csv(os.path.join(work_dir, "boot_phases.csv"), os.path.join(startup_dir, f"boot_phases_{app}_{platform}.csv"))
+    append_csv(os.path.join(work_dir, "memory_summary.csv"), os.path.join(startup_dir, f"memory_summary_{app}_{platform}.csv"))
+
+
+def boot_mode(matrix, app):
+    return matrix["apps"][app].get("boot_mode", matrix["boot_mode"])
+
+
+def prepare_ubuntu_disks(matrix, cells, parallel):
+    # one pooled overlay per parallel slot before the first boot, and the seed ISOs built once
+    # up front rather than by the first runs racing for them
+    matrix["overlay_pool"] = max(matrix["overlay_pool"], parallel)
+    for app_dir in sorted({c["app_dir"] for c in cells if c["platform"] == "ubuntu"}):
+        base = os.path.join(app_dir, "ubuntu.qcow2")
+        if not os.path.exists(base):
+            continue
+        seed_for(app_dir)
+        threading.Thread(target=fill_overlays, args=(base, matrix["overlay_pool"]), daemon=True).start()
+
+
+def network(matrix, app):
+    return matrix["apps"][app].get("network", matrix["network"])
+
+
+def start_harness(matrix, cell, port, work_dir, cpus):
+    # the harness script of cell on host port `port`, in a namespace of its own with tap networking
+    app = cell["app"]
+    netns = Namespace(f"ueval{port}", matrix["net_queues"]).up() if network(matrix, app) == "tap" else None
+    return HarnessRun(HARNESS_SCRIPTS[(app, cell["platform"])], cell["app_dir"], harness_env(matrix, app, port, work_dir),
+                      cpus, os.path.join(work_dir, "harness.log"), port, GUEST_PORTS[app], netns)
+
+
+def harness_env(matrix, app, port, work_dir):
+    env = dict(os.environ, METRICS_DIR=work_dir, HOST_PORT=str(port), SAMPLER_HZ=str(matrix["sampler_hz"]),
+               APP_STATS_HZ=str(matrix["app_stats_hz"]), SCHED_HZ=str(matrix["sched_hz"]),
+               BOOT_MODE=boot_mode(matrix, app), OVERLAY_POOL=str(matrix["overlay_pool"]),
+               NET_BACKEND=network(matrix, app), NET_QUEUES=str(matrix["net_queues"]))
+    if matrix["housekeeping_cpu"] is not None:
+        env["SAMPLER_CPU"] = str(matrix["housekeeping_cpu"])
+    return env
+
+
+def place_run(matrix, run, slot):
+    # vCPU, I/O and harness threads of a ready run onto the slot's CPUs, recorded with the run
+    if not run.qemu_pid:
+        return
+    housekeeping = matrix["housekeeping_cpu"]
+    run.placement = place(run.qemu_pid, slot["vm_cpus"], slot["io_cpus"], run.proc.pid,
+                          [housekeeping] if housekeeping in os.sched_getaffinity(0) else None,
+                          matrix["sched_policy"], matrix["sched_priority"])
+    run.placement["loadgen_cpus"] = slot["loadgen_cpus"]
+
+
+def port_free(port):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        try:
+            sock.bind(("127.0.0.1", port))
+            return True
+        except OSError:
+            return False
+
+
+class WarmPool:
+    # Keeps `size` booted instances per (app, platform, app_dir) ready on ports of their own, away
+    # from the measured CPUs. A repetition takes a ready instance, moves its QEMU onto the slot's
+    # vCPUs and runs the benchmark; the used instance is torn down and filed, and a replacement
+    # booted, in the background. Every repetition gets a fresh guest, no boot on the critical path.
+
+    def __init__(self, matrix, size, cpus):
+        self.matrix = matrix
+        self.size = size
+        self.cpus = cpus
+        self.ready = {}
+        self.lock = threading.Lock()
+        self.ports = itertools.count(100)
+        self.workers = []
+        self.closed = False
+
+    def _port(self, app):
+        with self.lock:
+            while True:
+                port = BASE_PORTS[app] + next(self.ports)
+                if port_free(port):
+                    return port
+
+    def _background(self, target, *args):
+        worker = threading.Thread(target=target, args=args, daemon=True)
+        worker.start()
+        with self.lock:
+            self.workers = [w for w in self.workers if w.is_alive()] + [worker]
+
+    def _boot(self, key):
+        app, platform, app_dir = key
+        if stop_requested.is_set():
+            return
+        work_dir = tempfile.mkdtemp(prefix=f"pool_{app}_{platform}_")
+        port = self._port(app)
+        run = start_harness(self.matrix, {"app": app, "platform": platform, "app_dir": app_dir}, port, work_dir, self.cpus)
+        run.work_dir = work_dir
+        if run.wait_ready(self.matrix["ready_timeout"]):
+            if not (self.closed or stop_requested.is_set()):
+                self.ready[key].put(run)
+                return
+        else:
+            log(f"pool {app}_{platform}: instance on port {port} not ready, see {work_dir}/harness.log")
+        run.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    def prime(self, keys):
+        for key in keys:
+            self.ready.setdefault(key, queue.Queue())
+            for _ in range(self.size):
+                self._background(self._boot, key)
+
+    def take(self, cell, slot):
+        # a ready instance placed on the slot's CPUs, None when none became ready in time
+        key = (cell["app"], cell["platform"], cell["app_dir"])
+        if key not in self.ready:
+            self.prime([key])
+        try:
+            run = self.ready[key].get(timeout=self.matrix["ready_timeout"])
+        except queue.Empty:
+            return None
+        self._background(self._boot, key)
+        run.taken_at = time.time()
+        place_run(self.matrix, run, slot)
+        return run
+
+    def recycle(self, run, cell, meta_dir):
+        def teardown():
+            run.stop()
+            file_harness_artifacts(self.matrix, cell, run.work_dir, meta_dir, run)
+            shutil.rmtree(run.work_dir, ignore_errors=True)
+        self._background(teardown)
+
+    def close(self):
+        # boots still under way stop their instance themselves once they see closed
+        self.closed = True
+        for worker in list(self.workers):
+            worker.join()
+        for ready in self.ready.values():
+            while not ready.empty():
+                run = ready.get()
+                run.stop()
+                shutil.rmtree(run.work_dir, ignore_errors=True)
+
+
+def run_loadgen(matrix, cmd, stdout, cpus):
+    # returncode, or None when it had to be killed; pinned() puts it in a session of its own, so
+    # its worker processes go down with it
+    proc = subprocess.Popen(cmd, stdout=stdout, preexec_fn=pinned(cpus))
+    try:
+        return proc.wait(timeout=matrix["duration"] + LOADGEN_GRACE)
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+        proc.wait()
+        return None
+
+
+def run_server_cell(matrix, cell, slot, work_dir):
+    meta_dir, bench_file = output_paths(matrix, cell)
+    run = warm_pool.take(cell, slot) if warm_pool else None
+    if run:
+        port = run.port
+        log(f"{cell_name(cell)}: took a warm instance (ready after {run.startup_time}s, "
+            f"idle {round(run.taken_at - run.ready_at, 1)}s) on port {port}")
+    else:
+        port = BASE_PORTS[cell["app"]] + slot["index"]
+        run = start_harness(matrix, cell, port, work_dir, slot["vm_cpus"] + slot["io_cpus"])
+    try:
+        if not run.ready.is_set() and not run.wait_ready(matrix["ready_timeout"]):
+            log(f"{cell_name(cell)}: not ready, see harness log")
+            return False
+        if not run.taken_at:
+            log(f"{cell_name(cell)}: ready after {run.startup_time}s on port {port}")
+            place_run(matrix, run, slot)
+
+        # with tap networking the load generator joins the guest's namespace
+        cmd = run.exec_prefix() + benchmark_command(matrix, cell, *run.address, bench_file)
+        if cell["app"] == "nginx":
+            with open(bench_file, "w") as f:
+                returncode = run_loadgen(matrix, cmd, f, slot["loadgen_cpus"])
+        else:
+            returncode = run_loadgen(matrix, cmd, subprocess.DEVNULL, slot["loadgen_cpus"])
+        if returncode is None:
+            log(f"{cell_name(cell)}: load generator still running {LOADGEN_GRACE}s after the run should have ended, killed")
+        return returncode == 0
+    finally:
+        if run.taken_at:
+            warm_pool.recycle(run, cell, meta_dir)
+        else:
+            run.stop()
+            file_harness_artifacts(matrix, cell, work_dir, meta_dir, run)
+
+
+def run_fibonacci_cell(matrix, cell, slot, work_dir):
+    # every result is appended to fibonacci_<n>_<platform>.txt as soon as the console shows it
+    meta_dir, _ = output_paths(matrix, cell)
+    platform = cell["platform"]
+    spec = matrix["apps"]["fibonacci"]
+
+    def record(n, elapsed_ns):
+        with print_lock, open(os.path.join(meta_dir, f"fibonacci_{n}_{platform}.txt"), "a") as f:
+            f.write(f"Elapsed time: {elapsed_ns} ns\n")
+
+    console_log = os.path.join(work_dir, f"console_{platform}.log")
+    batch = Batch(platform, cell["app_dir"], cell["inputs"], cell["iterations"], slot["vm_cpus"], spec.get("memory_mb", 128),
+                  console_log, record)
+    batch.run(spec.get("timeout", 3600))
+    if os.path.exists(console_log):
+        shutil.move(console_log, os.path.join(meta_dir, f"console_{platform}_batch_{cell['rep']}.log"))
+    for n in sorted({n for n, _ in batch.results}):
+        write_cell_metadata(matrix, dict(cell, level=n), os.path.join(meta_dir, f"fibonacci_{n}_{platform}_meta.json"),
+                            iterations=cell["iterations"], batch=cell["rep"])
+    expected = len(cell["inputs"]) * cell["iterations"]
+    if not batch.complete:
+        log(f"{cell_name(cell)}: {len(batch.results)}/{expected} results" + (", timed out" if batch.timed_out else ""))
+    return batch.complete
+
+
+def run_cell(matrix, cell, slots):
+    if stop_requested.is_set():
+        return False
+    slot = slots.get()
+    work_dir = tempfile.mkdtemp(prefix=f"{cell_name(cell)}_")
+    try:
+        log(f"{cell_name(cell)}: starting on slot {slot['index']} (vm cpus {slot['vm_cpus']}, io cpus {slot['io_cpus'] or 'shared'}, loadgen cpus {slot['loadgen_cpus']})")
+        if cell["app"] == "fibonacci":
+            ok = run_fibonacci_cell(matrix, cell, slot, work_dir)
+        else:
+            ok = run_server_cell(matrix, cell, slot, work_dir)
+        log(f"{cell_name(cell)}: {'done' if ok else 'FAILED'}")
+        return ok
+    except Exception as e:
+        log(f"{cell_name(cell)}: exception {e}")
+        return False
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        slots.put(slot)
+
+
+def cell_metric(matrix, cell, name):
+    # (value, trimmed) out of a finished cell's benchmark output, parsed the way resultsdb.py does;
+    # a *_steady metric falls back to the whole-run one when no steady window was found
+    _, bench_file = output_paths(matrix, cell)
+    spec = matrix["apps"][cell["app"]]
+    if cell["app"] == "nginx" and spec.get("loadgen") == "native":
+        bench_file = os.path.splitext(bench_file)[0] + ".json"
+    known = classify(bench_file) if os.path.exists(bench_file) else None
+    if not known:
+        return None, False
+    metrics = dict(metric for record in known[2]() for metric in record.metrics)
+    if name in metrics:
+        return metrics[name], name.endswith("_steady")
+    if name.endswith("_steady"):
+        return metrics.get(name[:-len("_steady")]), False
+    return None, False
+
+
+def run_adaptive(matrix, app, level, cells, slots):
+    # one app at one level: rounds of all platforms in shuffled order until the comparison is
+    # resolved or the budget is spent; returns [(cell, ok)]
+    settings = matrix["adaptive"]
+    metric = dict(ADAPTIVE_DEFAULTS["metrics"], **settings.get("metrics", {})).get(app)
+    platforms = [p for p in matrix["platforms"] if any(c["platform"] == p for c in cells)]
+    dirs = {c["platform"]: c["app_dir"] for c in cells}
+    comparison = ABComparison(platforms, settings, seed=f"{settings.get('seed', 0)}:{app}:{level}")
+    outcomes, untrimmed = [], []
+    start = time.time()
+    while not stop_requested.is_set():
+        rep = len(comparison.orders)
+        for platform in comparison.next_order():
+            cell = {"app": app, "platform": platform, "level": level, "rep": rep, "app_dir": dirs[platform]}
+            ok = run_cell(matrix, cell, slots)
+            outcomes.append((cell, ok))
+            value, trimmed = cell_metric(matrix, cell, metric) if ok else (None, False)
+            if value is not None and metric.endswith("_steady") and not trimmed:
+                log(f"{cell_name(cell)}: no steady window, compared on the whole run")
+                untrimmed.append({"platform": platform, "rep": rep})
+            comparison.add(platform, value)
+        decision = comparison.decide(time.time() - start)
+        for platform, c in comparison.summary()["comparisons"].items():
+            log(f"{app} {level}: {platform} vs {platforms[0]} {metric} {c['relative_difference']:+.2%} "
+                f"[{c['ci_low']:+.2%}, {c['ci_high']:+.2%}], Mann-Whitney p={c['p_value']:.3f} after {rep + 1} rounds")
+        if decision:
+            log(f"{app} {level}: stopping after {rep + 1} rounds ({decision})")
+            break
+    summary = dict(comparison.summary(), app=app, level=level, metric=metric, settings=comparison.settings, untrimmed=untrimmed)
+    os.makedirs(os.path.join(matrix["results_dir"], app), exist_ok=True)
+    with open(os.path.join(matrix["results_dir"], app, f"adaptive_{app}_{level}.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    return outcomes
+
+
+def run_matrix(matrix):
+    global warm_pool
+    all_cells = cells = expand_cells(matrix)
+    slot_list = plan_slots(matrix)
+    slots = queue.Queue()
+    for slot in slot_list:
+        slots.put(slot)
+
+    # with "adaptive" set, apps that run on more than one platform are compared round by round,
+    # one task per app and level, so levels run side by side on the slots while the rounds of
+    # one level run one after another
+    tasks = []
+    if matrix.get("adaptive"):
+        by_level = {}
+        for cell in cells:
+            by_level.setdefault((cell["app"], cell["level"]), []).append(cell)
+        for (app, level), level_cells in by_level.items():
+            # fibonacci has no per-level metric to compare on, its batches run as usual
+            if app in BASE_PORTS and len({c["platform"] for c in level_cells}) > 1:
+                tasks.append(lambda app=app, level=level, level_cells=level_cells:
+                             run_adaptive(matrix, app, level, level_cells, slots))
+                cells = [c for c in cells if (c["app"], c["level"]) != (app, level)]
+
+    # every Ubuntu run boots its own overlay of ubuntu.qcow2 and runs in parallel like the rest; in
+    # snapshot mode the cells of one image still run back to back, the first saves what the others restore
+    chains = {}
+    for cell in cells:
+        if cell["platform"] == "ubuntu" and boot_mode(matrix, cell["app"]) == "snapshot":
+            if cell["app_dir"] not in chains:
+                chains[cell["app_dir"]] = []
+                tasks.append(lambda chain=chains[cell["app_dir"]]: [(c, run_cell(matrix, c, slots)) for c in chain])
+            chains[cell["app_dir"]].append(cell)
+        else:
+            tasks.append(lambda cell=cell: [(cell, run_cell(matrix, cell, slots))])
+
+    def interrupt(signum, frame):
+        log("Interrupted, stopping running cells")
+        stop_requested.set()
+        for run in list(active_runs):
+            run.stop(timeout=30)
+
+    signal.signal(signal.SIGINT, interrupt)
+    signal.signal(signal.SIGTERM, interrupt)
+
+    # every cell, the adaptive ones taken out of cells above included
+    prepare_ubuntu_disks(matrix, all_cells, len(slot_list))
+    if matrix["warm_pool"]:
+        # boot the first instances of every server app while the tasks are being scheduled
+        warm_pool = WarmPool(matrix, matrix["warm_pool"].get("size", 1), standby_cpus(matrix, slot_list))
+        warm_pool.prime(sorted({(c["app"], c["platform"], c["app_dir"]) for c in all_cells if c["app"] in BASE_PORTS}))
+        log(f"Warm pool of {warm_pool.size} instance(s) per app and platform on cpus {warm_pool.cpus}")
+    log(f"Running {len(tasks)} tasks on {len(slot_list)} parallel slot(s)")
+    start = time.time()
+    try:
+        with ThreadPoolExecutor(max_workers=len(slot_list)) as pool:
+            outcomes = [outcome for task_outcomes in pool.map(lambda task: task(), tasks) for outcome in task_outcomes]
+    finally:
+        if warm_pool:
+            warm_pool.close()
+    failed = [cell_name(c) for c, ok in outcomes if not ok]
+    log(f"Matrix finished in {round(time.time() - start, 1)}s, {len(outcomes) - len(failed)}/{len(outcomes)} cells succeeded")
+    for name in failed:
+        log(f"  failed: {name}")
+    with ResultsDB(os.path.join(matrix["results_dir"], "results.sqlite")) as db:
+        ingested = db.ingest(matrix["results_dir"])
+    log(f"Indexed {ingested['ingested']} new result files into {matrix['results_dir']}/results.sqlite")
+    return not failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Unikraft vs Ubuntu experiment matrix unattended")
+    parser.add_argument("matrix", nargs="?", default=DEFAULT_MATRIX, help="path to the matrix JSON file")
+    parser.add_argument("--dry-run", action="store_true", help="only print the expanded cells and CPU slots")
+    args = parser.parse_args()
+
+    matrix = load_matrix(args.matrix)
+    if args.dry_run:
+        for slot in plan_slots(matrix):
+            print(f"slot {slot['index']}: vm {slot['vm_cpus']} io {slot['io_cpus']} loadgen {slot['loadgen_cpus']}")
+        for cell in expand_cells(matrix):
+            print(cell_name(cell), cell["app_dir"])
+        return
+    sys.exit(0 if run_matrix(matrix) else 1)
+
+
+if __name__ == "__main__":
+    main()
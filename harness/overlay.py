@@ -0,0 +1,207 @@
+# Disks for the Ubuntu guests: a thin qcow2 overlay per run on top of a read-only base image, and
+# the cloud-init seed ISO built from user-data.
+#
+# Every run boots its own overlay, so it starts from exactly the base disk whatever earlier runs
+# wrote, and runs sharing one base can boot in parallel. Overlays are taken from a pool of
+# pre-created ones next to the base (.overlays/<base fingerprint>/); taking one is a rename, which
+# is atomic between concurrent runs, and the pool is topped up again by a background process.
+# A changed base gets a new pool, the old overlays are never handed out against it. When the run
+# disk is on another file system than the pool (a work directory on a tmpfs /tmp), the overlay is
+# renamed into the pool's taken/ directory instead and the run disk is a symlink to it.
+#
+# The seed ISO is built once per content of user-data and meta-data and cached under their hash.
+#
+#   python3 harness/overlay.py fill ubuntu.qcow2 --size 4
+#   python3 harness/overlay.py seed ubuntu_minimal_cloud_image/user-data
+
+import argparse
+import errno
+import glob
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from runmeta import file_fingerprint
+
+HARNESS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_USER_DATA = os.path.join(HARNESS_DIR, "..", "ubuntu_minimal_cloud_image", "user-data")
+POOL_SIZE = 2
+ISO_TOOLS = (
+    ("genisoimage", lambda out, files: ["genisoimage", "-quiet", "-output", out, "-volid", "cidata", "-joliet", "-rock"] + files),
+    ("mkisofs", lambda out, files: ["mkisofs", "-quiet", "-output", out, "-volid", "cidata", "-joliet", "-rock"] + files),
+    ("xorriso", lambda out, files: ["xorriso", "-as", "mkisofs", "-quiet", "-output", out, "-volid", "cidata", "-joliet", "-rock"] + files),
+)
+
+
+def pool_dir(backing):
+    backing = os.path.abspath(backing)
+    return os.path.join(os.path.dirname(backing), ".overlays", file_fingerprint(backing) or "missing")
+
+
+def taken_dir(backing):
+    return os.path.join(pool_dir(backing), "taken")
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def prune_taken(backing):
+    # overlays held for runs whose process is gone without discarding them
+    for path in glob.glob(os.path.join(taken_dir(backing), "*.qcow2")):
+        pid = os.path.basename(path).split("-", 1)[0]
+        if pid.isdigit() and not pid_alive(int(pid)):
+            discard(path)
+
+
+def create_overlay(backing, path):
+    # written under a temporary name first, a half-created overlay is never picked up
+    partial = f"{path}.{os.getpid()}.partial"
+    subprocess.run(["qemu-img", "create", "-q", "-f", "qcow2", "-F", "qcow2", "-b", os.path.abspath(backing), partial],
+                   check=True, capture_output=True, timeout=60)
+    os.replace(partial, path)
+    return path
+
+
+def fill(backing, size=POOL_SIZE):
+    directory = pool_dir(backing)
+    os.makedirs(directory, exist_ok=True)
+    prune_taken(backing)
+    created = 0
+    while len(glob.glob(os.path.join(directory, "*.qcow2"))) < size:
+        fd, path = tempfile.mkstemp(suffix=".qcow2", dir=directory)
+        os.close(fd)
+        os.unlink(path)
+        create_overlay(backing, path)
+        created += 1
+    return created
+
+
+def refill_in_background(backing, size=POOL_SIZE):
+    # detached from the run, so a slow qemu-img never holds up the harness or its teardown
+    subprocess.Popen([sys.executable, os.path.abspath(__file__), "fill", os.path.abspath(backing), "--size", str(size)],
+                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, stdin=subprocess.DEVNULL,
+                     start_new_session=True)
+
+
+def take(backing, target, size=POOL_SIZE):
+    # a fresh overlay of backing at target, from the pool when one is ready
+    target = os.path.abspath(target)
+    discard(target)
+    pooled = False
+    for path in sorted(glob.glob(os.path.join(pool_dir(backing), "*.qcow2"))):
+        try:
+            os.rename(path, target)
+            pooled = True
+            break
+        except FileNotFoundError:
+            continue  # taken by a concurrent run
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                continue
+        # target is on another file system: hold the overlay next to the pool and link to it
+        held = os.path.join(taken_dir(backing), f"{os.getpid()}-{os.path.basename(path)}")
+        os.makedirs(os.path.dirname(held), exist_ok=True)
+        try:
+            os.rename(path, held)
+        except FileNotFoundError:
+            continue
+        os.symlink(held, target)
+        pooled = True
+        break
+    if not pooled:
+        create_overlay(backing, target)
+    if size:
+        refill_in_background(backing, size)
+    return target, pooled
+
+
+def discard(*paths):
+    # a run disk that links to an overlay held next to the pool takes the overlay with it
+    for path in paths:
+        if not path:
+            continue
+        if os.path.islink(path) and os.path.exists(os.path.realpath(path)):
+            os.unlink(os.path.realpath(path))
+        if os.path.lexists(path):
+            os.unlink(path)
+
+
+def user_data_path(app_dir="."):
+    # USER_DATA, else a user-data file in the app directory, else the one shipped in this repository
+    for path in (os.environ.get("USER_DATA"), os.path.join(app_dir, "user-data"), DEFAULT_USER_DATA):
+        if path and os.path.exists(path):
+            return os.path.abspath(path)
+    return None
+
+
+def seed_iso(user_data, cache_dir=None):
+    # the cached seed ISO for user-data and the meta-data next to it, built on first use
+    meta_data = os.path.join(os.path.dirname(user_data), "meta-data")
+    contents = []
+    for path in (user_data, meta_data):
+        contents.append(b"")
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                contents[-1] = f.read()
+    digest = hashlib.sha256(b"\0".join(contents)).hexdigest()[:16]
+    cache_dir = cache_dir or os.path.join(os.path.dirname(user_data), ".seeds")
+    iso = os.path.join(cache_dir, f"seed-{digest}.iso")
+    if os.path.exists(iso):
+        return iso
+    tool = next(((name, command) for name, command in ISO_TOOLS if shutil.which(name)), None)
+    if not tool:
+        raise RuntimeError(f"building the seed ISO needs one of {', '.join(name for name, _ in ISO_TOOLS)}")
+    os.makedirs(cache_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=cache_dir) as staging:
+        # cloud-init's NoCloud source wants exactly these two names at the root of the ISO
+        files = []
+        for name, content in zip(("user-data", "meta-data"), contents):
+            files.append(os.path.join(staging, name))
+            with open(files[-1], "wb") as f:
+                f.write(content)
+        partial = os.path.join(staging, "seed.iso")
+        subprocess.run(tool[1](partial, files), check=True, capture_output=True, timeout=60)
+        os.replace(partial, iso)
+    return iso
+
+
+def seed_for(app_dir="."):
+    # the cached seed ISO of the app's user-data, the app's own seed.iso when it cannot be built
+    user_data = user_data_path(app_dir)
+    if user_data:
+        try:
+            return seed_iso(user_data)
+        except (OSError, RuntimeError, subprocess.SubprocessError):
+            pass
+    return os.path.abspath(os.path.join(app_dir, "seed.iso"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Overlay pool and seed ISO cache for the Ubuntu guests")
+    sub = parser.add_subparsers(dest="command", required=True)
+    fill_parser = sub.add_parser("fill", help="pre-create overlays of a base image")
+    fill_parser.add_argument("base")
+    fill_parser.add_argument("--size", type=int, default=POOL_SIZE)
+    seed_parser = sub.add_parser("seed", help="build (or find) the seed ISO of a user-data file")
+    seed_parser.add_argument("user_data", nargs="?", default=DEFAULT_USER_DATA)
+    args = parser.parse_args()
+
+    if args.command == "fill":
+        created = fill(args.base, args.size)
+        print(f"{created} overlay(s) created in {pool_dir(args.base)}")
+    else:
+        print(seed_iso(os.path.abspath(args.user_data)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+# Thread placement: which CPUs the QEMU threads of a run and its load generator run on.
+#
+# Slots are cut from whole physical cores and, where they fit, from a single package. Inside a slot
+# every role gets cores of its own, so SMT siblings are never shared between two roles or slots:
+#
+#   vcpu     one CPU per vCPU thread, found over QMP (query-cpus-fast) or, failing that, from the
+#            thread names QEMU gives them with -name ...,debug-threads=on ("CPU 0/KVM")
+#   io       the QEMU main loop, its I/O and worker threads and the vhost workers of its NICs;
+#            on the vCPU CPUs when the slot has no io CPUs
+#   loadgen  wrk, memtier and the native load generators, pinned when they are started
+#   monitor  the harness script, kraft and the sampler, moved onto the housekeeping CPU
+#
+# A scheduling policy (SCHED_FIFO, SCHED_RR, SCHED_BATCH) can be put on the vCPU threads. A
+# realtime policy is only applied to vCPUs that do not share their CPU with the io threads, and
+# without the privilege to set it the run goes ahead on SCHED_OTHER; place() records what it did.
+
+import glob
+import os
+
+from kraftcmd import qmp_socket
+from proctree import descendants, proc_comm
+from qmp import QMPClient, QMPError
+from runmeta import qemu_cmdline
+from sampler import thread_role
+
+POLICIES = {"fifo": os.SCHED_FIFO, "rr": os.SCHED_RR, "batch": os.SCHED_BATCH, "other": os.SCHED_OTHER}
+REALTIME = {"fifo", "rr"}
+
+
+def read_int(path, default=0):
+    try:
+        with open(path) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return default
+
+
+def physical_cores(cpus):
+    # [(package, [logical cpus of one core]), ...] in package and core order
+    cores = {}
+    for cpu in cpus:
+        topology = f"/sys/devices/system/cpu/cpu{cpu}/topology"
+        key = (read_int(f"{topology}/physical_package_id"), read_int(f"{topology}/core_id", cpu))
+        cores.setdefault(key, []).append(cpu)
+    return [(package, sorted(siblings)) for (package, _), siblings in sorted(cores.items())]
+
+
+def slot_roles(cpus, widths, count):
+    # up to count slots of {role: CPUs} for widths [(role, CPUs)]: every role gets whole cores of
+    # its own, a sibling it does not need stays idle rather than going to another role or slot, and
+    # a slot is kept on one package when it fits
+    packages = {}
+    for package, siblings in physical_cores(cpus):
+        packages.setdefault(package, []).append(siblings)
+
+    def cut(cores):
+        # one slot off the front of cores and the cores left, None when they do not make one up
+        slot, used = {}, 0
+        for role, width in widths:
+            taken = []
+            while len(taken) < width:
+                if used == len(cores):
+                    return None, cores
+                taken += cores[used]
+                used += 1
+            slot[role] = taken[:width]
+        return slot, cores[used:]
+
+    slots, spill = [], []
+    for cores in packages.values():
+        slot, cores = cut(cores)
+        while slot:
+            slots.append(slot)
+            slot, cores = cut(cores)
+        spill += cores
+    # what is left of every package, when that still makes up slots
+    slot, spill = cut(spill)
+    while slot:
+        slots.append(slot)
+        slot, spill = cut(spill)
+    return slots[:count]
+
+
+def vcpu_threads(pid):
+    # [(vcpu index, tid)] over QMP, None when QEMU has no monitor for us (or it is busy)
+    try:
+        path = qmp_socket(qemu_cmdline(pid))
+    except OSError:
+        return None
+    if not path:
+        return None
+    try:
+        with QMPClient(path, timeout=2) as qmp:
+            return sorted((cpu["cpu-index"], cpu["thread-id"]) for cpu in qmp.execute("query-cpus-fast"))
+    except (QMPError, OSError, ValueError, KeyError):
+        return None
+
+
+def qemu_threads(pid):
+    # the QEMU threads by role: {"vcpu": [(index, tid)], "io": [tid, ...]} and where the vCPUs came from
+    vcpus = vcpu_threads(pid)
+    source = "qmp" if vcpus else "thread names"
+    io = []
+    named = []
+    for tid in sorted(int(t) for t in os.listdir(f"/proc/{pid}/task")):
+        role = thread_role(pid, tid, proc_comm(f"{pid}/task/{tid}"))
+        if role.startswith("vcpu"):
+            named.append((int(role[4:]), tid))
+        elif not vcpus or tid not in {t for _, t in vcpus}:
+            io.append(tid)
+    vcpus = vcpus or sorted(named)
+    if not vcpus:
+        source = "none"
+    # vhost workers are kernel threads named after the QEMU that owns them
+    for comm_path in glob.glob("/proc/[0-9]*/comm"):
+        if proc_comm(comm_path.split("/")[2]) == f"vhost-{pid}":
+            io.append(int(comm_path.split("/")[2]))
+    return {"vcpu": vcpus, "io": io, "source": source}
+
+
+def pin(tid, cpus):
+    try:
+        os.sched_setaffinity(tid, cpus)
+        return True
+    except OSError:
+        return False  # a thread that just exited
+
+
+def set_policy(tid, policy, priority):
+    try:
+        os.sched_setscheduler(tid, POLICIES[policy], os.sched_param(priority if policy in REALTIME else 0))
+        return True
+    except OSError:
+        return False
+
+
+def place(qemu_pid, vm_cpus, io_cpus=None, monitor_pid=None, monitor_cpus=None, policy=None, priority=1):
+    # pins the threads of a running QEMU (and its harness) and returns the placement for run metadata
+    threads = qemu_threads(qemu_pid)
+    io_cpus = list(io_cpus or vm_cpus)
+    record = {"vcpu_source": threads["source"], "vcpus": [], "io_cpus": io_cpus, "io_threads": len(threads["io"])}
+    # realtime vCPUs sharing a CPU with the main loop could starve it
+    shared = bool(set(io_cpus) & set(vm_cpus))
+    apply_policy = policy and not (policy in REALTIME and shared)
+    for index, tid in threads["vcpu"]:
+        cpus = [vm_cpus[index % len(vm_cpus)]]
+        pin(tid, cpus)
+        entry = {"index": index, "tid": tid, "cpus": cpus}
+        if apply_policy:
+            entry["policy"] = policy if set_policy(tid, policy, priority) else "other"
+        record["vcpus"].append(entry)
+    for tid in threads["io"]:
+        pin(tid, io_cpus)
+    if not threads["vcpu"]:
+        # roles unknown, the whole QEMU stays on the slot's vCPU CPUs
+        for tid in os.listdir(f"/proc/{qemu_pid}/task"):
+            pin(int(tid), vm_cpus)
+    if policy and not apply_policy:
+        record["policy_skipped"] = f"{policy} needs vCPU CPUs not shared with the io threads"
+    if monitor_pid and monitor_cpus:
+        moved = 0
+        for pid in [monitor_pid] + [p for p in descendants(monitor_pid) if p != qemu_pid]:
+            try:
+                tids = os.listdir(f"/proc/{pid}/task")
+            except OSError:
+                continue
+            moved += sum(pin(int(tid), monitor_cpus) for tid in tids)
+        record["monitor_cpus"] = list(monitor_cpus)
+        record["monitor_threads"] = moved
+    return record
@@ -0,0 +1,88 @@
+# Application-level readiness probes.
+#
+# A TCP accept is not readiness: slirp (-netdev user) accepts on the forwarded host port before the
+# guest application listens and then drops the connection. These probes only report ready once the
+# application answered its own protocol (HTTP 200 from nginx, "VERSION ..." from memcached), and keep
+# time-to-accept and time-to-first-byte as separate milestones. Connects are non-blocking and the
+# retry backoff starts in the tens of microseconds and stays below a millisecond, so the result is
+# not quantized to a sleep.
+
+import asyncio
+import time
+
+MIN_BACKOFF = 0.00002
+MAX_BACKOFF = 0.0005  # sub-millisecond readiness for the whole wait, not only its start
+IO_TIMEOUT = 1.0
+
+HTTP_REQUEST = "GET / HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n"
+MEMCACHED_REQUEST = "version\r\n"
+
+
+class ProbeResult:
+    def __init__(self):
+        self.accept_ns = None       # first TCP connect that succeeded
+        self.first_byte_ns = None   # first byte of any application reply
+        self.ready_ns = None        # first valid application reply
+        self.attempts = 0
+        self.reply = None
+
+    def since(self, start_ns):
+        # milestones in seconds relative to start_ns (a time.monotonic_ns() value)
+        def rel(ns):
+            return None if ns is None else (ns - start_ns) / 1e9
+        return {"accept": rel(self.accept_ns), "first_byte": rel(self.first_byte_ns), "ready": rel(self.ready_ns)}
+
+
+def http_ok(reply):
+    return reply.startswith(b"HTTP/1.") and reply[9:12] == b"200"
+
+
+def memcached_ok(reply):
+    return reply.startswith(b"VERSION ") and reply.endswith(b"\r\n")
+
+
+PROTOCOLS = {
+    "http": (HTTP_REQUEST, http_ok),
+    "memcached": (MEMCACHED_REQUEST, memcached_ok),
+}
+
+
+async def probe_once(host, port, protocol, result):
+    request, valid = PROTOCOLS[protocol]
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), IO_TIMEOUT)
+    try:
+        if result.accept_ns is None:
+            result.accept_ns = time.monotonic_ns()
+        writer.write(request.format(host=host).encode())
+        await writer.drain()
+        # only the status line / version line matters
+        reply = await asyncio.wait_for(reader.readline(), IO_TIMEOUT)
+        if reply and result.first_byte_ns is None:
+            result.first_byte_ns = time.monotonic_ns()
+        if valid(reply):
+            result.ready_ns = time.monotonic_ns()
+            result.reply = reply.decode(errors="replace").strip()
+            return True
+        return False
+    finally:
+        writer.close()
+
+
+async def wait_until_ready_async(host, port, protocol, timeout):
+    result = ProbeResult()
+    deadline = time.monotonic() + timeout
+    backoff = MIN_BACKOFF
+    while time.monotonic() < deadline:
+        result.attempts += 1
+        try:
+            if await probe_once(host, port, protocol, result):
+                return result
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            pass
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, MAX_BACKOFF)
+    return result
+
+
+def wait_until_ready(host, port, protocol, timeout=15):
+    return asyncio.run(wait_until_ready_async(host, port, protocol, timeout))
@@ -0,0 +1,115 @@
+# Resolves the QEMU process that belongs to *this* harness run straight from our own process tree
+# instead of scanning every process on the host and matching on the port in its cmdline.
+#
+# The harness marks itself as a child subreaper, so even a QEMU that daemonizes (double fork) is
+# re-parented to us and stays inside the tree we walk. The QEMU is held through a pidfd so a PID
+# reused after exit can never be confused with it.
+
+import ctypes
+import os
+import signal
+import select
+import time
+
+PR_SET_CHILD_SUBREAPER = 36
+
+
+def enable_child_subreaper():
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        return libc.prctl(PR_SET_CHILD_SUBREAPER, 1, 0, 0, 0) == 0
+    except (OSError, AttributeError):
+        return False
+
+
+def children(pid):
+    kids = []
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                kids.extend(int(k) for k in f.read().split())
+    except OSError:
+        pass
+    return kids
+
+
+def descendants(pid):
+    found, stack = [], [pid]
+    while stack:
+        for kid in children(stack.pop()):
+            found.append(kid)
+            stack.append(kid)
+    return found
+
+
+def proc_comm(pid):
+    try:
+        with open(f"/proc/{pid}/comm") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+class QemuHandle:
+    def __init__(self, pid, exec_ns):
+        self.pid = pid
+        self.exec_ns = exec_ns  # time.monotonic_ns() at which the exec was observed
+        self.pidfd = os.pidfd_open(pid) if hasattr(os, "pidfd_open") else None
+
+    def wall_time(self):
+        # exec_ns expressed on the time.time() clock the harnesses use for their other timestamps
+        return time.time() - (time.monotonic_ns() - self.exec_ns) / 1e9
+
+    def seconds_since(self, start_ns):
+        return (self.exec_ns - start_ns) / 1e9
+
+    def exited(self, timeout=0):
+        if self.pidfd is None:
+            return not os.path.exists(f"/proc/{self.pid}")
+        readable, _, _ = select.select([self.pidfd], [], [], timeout)
+        return bool(readable)
+
+    def terminate(self, timeout=5):
+        if self.exited():
+            return True
+        try:
+            if self.pidfd is not None:
+                signal.pidfd_send_signal(self.pidfd, signal.SIGTERM)
+            else:
+                os.kill(self.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return True
+        if self.exited(timeout):
+            return True
+        try:
+            if self.pidfd is not None:
+                signal.pidfd_send_signal(self.pidfd, signal.SIGKILL)
+            else:
+                os.kill(self.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        return self.exited(timeout)
+
+    def close(self):
+        if self.pidfd is not None:
+            os.close(self.pidfd)
+            self.pidfd = None
+
+
+def from_popen(popen):
+    # Popen only returns once the child has exec'd (the CLOEXEC error pipe closed),
+    # so the QEMU we launched ourselves is known exactly and immediately
+    return QemuHandle(popen.pid, time.monotonic_ns())
+
+
+def wait_for_qemu_child(root_pid=None, timeout=15, poll_interval=0.0005):
+    # Only our own (usually two or three) descendants are looked at, so a tight poll is cheap.
+    # comm switches to "qemu-system-*" at exec, which gives the exec time to within poll_interval.
+    root_pid = root_pid or os.getpid()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for pid in descendants(root_pid):
+            if proc_comm(pid).startswith("qemu-system"):
+                return QemuHandle(pid, time.monotonic_ns())
+        time.sleep(poll_interval)
+    return None
@@ -0,0 +1,71 @@
+# Minimal QEMU Machine Protocol client over the unix socket given to QEMU with
+#   -qmp unix:<path>,server=on,wait=off
+# Asynchronous events are skipped, only command replies are returned.
+
+import json
+import socket
+import time
+
+
+class QMPError(Exception):
+    pass
+
+
+class QMPClient:
+    def __init__(self, path, timeout=5):
+        self.path = path
+        self.timeout = timeout
+        self.sock = None
+        self.reader = None
+
+    def connect(self, wait=10):
+        deadline = time.monotonic() + wait
+        while True:
+            try:
+                self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.sock.settimeout(self.timeout)
+                self.sock.connect(self.path)
+                break
+            except OSError:
+                self.sock.close()
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.01)
+        self.reader = self.sock.makefile("r")
+        greeting = json.loads(self.reader.readline())
+        if "QMP" not in greeting:
+            raise QMPError(f"unexpected QMP greeting: {greeting}")
+        self.execute("qmp_capabilities")
+        return self
+
+    def execute(self, command, **arguments):
+        message = {"execute": command}
+        if arguments:
+            message["arguments"] = arguments
+        self.sock.sendall(json.dumps(message).encode() + b"\n")
+        while True:
+            line = self.reader.readline()
+            if not line:
+                raise QMPError("QMP connection closed")
+            reply = json.loads(line)
+            if "event" in reply:
+                continue
+            if "error" in reply:
+                raise QMPError(f"{command}: {reply['error'].get('desc', reply['error'])}")
+            return reply.get("return")
+
+    def hmp(self, command_line):
+        return self.execute("human-monitor-command", **{"command-line": command_line})
+
+    def close(self):
+        if self.reader:
+            self.reader.close()
+        if self.sock:
+            self.sock.close()
+        self.sock = self.reader = None
+
+    def __enter__(self):
+        return self.connect()
+
+    def __exit__(self, *exc):
+        self.close()
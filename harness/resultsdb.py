@@ -0,0 +1,701 @@
+# Indexed SQLite store for everything under results/.
+#
+# ingest walks a results tree, recognises the files the harnesses and load generators write (wrk /
+# httpload text and json, fsbench json, memtier / mcload json, fibonacci and microbench logs,
+# startup times, CPU, memory, application stats and schedstat logs, boot phase and memory
+# summaries, per-run metadata) and loads them as runs with metrics, time series samples and encoded
+# HDR histograms. A run is one app x platform x level x repetition in one directory and carries the
+# metadata the harness read back from QEMU (memory, vCPUs, images, QEMU version, kraft config hash,
+# host fingerprint) when a *_meta.json exists for it.
+#
+# Ingestion is incremental: files whose size and mtime did not change are skipped without being
+# read, files whose content hash is already in the store are skipped, and a file whose content
+# changed has its old rows replaced.
+#
+#   python3 harness/resultsdb.py ingest results/
+#   python3 harness/resultsdb.py metric gets_latency_p99_ms --app memcached --platform unikraft --level 1000 --by kraft_config_hash
+#   python3 harness/resultsdb.py query "SELECT platform, avg(value) FROM runs JOIN metrics ON metrics.run_id = runs.id WHERE name = 'requests_per_sec' GROUP BY platform"
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+
+from apptelemetry import COUNTERS as APP_COUNTERS
+from schedstat import read_log as read_sched_log, vcpu_summary, vcpus_seen
+from steady import memtier_window, steady_window, within
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_DB = os.path.join(REPO_ROOT, "results", "results.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    sha256 TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    size INTEGER,
+    mtime REAL,
+    ingested_at REAL
+);
+CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256);
+
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    app TEXT,
+    platform TEXT,
+    level INTEGER,
+    rep INTEGER,
+    dir TEXT,
+    label TEXT,
+    source TEXT,
+    memory_mb INTEGER,
+    smp INTEGER,
+    qemu_version TEXT,
+    image_hash TEXT,
+    kraft_config_hash TEXT,
+    host TEXT,
+    host_fingerprint TEXT,
+    loadgen TEXT,
+    rate REAL,
+    meta TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_cell ON runs (app, platform, level);
+CREATE INDEX IF NOT EXISTS runs_label ON runs (label);
+
+CREATE TABLE IF NOT EXISTS metrics (
+    run_id INTEGER NOT NULL,
+    file_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    value REAL
+);
+CREATE INDEX IF NOT EXISTS metrics_name ON metrics (name, run_id);
+CREATE INDEX IF NOT EXISTS metrics_file ON metrics (file_id);
+
+CREATE TABLE IF NOT EXISTS samples (
+    run_id INTEGER NOT NULL,
+    file_id INTEGER NOT NULL,
+    series TEXT NOT NULL,
+    t REAL,
+    value REAL
+);
+CREATE INDEX IF NOT EXISTS samples_run ON samples (run_id, series);
+CREATE INDEX IF NOT EXISTS samples_file ON samples (file_id);
+
+CREATE TABLE IF NOT EXISTS histograms (
+    run_id INTEGER NOT NULL,
+    file_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    encoded TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS histograms_run ON histograms (run_id, name);
+CREATE INDEX IF NOT EXISTS histograms_file ON histograms (file_id);
+"""
+
+META_COLUMNS = ("memory_mb", "smp", "qemu_version", "image_hash", "kraft_config_hash", "host", "host_fingerprint", "loadgen", "rate")
+
+PLATFORMS = "unikraft|ubuntu"
+WRK_RE = re.compile(rf"^nginx_+(?:manual_)?({PLATFORMS})_run_(\d+)_(\d+)\.txt$")
+HTTPLOAD_RE = re.compile(rf"^nginx_({PLATFORMS})_run_(\d+)_(\d+)\.json$")
+MEMTIER_RE = re.compile(rf"^({PLATFORMS})_run1?_(\d+)\.json$")
+FIBONACCI_RE = re.compile(rf"^fibonacci_(\d+)_({PLATFORMS})\.txt$")
+MICROBENCH_RE = re.compile(rf"^microbench_({PLATFORMS})\.txt$")
+FS_RE = re.compile(r"^fs_(9pfs|initrd|blk|ubuntu)_(\d+)_run_(\d+)_(\d+)\.json$")
+STARTUP_RE = re.compile(rf"^(?:startup_times(?:_(nginx|memcached))?(?:_({PLATFORMS}))?(_restore)?\.txt|(nginx|memcached)_start\.log)$")
+CPU_LOG_RE = re.compile(rf"^cpu_usage_({PLATFORMS})(?:_run_(\d+)_(\d+))?\.log$")
+MEMORY_LOG_RE = re.compile(rf"^memory_({PLATFORMS})_run_(\d+)_(\d+)\.log$")
+APP_STATS_RE = re.compile(rf"^app_stats_({PLATFORMS})_run_(\d+)_(\d+)\.log$")
+SCHED_RE = re.compile(rf"^sched_({PLATFORMS})_run_(\d+)_(\d+)\.log$")
+BOOT_PHASES_RE = re.compile(rf"^boot_phases_(nginx|memcached)_({PLATFORMS})\.csv$")
+MEMORY_SUMMARY_RE = re.compile(rf"^memory_summary_(nginx|memcached)_({PLATFORMS})\.csv$")
+META_RE = re.compile(rf"^(?:(nginx|memcached)_({PLATFORMS})_run_(\d+)_(\d+)|fibonacci_(\d+)_({PLATFORMS}))_meta\.json$")
+LEVEL_DIR_RE = re.compile(r"^(?:nginx|memcached?)_?(\d+)$")
+
+WRK_LATENCY_RE = re.compile(r"^\s*Latency\s+(.*)$", re.M)
+WRK_PERCENTILE_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)%\s+([\d.]+)(us|ms|s)\s*$", re.M)
+WRK_REQUESTS_RE = re.compile(r"(\d+) requests in ([\d.]+)(us|ms|s|m)")
+WRK_REQ_SEC_RE = re.compile(r"Requests/sec:\s+([\d.]+)")
+WRK_TRANSFER_RE = re.compile(r"Transfer/sec:\s+([\d.]+)([KMG]?B)")
+WRK_SOCKET_RE = re.compile(r"Socket errors: connect (\d+), read (\d+), write (\d+), timeout (\d+)")
+WRK_NON2XX_RE = re.compile(r"Non-2xx or 3xx responses: (\d+)")
+ELAPSED_RE = re.compile(r"Elapsed time:\s+(\d+)\s+ns")
+BENCH_RE = re.compile(r"\bBENCH\s+(.*)$")
+BENCH_FIELD_RE = re.compile(r"(\w+)=(\S+)")
+
+TIME_UNITS_MS = {"us": 0.001, "ms": 1.0, "s": 1000.0, "m": 60000.0}
+BYTE_UNITS = {"B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+
+
+def percentile_name(value):
+    # 99.00 -> p99, 99.90 -> p99.9
+    return f"p{float(value):g}"
+
+
+def snake(text):
+    return re.sub(r"[^a-z0-9]+", "_", text.lower()).strip("_")
+
+
+def number(text):
+    try:
+        value = float(text)
+    except (TypeError, ValueError):
+        return None
+    return value if value == value else None
+
+
+def level_from_dir(path):
+    # results/nginx/nginx_100/metadata/x.txt -> 100
+    parts = os.path.normpath(os.path.dirname(path)).split(os.sep)
+    for part in reversed(parts[-3:]):
+        match = LEVEL_DIR_RE.match(part)
+        if match:
+            return int(match.group(1))
+    return None
+
+
+def app_from_dir(path):
+    parts = os.path.normpath(path).split(os.sep)
+    for app in ("nginx", "memcached", "fibonacci", "microbench"):
+        if app in parts:
+            return app
+    return None
+
+
+class Record:
+    # what one file contributes to one run
+    def __init__(self, source, app, platform, level=None, rep=None, label=None):
+        self.key = {"app": app, "platform": platform, "level": level, "rep": rep, "label": label}
+        self.source = source
+        self.metrics = []
+        self.samples = []
+        self.histograms = []
+        self.meta = None
+
+    def metric(self, name, value):
+        value = number(value)
+        if value is not None:
+            self.metrics.append((name, value))
+
+
+def parse_wrk(path, platform, level, rep):
+    with open(path, errors="replace") as f:
+        text = f.read()
+    record = Record("wrk", "nginx", platform, level, rep)
+    match = WRK_LATENCY_RE.search(text)
+    if match:
+        values = re.findall(r"([\d.]+)(us|ms|s)\b", match.group(1))
+        for name, (value, unit) in zip(("latency_avg_ms", "latency_stdev_ms", "latency_max_ms"), values):
+            record.metric(name, float(value) * TIME_UNITS_MS[unit])
+    for pct, value, unit in WRK_PERCENTILE_RE.findall(text):
+        record.metric(f"latency_{percentile_name(pct)}_ms", float(value) * TIME_UNITS_MS[unit])
+    match = WRK_REQUESTS_RE.search(text)
+    if match:
+        record.metric("requests", match.group(1))
+    match = WRK_REQ_SEC_RE.search(text)
+    if match:
+        record.metric("requests_per_sec", match.group(1))
+    match = WRK_TRANSFER_RE.search(text)
+    if match:
+        record.metric("transfer_per_sec_bytes", float(match.group(1)) * BYTE_UNITS[match.group(2)])
+    match = WRK_SOCKET_RE.search(text)
+    for kind, value in zip(("connect", "read", "write", "timeout"), match.groups() if match else (0, 0, 0, 0)):
+        record.metric(f"errors_{kind}", value)
+    match = WRK_NON2XX_RE.search(text)
+    record.metric("errors_status", match.group(1) if match else 0)
+    return [record]
+
+
+def parse_httpload(path, platform, level, rep, app="nginx", label=None):
+    with open(path) as f:
+        data = json.load(f)
+    record = Record("httpload", app, platform, level, rep, label)
+    record.metric("requests", data["requests"])
+    record.metric("requests_per_sec", data["requests_per_sec"])
+    record.metric("transfer_per_sec_bytes", data["transfer_per_sec"])
+    latency = data["latency_ms"]
+    for key, name in (("mean", "avg"), ("stdev", "stdev"), ("min", "min"), ("max", "max")):
+        record.metric(f"latency_{name}_ms", latency[key])
+    for key, value in latency["percentiles"].items():
+        record.metric(f"latency_{percentile_name(key[1:])}_ms", value)
+    for kind, value in data["errors"].items():
+        record.metric(f"errors_{kind}", value)
+    for entry in data.get("time_series", []):
+        record.samples.append(("requests", entry["second"], entry["requests"]))
+        record.samples.append(("latency_p99_ms", entry["second"], entry.get("p99.00_ms")))
+    if data.get("histogram"):
+        record.histograms.append(("latency", data["histogram"]))
+    return [record]
+
+
+def parse_memtier(path, platform, level, rep):
+    # memtier_benchmark and mcload.py share this layout
+    with open(path) as f:
+        data = json.load(f)
+    stats = data.get("ALL STATS", {})
+    source = "mcload" if "mode" in data.get("configuration", {}) else "memtier"
+    record = Record(source, "memcached", platform, level, rep)
+    for op in ("Gets", "Sets", "Totals"):
+        s = stats.get(op)
+        if not s:
+            continue
+        prefix = op.lower()
+        record.metric(f"{prefix}_count", s.get("Count"))
+        record.metric(f"{prefix}_ops_per_sec", s.get("Ops/sec"))
+        record.metric(f"{prefix}_latency_avg_ms", s.get("Average Latency"))
+        record.metric(f"{prefix}_latency_min_ms", s.get("Min Latency"))
+        record.metric(f"{prefix}_latency_max_ms", s.get("Max Latency"))
+        record.metric(f"{prefix}_kb_per_sec", s.get("KB/sec"))
+        if op == "Gets":
+            record.metric("gets_hits_per_sec", s.get("Hits/sec"))
+            record.metric("gets_misses_per_sec", s.get("Misses/sec"))
+        percentiles = s.get("Percentile Latencies") or {}
+        for key, value in percentiles.items():
+            if key.startswith("p"):
+                record.metric(f"{prefix}_latency_{percentile_name(key[1:])}_ms", value)
+        encoded = (percentiles.get("Histogram log format") or {}).get("Compressed Histogram")
+        if encoded:
+            record.histograms.append((prefix, encoded))
+        for second, entry in (s.get("Time-Serie") or {}).items():
+            record.samples.append((f"{prefix}_count", int(second), entry.get("Count")))
+            record.samples.append((f"{prefix}_latency_avg_ms", int(second), entry.get("Average Latency")))
+            if "p99.00" in entry:
+                record.samples.append((f"{prefix}_latency_p99_ms", int(second), entry["p99.00"]))
+    if "Errors" in stats:
+        record.metric("errors", stats["Errors"])
+    window = memtier_window(stats.get("Totals") or {})
+    # 0 when the *_steady metrics are missing and only whole-run figures exist
+    record.metric("steady_trimmed", 1 if window else 0)
+    if window:
+        record.metric("steady_start_s", window[0])
+        record.metric("steady_end_s", window[1])
+        for op in ("Gets", "Sets", "Totals"):
+            series = (stats.get(op) or {}).get("Time-Serie") or {}
+            kept = [entry for second, entry in series.items() if window[0] <= int(second) <= window[1]]
+            count = sum(entry.get("Count", 0) for entry in kept)
+            record.metric(f"{op.lower()}_ops_per_sec_steady", count / (window[1] - window[0] + 1))
+            if count:
+                record.metric(f"{op.lower()}_latency_avg_ms_steady",
+                              sum(entry.get("Count", 0) * entry.get("Average Latency", 0.0) for entry in kept) / count)
+    return [record]
+
+
+def parse_fibonacci(path, level, platform):
+    records = []
+    with open(path, errors="replace") as f:
+        for line in f:
+            match = ELAPSED_RE.search(line)
+            if match:
+                record = Record("fibonacci", "fibonacci", platform, level, len(records))
+                record.metric("elapsed_ns", match.group(1))
+                records.append(record)
+    return records
+
+
+def parse_microbench(path, platform):
+    # one run per suite= line; test malloc_free at param 4096 gives malloc_free_4096_ns_per_op, ...
+    records = []
+    with open(path, errors="replace") as f:
+        for line in f:
+            match = BENCH_RE.search(line)
+            if not match:
+                continue
+            fields = dict(BENCH_FIELD_RE.findall(match.group(1)))
+            if "suite" in fields:
+                records.append(Record("microbench", "microbench", platform, rep=len(records)))
+            elif records and "test" in fields and "ns_per_op" in fields:
+                name = fields["test"] if fields.get("param", "0") == "0" else f"{fields['test']}_{fields['param']}"
+                for key in ("ns_per_op", "min_ns_per_op", "mb_per_s"):
+                    if key in fields:
+                        records[-1].metric(f"{name}_{key}", fields[key])
+    return records
+
+
+def parse_startup(path, app, platform, restore=False):
+    # cold boots give startup_s, snapshot restores (the *_restore.txt files) startup_restore_s
+    records = []
+    with open(path, errors="replace") as f:
+        for line in f:
+            line = line.strip()
+            if not platform and re.search(PLATFORMS, line):
+                platform = re.search(PLATFORMS, line).group(0)
+            value = number(line[:-1] if line.endswith("s") else line)
+            if value is None:
+                continue
+            record = Record("startup_log", app, platform, rep=len(records))
+            record.metric("startup_restore_s" if restore else "startup_s", value)
+            records.append(record)
+    return records
+
+
+def parse_cpu_log(path, platform, level, rep):
+    record = Record("cpu_log", app_from_dir(path), platform, level, rep)
+    series = None
+    times, cpu, memory = [], [], []
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            if not row:
+                continue
+            if series is None or row[0] == "Time Elapsed":
+                series = [snake(name.replace("(%)", "percent").replace("(KB)", "kb")) for name in row[1:]]
+                continue
+            t = number(row[0])
+            for name, value in zip(series, row[1:]):
+                value = number(value)
+                if value is not None:
+                    record.samples.append((name, t, value))
+            times.append(t if t is not None else float(len(times)))
+            cpu.append(number(row[1]) or 0.0)
+            memory.append(number(row[2]) or 0.0)
+    if cpu:
+        record.metric("cpu_avg_percent", sum(cpu) / len(cpu))
+        record.metric("cpu_max_percent", max(cpu))
+        record.metric("memory_avg_kb", sum(memory) / len(memory))
+        record.metric("memory_max_kb", max(memory))
+        # steady part of the CPU series in batches of about one second
+        interval = (times[-1] - times[0]) / (len(times) - 1) if len(times) > 1 and times[-1] > times[0] else 1.0
+        window = steady_window(times, cpu, batch=max(1, round(1 / interval)))
+        if window:
+            kept = within(times, window)
+            record.metric("cpu_steady_start_s", window[0])
+            record.metric("cpu_steady_end_s", window[1])
+            record.metric("cpu_avg_percent_steady", sum(cpu[i] for i in kept) / len(kept))
+            record.metric("memory_avg_kb_steady", sum(memory[i] for i in kept) / len(kept))
+    return [record]
+
+
+def parse_memory_log(path, platform, level, rep):
+    record = Record("memory_log", app_from_dir(path), platform, level, rep)
+    peaks = {}
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            t = number(row.get("Time Elapsed"))
+            for column, value in row.items():
+                if column == "Time Elapsed":
+                    continue
+                value = number(value)
+                if value is None:
+                    continue
+                name = snake(column.replace("(KB)", "kb"))
+                record.samples.append((name, t, value))
+                peaks[name] = max(peaks.get(name, value), value)
+    for name in ("pss_kb", "uss_kb", "guest_touched_kb", "qemu_overhead_kb"):
+        if name in peaks:
+            record.metric(f"{name[:-3]}_peak_kb", peaks[name])
+    return [record]
+
+
+def parse_app_stats(path, platform, level, rep):
+    # counters as their increase over the run, gauges as their peak
+    record = Record("app_stats", app_from_dir(path), platform, level, rep)
+    first, last, peaks = {}, {}, {}
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            t = number(row.get("t"))
+            for name, value in row.items():
+                value = number(value)
+                if name == "t" or value is None:
+                    continue
+                record.samples.append((f"app_{name}", t, value))
+                first.setdefault(name, value)
+                last[name] = value
+                peaks[name] = max(peaks.get(name, value), value)
+    for name in APP_COUNTERS.get(record.key["app"], ()):
+        if name in first:
+            record.metric(f"app_{name}_delta", last[name] - first[name])
+    for name in ("curr_connections", "curr_items", "bytes", "active", "waiting"):
+        if name in peaks:
+            record.metric(f"app_{name}_max", peaks[name])
+    lookups = last.get("get_hits", 0) - first.get("get_hits", 0) + last.get("get_misses", 0) - first.get("get_misses", 0)
+    if lookups:
+        record.metric("app_get_hit_ratio", (last["get_hits"] - first["get_hits"]) / lookups)
+    return [record]
+
+
+def parse_sched(path, platform, level, rep):
+    # per vCPU: run-queue delay, idle time and switches over the run, and their series
+    record = Record("sched", app_from_dir(path), platform, level, rep)
+    columns, rows = read_sched_log(path)
+    t = columns.index("t")
+    for vcpu in vcpus_seen(rows, columns):
+        for metric in ("run_ms", "wait_ms", "nvcs"):
+            i = columns.index(f"{vcpu}_{metric}")
+            record.samples.extend((f"{vcpu}_{metric}", row[t], row[i]) for row in rows)
+        for name, value in vcpu_summary(rows, columns, vcpu).items():
+            record.metric(f"{vcpu}_{name}", value)
+    return [record]
+
+
+def parse_boot_phases(path, app, platform):
+    records = {}
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            label = row["Run"]
+            record = records.setdefault(label, Record("boot_phases", app, platform, label=label))
+            record.metric(f"boot_{snake(row['Phase'])}_s", row["Duration (s)"])
+    return list(records.values())
+
+
+def parse_memory_summary(path, app, platform):
+    records = []
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            record = Record("memory_summary", app, platform, label=row["Run"])
+            for column, value in row.items():
+                if column not in ("Run", "Platform", "App"):
+                    record.metric(snake(column.replace("(KB)", "kb").replace("(MB)", "mb")), value)
+            records.append(record)
+    return records
+
+
+def parse_meta(path, match):
+    with open(path) as f:
+        meta = json.load(f)
+    if match.group(1):
+        record = Record("meta", match.group(1), match.group(2), int(match.group(3)), int(match.group(4)))
+    else:
+        record = Record("meta", "fibonacci", match.group(6), int(match.group(5)))
+    record.meta = meta
+    return [record]
+
+
+def classify(path):
+    # (kind, priority, parser) for files we know, None for everything else; metadata first so
+    # that label-keyed summaries find the runs it labels
+    name = os.path.basename(path)
+    level = level_from_dir(path)
+    match = META_RE.match(name)
+    if match:
+        return "meta", 0, lambda: parse_meta(path, match)
+    match = WRK_RE.match(name)
+    if match:
+        return "wrk", 1, lambda: parse_wrk(path, match.group(1), int(match.group(2)), int(match.group(3)))
+    match = HTTPLOAD_RE.match(name)
+    if match:
+        return "httpload", 1, lambda: parse_httpload(path, match.group(1), int(match.group(2)), int(match.group(3)))
+    match = FS_RE.match(name)
+    if match:
+        # fsbench.py: the file size is the level, the backend and file count the label
+        backend, count = match.group(1), match.group(2)
+        return "httpload", 1, lambda: parse_httpload(path, "ubuntu" if backend == "ubuntu" else "unikraft", int(match.group(3)),
+                                                     int(match.group(4)), "nginx_fs", f"{backend}_{count}")
+    match = MEMTIER_RE.match(name)
+    if match:
+        return "memtier", 1, lambda: parse_memtier(path, match.group(1), level, int(match.group(2)))
+    match = FIBONACCI_RE.match(name)
+    if match:
+        return "fibonacci", 1, lambda: parse_fibonacci(path, int(match.group(1)), match.group(2))
+    match = MICROBENCH_RE.match(name)
+    if match:
+        return "microbench", 1, lambda: parse_microbench(path, match.group(1))
+    match = STARTUP_RE.match(name)
+    if match:
+        app = match.group(1) or match.group(4) or app_from_dir(path)
+        return "startup", 1, lambda: parse_startup(path, app, match.group(2), bool(match.group(3)))
+    match = CPU_LOG_RE.match(name)
+    if match:
+        return "cpu_log", 1, lambda: parse_cpu_log(path, match.group(1), int(match.group(2)) if match.group(2) else level,
+                                                  int(match.group(3)) if match.group(3) else None)
+    match = MEMORY_LOG_RE.match(name)
+    if match:
+        return "memory_log", 1, lambda: parse_memory_log(path, match.group(1), int(match.group(2)), int(match.group(3)))
+    match = APP_STATS_RE.match(name)
+    if match:
+        return "app_stats", 1, lambda: parse_app_stats(path, match.group(1), int(match.group(2)), int(match.group(3)))
+    match = SCHED_RE.match(name)
+    if match:
+        return "sched", 1, lambda: parse_sched(path, match.group(1), int(match.group(2)), int(match.group(3)))
+    match = BOOT_PHASES_RE.match(name)
+    if match:
+        return "boot_phases", 2, lambda: parse_boot_phases(path, match.group(1), match.group(2))
+    match = MEMORY_SUMMARY_RE.match(name)
+    if match:
+        return "memory_summary", 2, lambda: parse_memory_summary(path, match.group(1), match.group(2))
+    return None
+
+
+def sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class ResultsDB:
+    def __init__(self, path=DEFAULT_DB):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run_id(self, record, directory):
+        key = record.key
+        if key["label"] and key["level"] is None:
+            # label-only records (boot phases, memory summary) attach to the run that label belongs to
+            row = self.conn.execute("SELECT id FROM runs WHERE app IS ? AND platform IS ? AND label = ?",
+                                    (key["app"], key["platform"], key["label"])).fetchone()
+        else:
+            row = self.conn.execute("SELECT id FROM runs WHERE app IS ? AND platform IS ? AND level IS ? AND rep IS ? AND dir = ?",
+                                    (key["app"], key["platform"], key["level"], key["rep"], directory)).fetchone()
+        if row:
+            return row[0]
+        cur = self.conn.execute("INSERT INTO runs (app, platform, level, rep, dir, label, source) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                (key["app"], key["platform"], key["level"], key["rep"], directory, key["label"], record.source))
+        return cur.lastrowid
+
+    def _apply_meta(self, run_id, meta):
+        values = [meta.get(column) for column in META_COLUMNS]
+        self.conn.execute(f"UPDATE runs SET {', '.join(f'{c} = ?' for c in META_COLUMNS)}, label = ?, meta = ? WHERE id = ?",
+                          values + [meta.get("run_id"), json.dumps(meta), run_id])
+
+    def _propagate_meta(self):
+        # one metadata file describes every repetition in the fibonacci log next to it
+        assignments = ", ".join(f"{c} = m.{c}" for c in META_COLUMNS + ("meta",))
+        self.conn.execute(f"UPDATE runs AS r SET {assignments} FROM runs AS m "
+                          "WHERE r.app = 'fibonacci' AND r.meta IS NULL AND m.source = 'meta' AND m.app = 'fibonacci' "
+                          "AND m.platform IS r.platform AND m.level IS r.level AND m.dir = r.dir AND m.rep IS NULL")
+
+    def _forget(self, file_id):
+        for table in ("metrics", "samples", "histograms"):
+            self.conn.execute(f"DELETE FROM {table} WHERE file_id = ?", (file_id,))
+
+    def ingest_file(self, path, kind, parse):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        row = self.conn.execute("SELECT id, sha256, size, mtime FROM files WHERE path = ?", (path,)).fetchone()
+        if row and row[2] == st.st_size and row[3] == st.st_mtime:
+            return False
+        digest = sha256_file(path)
+        if row and row[1] == digest:
+            self.conn.execute("UPDATE files SET size = ?, mtime = ? WHERE id = ?", (st.st_size, st.st_mtime, row[0]))
+            return False
+        if not row and self.conn.execute("SELECT 1 FROM files WHERE sha256 = ?", (digest,)).fetchone():
+            # same content already ingested from another path (a copied results folder)
+            self.conn.execute("INSERT INTO files (path, sha256, kind, size, mtime, ingested_at) VALUES (?, ?, ?, ?, ?, ?)",
+                              (path, digest, "duplicate", st.st_size, st.st_mtime, time.time()))
+            return False
+
+        records = parse()
+        if row:
+            file_id = row[0]
+            self._forget(file_id)
+            self.conn.execute("UPDATE files SET sha256 = ?, kind = ?, size = ?, mtime = ?, ingested_at = ? WHERE id = ?",
+                              (digest, kind, st.st_size, st.st_mtime, time.time(), file_id))
+        else:
+            file_id = self.conn.execute("INSERT INTO files (path, sha256, kind, size, mtime, ingested_at) VALUES (?, ?, ?, ?, ?, ?)",
+                                        (path, digest, kind, st.st_size, st.st_mtime, time.time())).lastrowid
+        directory = os.path.dirname(path)
+        for record in records:
+            run_id = self._run_id(record, directory)
+            if record.meta is not None:
+                self._apply_meta(run_id, record.meta)
+            self.conn.executemany("INSERT INTO metrics (run_id, file_id, name, value) VALUES (?, ?, ?, ?)",
+                                  [(run_id, file_id, name, value) for name, value in record.metrics])
+            self.conn.executemany("INSERT INTO samples (run_id, file_id, series, t, value) VALUES (?, ?, ?, ?, ?)",
+                                  [(run_id, file_id, s, t, v) for s, t, v in record.samples if v is not None])
+            self.conn.executemany("INSERT INTO histograms (run_id, file_id, name, encoded) VALUES (?, ?, ?, ?)",
+                                  [(run_id, file_id, name, encoded) for name, encoded in record.histograms])
+        return True
+
+    def ingest(self, *roots):
+        found = []
+        for root in roots:
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames[:] = [d for d in dirnames if not d.startswith((".", "__"))]
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    known = classify(path)
+                    if known:
+                        found.append((known[1], path, known[0], known[2]))
+        found.sort(key=lambda item: (item[0], item[1]))
+        ingested = failed = 0
+        with self.conn:
+            for _, path, kind, parse in found:
+                try:
+                    ingested += self.ingest_file(path, kind, parse)
+                except (OSError, ValueError, KeyError, TypeError, json.JSONDecodeError, csv.Error) as e:
+                    failed += 1
+                    print(f"Skipping {path}: {e}", file=sys.stderr)
+            self._propagate_meta()
+            # label-only runs whose rows moved to their labelled run on a later ingest
+            self.conn.execute("DELETE FROM runs WHERE meta IS NULL AND id NOT IN (SELECT run_id FROM metrics) "
+                              "AND id NOT IN (SELECT run_id FROM samples) AND id NOT IN (SELECT run_id FROM histograms)")
+        return {"seen": len(found), "ingested": ingested, "failed": failed}
+
+    def query(self, sql, params=()):
+        cur = self.conn.execute(sql, params)
+        return [d[0] for d in cur.description or []], cur.fetchall()
+
+    def metric(self, name, app=None, platform=None, level=None, by=None):
+        # (group, count, mean, min, max) of one metric over the matching runs
+        where, params = ["m.name = ?"], [name]
+        for column, value in (("app", app), ("platform", platform), ("level", level)):
+            if value is not None:
+                where.append(f"r.{column} = ?")
+                params.append(value)
+        group = f"r.{by}" if by else "r.platform"
+        if by and by not in META_COLUMNS + ("app", "platform", "level", "dir", "source", "label"):
+            raise ValueError(f"cannot group by {by}")
+        return self.query(
+            f'SELECT {group} AS "{by or "platform"}", count(*) AS runs, avg(m.value) AS mean, min(m.value) AS "min", '
+            f'max(m.value) AS "max" FROM metrics m JOIN runs r ON r.id = m.run_id WHERE {" AND ".join(where)} '
+            f"GROUP BY 1 ORDER BY 1", params)
+
+
+def print_table(columns, rows):
+    rows = [["" if v is None else (f"{v:.6g}" if isinstance(v, float) else str(v)) for v in row] for row in rows]
+    widths = [max([len(c)] + [len(r[i]) for r in rows]) for i, c in enumerate(columns)]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(v.ljust(w) for v, w in zip(row, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite store for the benchmark results")
+    parser.add_argument("--db", default=DEFAULT_DB)
+    sub = parser.add_subparsers(dest="command", required=True)
+    ingest = sub.add_parser("ingest", help="load new or changed result files")
+    ingest.add_argument("roots", nargs="*", default=[os.path.join(REPO_ROOT, "results")])
+    query = sub.add_parser("query", help="run an SQL query")
+    query.add_argument("sql")
+    metric = sub.add_parser("metric", help="summarise one metric over runs")
+    metric.add_argument("name")
+    metric.add_argument("--app")
+    metric.add_argument("--platform")
+    metric.add_argument("--level", type=int)
+    metric.add_argument("--by", help="group by a run column, e.g. kraft_config_hash, qemu_version, host_fingerprint")
+    sub.add_parser("metrics", help="list metric names")
+    args = parser.parse_args()
+
+    with ResultsDB(args.db) as db:
+        if args.command == "ingest":
+            start = time.monotonic()
+            result = db.ingest(*args.roots)
+            print(f"{result['ingested']} of {result['seen']} result files ingested ({result['failed']} failed) "
+                  f"in {round(time.monotonic() - start, 2)}s -> {args.db}")
+        elif args.command == "query":
+            print_table(*db.query(args.sql))
+        elif args.command == "metric":
+            columns, rows = db.metric(args.name, args.app, args.platform, args.level, args.by)
+            print_table(columns, rows)
+        else:
+            print_table(*db.query("SELECT name, count(*) AS runs FROM metrics GROUP BY name ORDER BY name"))
+
+
+if __name__ == "__main__":
+    main()
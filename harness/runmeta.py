@@ -0,0 +1,184 @@
+# Describes what a run actually ran on: guest memory, vCPUs, kernel/disk images and the QEMU
+# binary (read back from the live QEMU command line rather than from our own settings), the kraft
+# configuration of the app directory and the host. The harness scripts write it to run_meta.json
+# next to their other metrics; the orchestrator files it with the run and resultsdb.py ingests it.
+
+import glob
+import hashlib
+import json
+import os
+import platform
+import socket
+import struct
+import subprocess
+
+KRAFT_CONFIG_FILES = ("Kraftfile", "kraft.yaml", "kraft.yml", ".config*")
+FULL_HASH_LIMIT = 64 << 20  # bigger images (qcow2) are fingerprinted from size, mtime and both ends
+EDGE_BYTES = 1 << 20
+
+
+def file_fingerprint(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        if st.st_size <= FULL_HASH_LIMIT:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        else:
+            h.update(f"{st.st_size}:{int(st.st_mtime)}".encode())
+            h.update(f.read(EDGE_BYTES))
+            f.seek(-EDGE_BYTES, os.SEEK_END)
+            h.update(f.read(EDGE_BYTES))
+    return h.hexdigest()[:16]
+
+
+def backing_chain(path):
+    # [path, backing, backing of backing, ...] of a qcow2 image, read from the headers
+    chain = [path]
+    while len(chain) < 16:
+        try:
+            with open(chain[-1], "rb") as f:
+                header = f.read(20)
+                if len(header) < 20 or header[:4] != b"QFI\xfb":
+                    break
+                offset, size = struct.unpack(">QI", header[8:20])
+                if not offset:
+                    break
+                f.seek(offset)
+                backing = f.read(size).decode(errors="replace")
+        except OSError:
+            break
+        chain.append(os.path.join(os.path.dirname(chain[-1]), backing))
+    return chain
+
+
+def kraft_config_hash(app_dir="."):
+    h = hashlib.sha256()
+    found = False
+    for pattern in KRAFT_CONFIG_FILES:
+        for path in sorted(glob.glob(os.path.join(app_dir, pattern))):
+            if os.path.isfile(path):
+                with open(path, "rb") as f:
+                    h.update(os.path.basename(path).encode() + b"\0" + f.read())
+                found = True
+    return h.hexdigest()[:16] if found else None
+
+
+def host_fingerprint():
+    cpu_model = ""
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    cpu_model = line.split(":", 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    mem_kb = 0
+    try:
+        with open("/proc/meminfo") as f:
+            mem_kb = int(f.readline().split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    host = {
+        "host": socket.gethostname(),
+        "kernel": platform.release(),
+        "cpu_model": cpu_model,
+        "cpus": os.cpu_count(),
+        "mem_kb": mem_kb,
+    }
+    stable = json.dumps([host["host"], host["kernel"], host["cpu_model"], host["cpus"], host["mem_kb"]])
+    host["host_fingerprint"] = hashlib.sha256(stable.encode()).hexdigest()[:16]
+    return host
+
+
+def qemu_cmdline(pid):
+    with open(f"/proc/{pid}/cmdline", "rb") as f:
+        return [arg.decode(errors="replace") for arg in f.read().split(b"\0") if arg]
+
+
+def option_values(args, name):
+    return [args[i + 1] for i, arg in enumerate(args[:-1]) if arg in (name, "-" + name)]
+
+
+def parse_memory_mb(value):
+    # -m 64M, -m 1G, -m size=128M,slots=..., plain numbers are MiB
+    size = value.split(",")[0].split("=")[-1].strip().upper()
+    units = {"K": 1 / 1024, "M": 1, "G": 1024, "T": 1 << 20}
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(float(size)) if size else None
+
+
+def parse_smp(value):
+    fields = dict(part.split("=", 1) if "=" in part else ("cpus", part) for part in value.split(","))
+    return int(fields.get("cpus", 1))
+
+
+def qemu_metadata(pid):
+    try:
+        args = qemu_cmdline(pid)
+        exe = os.readlink(f"/proc/{pid}/exe")
+    except OSError:
+        return {}
+    meta = {"qemu_binary": exe}
+    try:
+        out = subprocess.run([exe, "--version"], capture_output=True, text=True, timeout=5).stdout
+        meta["qemu_version"] = out.splitlines()[0].strip() if out else None
+    except (OSError, subprocess.SubprocessError):
+        meta["qemu_version"] = None
+    memory = option_values(args, "-m")
+    meta["memory_mb"] = parse_memory_mb(memory[-1]) if memory else None
+    smp = option_values(args, "-smp")
+    meta["smp"] = parse_smp(smp[-1]) if smp else 1
+    accel = option_values(args, "-accel") + [m.split("accel=")[1].split(",")[0] for m in option_values(args, "-machine") if "accel=" in m]
+    meta["accel"] = accel[-1] if accel else ("kvm" if "-enable-kvm" in args else None)
+    # user (slirp) or tap, and for a tap whether vhost-net and how many queue pairs it moves packets with
+    netdevs = option_values(args, "-netdev")
+    options = dict(f.split("=", 1) for f in netdevs[0].split(",")[1:] if "=" in f) if netdevs else {}
+    meta["network"] = netdevs[0].split(",")[0] if netdevs else None
+    meta["vhost"] = options.get("vhost") == "on"
+    meta["net_queues"] = int(options.get("queues", 1)) if netdevs else None
+
+    images = option_values(args, "-kernel")
+    images += [d.split("file=")[1].split(",")[0] for d in option_values(args, "-drive") if "file=" in d]
+    cwd = os.readlink(f"/proc/{pid}/cwd") if os.path.exists(f"/proc/{pid}/cwd") else "."
+    meta["images"] = []
+    for img in images:
+        # a per-run overlay says nothing about the disk, the base image at the bottom of its chain does
+        chain = backing_chain(os.path.join(cwd, img))
+        meta["images"].append({"path": img, "fingerprint": file_fingerprint(chain[-1]), "backing": chain[1:]})
+    meta["image_hash"] = meta["images"][0]["fingerprint"] if meta["images"] else None
+    return meta
+
+
+def run_metadata(qemu_pid=None, app_dir=".", **fields):
+    meta = dict(fields)
+    meta.update(host_fingerprint())
+    meta["kraft_config_hash"] = kraft_config_hash(app_dir)
+    if qemu_pid:
+        meta.update(qemu_metadata(qemu_pid))
+    return meta
+
+
+def write_run_metadata(path, qemu_pid=None, app_dir=".", **fields):
+    meta = run_metadata(qemu_pid, app_dir, **fields)
+    with open(path, "w") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+def update_run_metadata(path, **fields):
+    # add what is only known after the run (steady-state window, ...) to an existing run_meta.json
+    meta = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            meta = json.load(f)
+    meta.update(fields)
+    with open(path, "w") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
@@ -0,0 +1,269 @@
+# High-frequency resource sampler for the QEMU process.
+#
+# Runs in its own process (optionally pinned to a housekeeping core) and reads /proc directly at
+# 10-1000 Hz: per-thread CPU time from /proc/<pid>/task/<tid>/schedstat (nanoseconds, so short
+# intervals are not quantized to the 10 ms clock tick of utime/stime) and RSS from statm. CPU is
+# attributed to vCPU threads, I/O threads and the main loop separately. Samples go into a
+# preallocated ring buffer in shared memory and, with store_path, are streamed to a metrics store
+# file as they are taken. The sampler's own CPU cost is reported as overhead.
+
+import array
+import csv
+import multiprocessing
+import os
+import re
+import signal
+import time
+from multiprocessing import shared_memory
+
+from metricstore import MetricsFile, MetricsWriter
+from steady import steady_window, within
+
+PAGE_KB = os.sysconf("SC_PAGE_SIZE") // 1024
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+RESCAN_EVERY = 0.5  # seconds between rescans of /proc/<pid>/task for new threads
+HEADER_FIELDS = 4   # samples written, sampler cpu ns, sampler wall ns, late samples
+
+VCPU_RE = re.compile(r"CPU (\d+)/KVM")
+IO_RE = re.compile(r"^(?:IO |iothread|worker|vhost|aio|io_uring)")
+
+
+def thread_role(pid, tid, comm):
+    match = VCPU_RE.search(comm)
+    if match:
+        return f"vcpu{match.group(1)}"
+    if tid == pid:
+        return "main"
+    if IO_RE.search(comm):
+        return "io"
+    return "other"
+
+
+def read_small(fd):
+    return os.pread(fd, 256, 0)
+
+
+def thread_cpu_ns(fd, from_schedstat):
+    data = read_small(fd)
+    if from_schedstat:
+        return int(data.split(None, 1)[0])
+    fields = data.rsplit(b")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) * 1_000_000_000 // CLK_TCK
+
+
+def columns_for(max_vcpus):
+    return ["t", "rss_kb", "total", "main", "io", "other"] + [f"vcpu{i}" for i in range(max_vcpus)]
+
+
+class ResourceSampler:
+    def __init__(self, pid, hz=100, cpu=None, capacity=1 << 16, max_vcpus=8, store_path=None, start_ns=None):
+        self.pid = pid
+        self.store_path = store_path
+        self.hz = max(1, min(int(hz), 1000))
+        self.cpu = cpu
+        self.capacity = capacity
+        self.columns = columns_for(max_vcpus)
+        width = len(self.columns)
+        self.shm = shared_memory.SharedMemory(create=True, size=8 * (HEADER_FIELDS + capacity * width))
+        self.header = self.shm.buf[:8 * HEADER_FIELDS].cast("q")
+        self.data = self.shm.buf[8 * HEADER_FIELDS:].cast("d")
+        self.stop_event = multiprocessing.get_context("fork").Event()
+        self.proc = None
+        # time base of the samples, shared with other collectors of the same run
+        self.start_ns = start_ns
+
+    def start(self):
+        # a store holds one run, leftovers of an earlier run in the same directory are dropped
+        if self.store_path and os.path.exists(self.store_path):
+            os.remove(self.store_path)
+        self.start_ns = self.start_ns or time.monotonic_ns()
+        self.proc = multiprocessing.get_context("fork").Process(target=self._run, daemon=True)
+        self.proc.start()
+
+    def stop(self, timeout=5):
+        self.stop_event.set()
+        if self.proc:
+            self.proc.join(timeout)
+            if self.proc.is_alive():
+                self.proc.kill()
+
+    def _run(self):
+        # Ctrl+C reaches the whole process group, the harness decides when sampling stops
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        if self.cpu is not None:
+            try:
+                os.sched_setaffinity(0, {self.cpu})
+            except OSError:
+                pass
+
+        width = len(self.columns)
+        role_index = {name: i for i, name in enumerate(self.columns)}
+        period = 1_000_000_000 // self.hz
+        from_schedstat = os.path.exists(f"/proc/{self.pid}/schedstat")
+        threads = {}  # tid -> [fd, column index, last cpu ns]
+        try:
+            statm_fd = os.open(f"/proc/{self.pid}/statm", os.O_RDONLY)
+        except OSError:
+            return
+
+        def rescan():
+            try:
+                tids = [int(t) for t in os.listdir(f"/proc/{self.pid}/task")]
+            except OSError:
+                return False
+            for tid in tids:
+                if tid in threads:
+                    continue
+                try:
+                    with open(f"/proc/{self.pid}/task/{tid}/comm") as f:
+                        comm = f.read().strip()
+                    name = "schedstat" if from_schedstat else "stat"
+                    fd = os.open(f"/proc/{self.pid}/task/{tid}/{name}", os.O_RDONLY)
+                    threads[tid] = [fd, role_index.get(thread_role(self.pid, tid, comm), role_index["other"]), thread_cpu_ns(fd, from_schedstat)]
+                except (OSError, ValueError, IndexError):
+                    continue
+            return True
+
+        store = MetricsWriter(self.store_path, self.columns) if self.store_path else None
+        cpu_start = time.process_time_ns()
+        rescan()
+        last_rescan = last_ns = time.monotonic_ns()
+        next_ns = last_ns + period
+        count = late = 0
+        row = array.array("d", [0.0] * width)
+        while not self.stop_event.is_set():
+            now = time.monotonic_ns()
+            if now < next_ns:
+                time.sleep((next_ns - now) / 1e9)
+                now = time.monotonic_ns()
+            elif now - next_ns > period:
+                late += 1
+            next_ns += period
+            if next_ns < now:
+                next_ns = now + period
+
+            if now - last_rescan > RESCAN_EVERY * 1e9:
+                if not rescan():
+                    break
+                last_rescan = now
+
+            for i in range(2, width):
+                row[i] = 0.0
+            elapsed = now - last_ns
+            for tid, entry in list(threads.items()):
+                try:
+                    cpu_ns = thread_cpu_ns(entry[0], from_schedstat)
+                except (OSError, ValueError, IndexError):
+                    os.close(entry[0])
+                    del threads[tid]
+                    continue
+                share = 100.0 * (cpu_ns - entry[2]) / elapsed if elapsed else 0.0
+                entry[2] = cpu_ns
+                row[entry[1]] += share
+                row[2] += share
+            try:
+                row[1] = int(read_small(statm_fd).split()[1]) * PAGE_KB
+            except (OSError, ValueError, IndexError):
+                break
+            row[0] = (now - self.start_ns) / 1e9
+            last_ns = now
+
+            offset = (count % self.capacity) * width
+            self.data[offset:offset + width] = memoryview(row)
+            if store:
+                store.append(row)
+            count += 1
+            self.header[0] = count
+            self.header[1] = time.process_time_ns() - cpu_start
+            self.header[2] = time.monotonic_ns() - self.start_ns
+            self.header[3] = late
+
+        for entry in threads.values():
+            os.close(entry[0])
+        os.close(statm_fd)
+        if store:
+            store.close()
+
+    def rows(self):
+        # every sample from the store file when there is one, otherwise what the ring still holds
+        if self.store_path and os.path.exists(self.store_path):
+            store = MetricsFile(self.store_path)
+            yield from store.rows()
+            store.close()
+            return
+        width = len(self.columns)
+        count = self.header[0]
+        first = max(0, count - self.capacity)
+        for n in range(first, count):
+            offset = (n % self.capacity) * width
+            yield tuple(self.data[offset:offset + width])
+
+    def overhead(self):
+        count, cpu_ns, wall_ns, late = self.header[0], self.header[1], self.header[2], self.header[3]
+        return {
+            "samples": count,
+            "dropped": 0 if self.store_path else max(0, count - self.capacity),
+            "late": late,
+            "cpu_percent": round(100.0 * cpu_ns / wall_ns, 2) if wall_ns else 0.0,
+            "us_per_sample": round(cpu_ns / count / 1000, 1) if count else 0.0,
+        }
+
+    def overhead_report(self):
+        o = self.overhead()
+        return (f"Sampler: {o['samples']} samples at {self.hz} Hz, {o['cpu_percent']}% of one core "
+                f"({o['us_per_sample']} us/sample), {o['late']} late, {o['dropped']} overwritten")
+
+    def write_csv(self, path):
+        # first three columns keep the old "Time Elapsed,CPU (%),Memory (KB)" log readable by the plots
+        busy = [False] * (len(self.columns) - 6)
+        for r in self.rows():
+            busy = [b or bool(v) for b, v in zip(busy, r[6:])]
+        vcpus = 1 + max([i for i, b in enumerate(busy) if b] or [0])
+        header = ["Time Elapsed", "CPU (%)", "Memory (KB)", "Main (%)", "IO (%)", "Other (%)"]
+        header += [f"vCPU {i} (%)" for i in range(vcpus)]
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for r in self.rows():
+                writer.writerow([round(r[0], 4), round(r[2], 1), int(r[1])] + [round(v, 1) for v in r[3:6 + vcpus]])
+
+    def close(self):
+        self.header.release()
+        self.data.release()
+        self.shm.close()
+        self.shm.unlink()
+
+
+def usage_rows(store_path):
+    # (elapsed, cpu %, memory KB) as the harnesses always logged it, streamed from the store
+    if not os.path.exists(store_path):
+        return
+    store = MetricsFile(store_path)
+    for r in store.rows():
+        yield round(r[0], 3), round(r[2], 1), int(r[1])
+    store.close()
+
+
+def usage_averages(store_path):
+    count = cpu_sum = mem_sum = 0
+    for _, cpu, mem in usage_rows(store_path):
+        count += 1
+        cpu_sum += cpu
+        mem_sum += mem
+    if not count:
+        return 0, 0.0, 0.0
+    return count, round(cpu_sum / count, 2), round(mem_sum / count, 2)
+
+
+def steady_averages(store_path, hz=100):
+    # (window, samples, cpu %, memory KB) over the steady part of the CPU series, in 1 s batches,
+    # so the boot and the teardown do not count; window is None when no steady part is found
+    rows = list(usage_rows(store_path))
+    if not rows:
+        return None, 0, 0.0, 0.0
+    times = [r[0] for r in rows]
+    window = steady_window(times, [r[1] for r in rows], batch=max(1, int(hz)))
+    kept = [rows[i] for i in within(times, window)]
+    return window, len(kept), round(sum(r[1] for r in kept) / len(kept), 2), round(sum(r[2] for r in kept) / len(kept), 2)
+
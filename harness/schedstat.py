@@ -0,0 +1,280 @@
+# Host scheduler view of a QEMU process: how much each of its threads ran, how long it sat on a
+# run queue waiting for a CPU, and how often it was switched out.
+#
+# A collector thread reads, for every QEMU thread, /proc/<pid>/task/<tid>/schedstat (ns on CPU,
+# ns waiting on a run queue, timeslices) and the voluntary / nonvoluntary context switches from
+# its status file, plus the I/O counters of the process (/proc/<pid>/io). Threads are grouped by
+# role like the resource sampler does (vcpuN, main, io, other). Every row holds the increase over
+# one interval and the wall clock time, which is what lines it up with the load generator.
+# Rows are only kept in the metrics store file; the log and the report are read back from it.
+#
+# For a vCPU thread the numbers read as:
+#
+#   wait      run-queue delay: the guest wanted to run and the host did not let it
+#   idle      neither running nor waiting, the guest halted (HLT) and the thread slept in KVM
+#   vcs       voluntary switches, mostly halts and the wakeups that follow them
+#   nvcs      nonvoluntary switches, the host scheduler preempting the vCPU
+#
+# analyze() lines the intervals up with the per-second throughput of the benchmark and, for every
+# second that drops below the run's median, says whether the host starved the vCPU (run-queue
+# delay or preemptions well above the run's usual) or the slowdown came from inside the guest.
+#
+#   python3 harness/schedstat.py analyze sched_unikraft_run_100_0.log nginx_unikraft_run_100_0.json
+
+import argparse
+import csv
+import json
+import math
+import os
+import statistics
+import threading
+import time
+
+from metricstore import MetricsFile, MetricsWriter, stored_rows
+from placement import vcpu_threads
+from sampler import thread_role
+
+METRICS = ("run_ms", "wait_ms", "slices", "vcs", "nvcs")
+IO_FIELDS = ("rchar", "wchar", "syscr", "syscw", "read_bytes", "write_bytes")
+DROP = 0.2          # a second more than this far below the median throughput is a drop
+STARVED_FACTOR = 3  # run-queue delay or preemptions this many times the median count as host-side
+STARVED_MIN_MS = 1  # ... and at least this much delay in the second
+VCPU_RETRY_S = (1, 2, 4, 8, 16, 30)  # waits between QMP attempts at the vCPU threads, then give up
+
+
+def columns_for(max_vcpus):
+    roles = [f"vcpu{i}" for i in range(max_vcpus)] + ["main", "io", "other"]
+    return ["t", "wall", "interval_ms"] + [f"{role}_{m}" for role in roles for m in METRICS] + list(IO_FIELDS)
+
+
+def read_thread(pid, tid):
+    # (run ns, wait ns, slices, voluntary, nonvoluntary)
+    with open(f"/proc/{pid}/task/{tid}/schedstat") as f:
+        run, wait, slices = (int(v) for v in f.read().split()[:3])
+    vcs = nvcs = 0
+    with open(f"/proc/{pid}/task/{tid}/status") as f:
+        for line in f:
+            if line.startswith("voluntary_ctxt_switches"):
+                vcs = int(line.split()[1])
+            elif line.startswith("nonvoluntary_ctxt_switches"):
+                nvcs = int(line.split()[1])
+    return run, wait, slices, vcs, nvcs
+
+
+def read_io(pid):
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/io") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                fields[name] = int(value)
+    except (OSError, ValueError):
+        pass
+    return [fields.get(name, math.nan) for name in IO_FIELDS]
+
+
+class SchedCollector(threading.Thread):
+    def __init__(self, pid, hz=10, start_ns=None, store_path=None, max_vcpus=8):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = 1 / hz
+        self.start_ns = start_ns or time.monotonic_ns()
+        self.store_path = store_path
+        self.columns = columns_for(max_vcpus)
+        self.index = {name: i for i, name in enumerate(self.columns)}
+        self.stop_event = threading.Event()
+        self.vcpus = {}
+
+    def _find_vcpus(self):
+        # vCPU threads over QMP, for QEMUs that do not name them (kraft's). Off the sampling thread:
+        # a monitor held by kraft or the balloon client makes every attempt block for seconds
+        for wait in (0,) + VCPU_RETRY_S:
+            if self.stop_event.wait(wait):
+                return
+            vcpus = vcpu_threads(self.pid)
+            if vcpus:
+                self.vcpus = {str(tid): f"vcpu{index}" for index, tid in vcpus}
+                return
+
+    def _snapshot(self):
+        totals = {}
+        for tid in os.listdir(f"/proc/{self.pid}/task"):
+            try:
+                with open(f"/proc/{self.pid}/task/{tid}/comm") as f:
+                    role = self.vcpus.get(tid) or thread_role(self.pid, int(tid), f.read().strip())
+                values = read_thread(self.pid, tid)
+            except (OSError, ValueError):
+                continue  # a thread that just exited
+            if f"{role}_run_ms" not in self.index:
+                role = "other"
+            totals.setdefault(role, {})[tid] = values
+        return totals
+
+    def run(self):
+        store = None
+        if self.store_path:
+            if os.path.exists(self.store_path):
+                os.remove(self.store_path)
+            store = MetricsWriter(self.store_path, self.columns)
+        threading.Thread(target=self._find_vcpus, daemon=True).start()
+        try:
+            last, last_io, last_ns = self._snapshot(), read_io(self.pid), time.monotonic_ns()
+        except OSError:
+            return
+        while not self.stop_event.wait(self.interval):
+            try:
+                current, io = self._snapshot(), read_io(self.pid)
+            except OSError:
+                break  # QEMU is gone
+            now = time.monotonic_ns()
+            row = [0.0] * len(self.columns)
+            row[0] = (now - self.start_ns) / 1e9
+            row[1] = time.time()
+            row[2] = (now - last_ns) / 1e6
+            # by thread, a vCPU found over QMP during the run changes role but keeps its counters
+            previous = {tid: values for threads in last.values() for tid, values in threads.items()}
+            for role, threads in current.items():
+                for tid, values in threads.items():
+                    # a thread that appeared during the interval counts from zero
+                    before = previous.get(tid, (0, 0, 0, 0, 0))
+                    deltas = [v - b for v, b in zip(values, before)]
+                    deltas[0] /= 1e6
+                    deltas[1] /= 1e6
+                    for metric, delta in zip(METRICS, deltas):
+                        row[self.index[f"{role}_{metric}"]] += delta
+            for name, value, before in zip(IO_FIELDS, io, last_io):
+                row[self.index[name]] = value - before
+            if store:
+                store.append(row)
+            last, last_io, last_ns = current, io, now
+        if store:
+            store.close()
+
+    def stop(self, timeout=5):
+        self.stop_event.set()
+        self.join(timeout)
+
+    def write_log(self, path):
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(self.columns)
+            for row in stored_rows(self.store_path):
+                writer.writerow(["" if math.isnan(value) else round(value, 6) for value in row])
+
+    def report(self):
+        # rows stay in the store, the summaries walk the mapped file
+        if not self.store_path or not os.path.exists(self.store_path):
+            return "Schedstat: no samples stored"
+        with MetricsFile(self.store_path) as store:
+            vcpus = vcpus_seen(store, self.columns)
+            if not vcpus:
+                return "Schedstat: no vCPU threads identified"
+            return "; ".join(f"{vcpu}: {summarize(store, self.columns, vcpu)}" for vcpu in vcpus)
+
+
+def vcpus_seen(rows, columns):
+    return [c[:-len("_run_ms")] for c in columns if c.startswith("vcpu") and c.endswith("_run_ms")
+            and any(row[columns.index(c)] for row in rows)]
+
+
+def vcpu_summary(rows, columns, vcpu):
+    index = {name: i for i, name in enumerate(columns)}
+    elapsed = sum(row[index["interval_ms"]] for row in rows)
+    run = sum(row[index[f"{vcpu}_run_ms"]] for row in rows)
+    wait = sum(row[index[f"{vcpu}_wait_ms"]] for row in rows)
+    waits = sorted(row[index[f"{vcpu}_wait_ms"]] for row in rows)
+    seconds = elapsed / 1000 or 1
+    return {
+        "run_ms": run,
+        "wait_ms": wait,
+        "wait_ratio": wait / (run + wait) if run + wait else 0.0,
+        "idle_ratio": max(0.0, 1 - (run + wait) / elapsed) if elapsed else 0.0,
+        "wakeups_per_s": sum(row[index[f"{vcpu}_vcs"]] for row in rows) / seconds,
+        "preemptions_per_s": sum(row[index[f"{vcpu}_nvcs"]] for row in rows) / seconds,
+        "wait_ms_p99": waits[min(len(waits) - 1, math.ceil(0.99 * len(waits)) - 1)] if waits else 0.0,
+    }
+
+
+def summarize(rows, columns, vcpu):
+    s = vcpu_summary(rows, columns, vcpu)
+    return (f"run-queue delay {s['wait_ms']:.1f} ms ({s['wait_ratio']:.1%} of runnable time, p99 {s['wait_ms_p99']:.2f} ms "
+            f"per interval), idle {s['idle_ratio']:.1%}, {s['wakeups_per_s']:.0f} wakeups/s, {s['preemptions_per_s']:.0f} preemptions/s")
+
+
+def read_log(path):
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        columns = next(reader)
+        rows = [[float(v) if v else math.nan for v in row] for row in reader]
+    return columns, rows
+
+
+def throughput_series(path):
+    # (wall clock start in s, {second: operations}) from httpload or memtier / mcload json
+    with open(path) as f:
+        data = json.load(f)
+    if "time_series" in data:
+        return data.get("start_time_ms", 0) / 1000, {e["second"]: e["requests"] for e in data["time_series"]}
+    stats = data.get("ALL STATS", {})
+    series = (stats.get("Totals") or {}).get("Time-Serie") or {}
+    return stats.get("Runtime", {}).get("Start time", 0) / 1000, {int(s): e.get("Count", 0) for s, e in series.items()}
+
+
+def analyze(columns, rows, start, throughput):
+    # every throughput drop with the vCPU scheduling of the same second and who is to blame
+    index = {name: i for i, name in enumerate(columns)}
+    vcpus = vcpus_seen(rows, columns)
+    per_second = {}
+    for row in rows:
+        second = math.floor(row[index["wall"]] - start)
+        if second in throughput:
+            bucket = per_second.setdefault(second, {"wait_ms": 0.0, "nvcs": 0.0, "run_ms": 0.0})
+            for vcpu in vcpus:
+                for metric in bucket:
+                    bucket[metric] += row[index[f"{vcpu}_{metric}"]]
+    if not per_second:
+        return {"seconds": 0, "drops": []}
+    median_ops = statistics.median(throughput.values())
+    median_wait = statistics.median(b["wait_ms"] for b in per_second.values())
+    median_nvcs = statistics.median(b["nvcs"] for b in per_second.values())
+    drops = []
+    for second, bucket in sorted(per_second.items()):
+        ops = throughput[second]
+        if ops >= (1 - DROP) * median_ops:
+            continue
+        starved = (bucket["wait_ms"] >= max(STARVED_MIN_MS, STARVED_FACTOR * median_wait)
+                   or bucket["nvcs"] > max(1, STARVED_FACTOR * median_nvcs))
+        drops.append({"second": second, "ops": ops, "median_ops": median_ops, **bucket,
+                      "cause": "host scheduler" if starved else "guest"})
+    return {"seconds": len(per_second), "median_ops": median_ops, "median_wait_ms": median_wait,
+            "median_nvcs": median_nvcs, "drops": drops}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="vCPU scheduling analysis of a schedstat log")
+    sub = parser.add_subparsers(dest="command", required=True)
+    summary_parser = sub.add_parser("summary", help="run-queue delay, idle time and switches per vCPU")
+    summary_parser.add_argument("log")
+    analyze_parser = sub.add_parser("analyze", help="attribute throughput drops to the host or the guest")
+    analyze_parser.add_argument("log")
+    analyze_parser.add_argument("benchmark", help="httpload, mcload or memtier json of the same run")
+    args = parser.parse_args()
+
+    columns, rows = read_log(args.log)
+    if args.command == "summary":
+        for vcpu in vcpus_seen(rows, columns):
+            print(f"{vcpu}: {summarize(rows, columns, vcpu)}")
+        return
+    start, throughput = throughput_series(args.benchmark)
+    if not start:
+        print("the benchmark output carries no start time, it cannot be lined up with the log")
+        return
+    result = analyze(columns, rows, start, throughput)
+    print(f"{result['seconds']} seconds lined up, {len(result['drops'])} below {1 - DROP:.0%} of the median throughput")
+    for drop in result["drops"]:
+        print(f"  second {drop['second']:>4}: {drop['ops']:.0f} ops (median {drop['median_ops']:.0f}), vCPU run-queue delay "
+              f"{drop['wait_ms']:.2f} ms, {drop['nvcs']:.0f} preemptions -> {drop['cause']}")
+
+
+if __name__ == "__main__":
+    main()
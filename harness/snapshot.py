@@ -0,0 +1,152 @@
+# Snapshot-restore boot: boot once to application-ready, save the VM state, and restore it for
+# every later run instead of booting again. Restore is a third startup strategy next to the
+# cold boots of both platforms, the harness scripts measure its time-to-ready the same way.
+#
+# The state is migrated to a file ("migrate exec:cat > file") and loaded with "-incoming exec:cat file":
+#
+#   ubuntu    the guest is stopped and its per-run overlay (overlay.py) is frozen as the disk of
+#             the snapshot with blockdev-snapshot-sync, the saving run carries on in a new overlay
+#             on top; restores boot a fresh overlay of the frozen disk with -incoming
+#   unikraft  kraft owns the QEMU command line and cannot pass -incoming, so the command line kraft
+#             used is stored with the state; restores exec QEMU directly from it (kraftcmd.py), on
+#             the current port and with our own QMP socket
+#
+# A snapshot only matches the machine it was taken from: the state file name carries the guest
+# memory size (and the balloon device for ubuntu), and a state is dropped once the base image or
+# kernel it was taken from changes.
+
+import contextlib
+import fcntl
+import json
+import os
+import shutil
+import time
+
+from kraftcmd import direct_command, kernel_fingerprint
+from qmp import QMPClient, QMPError
+from runmeta import file_fingerprint
+
+BOOT_MODES = ("cold", "snapshot")
+SNAPSHOT_DIR = ".snapshots"
+
+
+def boot_mode():
+    mode = os.environ.get("BOOT_MODE", "cold")
+    if mode not in BOOT_MODES:
+        raise ValueError(f"BOOT_MODE must be one of {', '.join(BOOT_MODES)}, not {mode}")
+    return mode
+
+
+def state_paths(app_dir, mem_mb, variant=""):
+    base = os.path.join(os.path.abspath(app_dir), SNAPSHOT_DIR, f"ready-{mem_mb}m{variant}")
+    return base + ".state", base + ".json"
+
+
+def disk_path(state_path):
+    # the frozen guest disk that belongs to an ubuntu state
+    return os.path.splitext(state_path)[0] + ".qcow2"
+
+
+def write_meta(state_path, **meta):
+    meta["saved_at"] = time.time()
+    with open(os.path.splitext(state_path)[0] + ".json", "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+def read_meta(state_path):
+    meta_path = os.path.splitext(state_path)[0] + ".json"
+    if not (os.path.exists(state_path) and os.path.exists(meta_path)):
+        return None
+    with open(meta_path) as f:
+        return json.load(f)
+
+
+@contextlib.contextmanager
+def save_lock(state_path):
+    # runs booting side by side (warm pool) may all try to save; one does, the others find its state
+    os.makedirs(os.path.dirname(state_path), exist_ok=True)
+    with open(os.path.splitext(state_path)[0] + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield read_meta(state_path) is None
+
+
+def migrate_to_file(qmp, state_path, timeout):
+    # the guest ends up paused, also when it was running before
+    partial = f"{state_path}.{os.getpid()}.partial"
+    qmp.execute("migrate", uri=f"exec:cat > {partial}")
+    deadline = time.monotonic() + timeout
+    while True:
+        status = qmp.execute("query-migrate").get("status")
+        if status == "completed":
+            break
+        if status in ("failed", "cancelled") or time.monotonic() > deadline:
+            raise QMPError(f"migration to {partial} {status or 'timed out'}")
+        time.sleep(0.05)
+    os.replace(partial, state_path)
+
+
+def save_state_file(qmp_path, state_path, args, cwd, timeout=600):
+    # unikraft: migrates the running guest into state_path and lets it continue, returns the seconds
+    # it was paused, None when another run saved first
+    with save_lock(state_path) as needed:
+        if not needed:
+            return None
+        start = time.monotonic()
+        with QMPClient(qmp_path, timeout=30) as qmp:
+            migrate_to_file(qmp, state_path, timeout)
+            paused = time.monotonic() - start
+            qmp.execute("cont")
+        write_meta(state_path, args=args, cwd=cwd, kernel_fingerprint=kernel_fingerprint(args, cwd))
+    return paused
+
+
+def load_state_file(state_path):
+    # the saved kraft command line, None when there is no usable state
+    meta = read_meta(state_path)
+    if not meta:
+        return None
+    if kernel_fingerprint(meta["args"], meta["cwd"]) != meta["kernel_fingerprint"]:
+        return None
+    return meta
+
+
+def save_guest(qmp_path, state_path, device, next_disk, base, timeout=600):
+    # ubuntu: freezes the disk of device and the RAM of the stopped guest, then lets it continue on
+    # next_disk; returns the seconds it was paused, None when another run saved first
+    with save_lock(state_path) as needed:
+        if not needed:
+            return None
+        start = time.monotonic()
+        with QMPClient(qmp_path, timeout=30) as qmp:
+            qmp.execute("stop")
+            try:
+                block = next(b for b in qmp.execute("query-block") if b.get("device") == device)
+                run_disk = block["inserted"]["file"]
+                qmp.execute("blockdev-snapshot-sync", device=device, format="qcow2", **{"snapshot-file": next_disk})
+                migrate_to_file(qmp, state_path, timeout)
+                # still open in QEMU as the backing file of next_disk, moving it does not disturb the run;
+                # the run disk may be a link to a pooled overlay, or on another file system than the state
+                partial = f"{disk_path(state_path)}.partial"
+                shutil.move(os.path.realpath(run_disk), partial)
+                os.replace(partial, disk_path(state_path))
+            finally:
+                paused = time.monotonic() - start
+                qmp.execute("cont")
+        write_meta(state_path, device=device, base=os.path.abspath(base), base_fingerprint=file_fingerprint(base))
+    return paused
+
+
+def load_guest(state_path, base):
+    # the saved ubuntu state, None when there is none or the base image changed since
+    meta = read_meta(state_path)
+    if not meta or not os.path.exists(disk_path(state_path)):
+        return None
+    if meta.get("base_fingerprint") != file_fingerprint(base):
+        return None
+    return meta
+
+
+def restore_command(meta, state_path, port, qmp_path):
+    # the saved command line (kraftcmd.py) with the state to load; the guest devices stay exactly as
+    # they were when the state was saved
+    return direct_command(meta, qmp_path, port) + ["-incoming", f"exec:cat {state_path}"]
@@ -0,0 +1,147 @@
+# Steady-state windows for run time series.
+#
+# Throughput, latency and CPU series start with a warm-up (boot, connection setup, cold caches)
+# and often end with a teardown tail. MSER (marginal standard error rule) picks the truncation
+# point d that minimises the standard error of the mean of what is left, over batch means:
+#
+#   MSER(d) = sum((x_i - mean(x[d:]))^2 for i >= d) / (n - d)^2,  d <= n / 2
+#
+# It is applied forwards to cut the warm-up and backwards to cut the cool-down, each pass on what
+# the other one left, until the window stops moving. On stationary noise the minimum still lands on
+# some d > 0 by chance, so each cut is then only kept when it brings the statistic of what the other
+# cut leaves below 40% (MARGIN, for 30 batch means; chance dips go deeper in shorter series, so
+# the margin tightens as MARGIN ** (30 / n)); otherwise that end of the series is kept whole. A real
+# warm-up or tail lowers it by far more. Several series of the same run (throughput and latency, CPU and
+# memory) are combined by intersecting their windows. Windows are reported in the series' own time
+# unit.
+#
+#   python3 harness/steady.py check    stationary noise keeps its whole range, a warm-up is cut
+
+import argparse
+import random
+import sys
+
+BATCH = 5
+MAX_PASSES = 5
+MARGIN = 0.4  # a cut must bring the MSER of the window below MARGIN times that of the uncut side
+MARGIN_MEANS = 30  # series length MARGIN is meant for
+
+
+def batch_means(values, batch=BATCH):
+    return [sum(values[i:i + batch]) / len(values[i:i + batch]) for i in range(0, len(values), batch)]
+
+
+def mser(values, max_fraction=0.5):
+    # index of the first value to keep, the d with the smallest MSER
+    n = len(values)
+    if n < 4:
+        return 0
+    suffix_sum = [0.0] * (n + 1)
+    suffix_sq = [0.0] * (n + 1)
+    for i in range(n - 1, -1, -1):
+        suffix_sum[i] = suffix_sum[i + 1] + values[i]
+        suffix_sq[i] = suffix_sq[i + 1] + values[i] * values[i]
+    stats = []
+    for d in range(int(n * max_fraction) + 1):
+        m = n - d
+        stats.append(max(0.0, suffix_sq[d] - suffix_sum[d] ** 2 / m) / (m * m))
+    return stats.index(min(stats))
+
+
+def mser_stat(values):
+    # MSER(0) of a whole series
+    n = len(values)
+    if not n:
+        return 0.0
+    mean = sum(values) / n
+    return sum((x - mean) ** 2 for x in values) / (n * n)
+
+
+def clear_cut(window, uncut):
+    # whether cutting uncut down to window lowers the statistic by more than chance would
+    return mser_stat(window) < MARGIN ** (MARGIN_MEANS / len(uncut)) * mser_stat(uncut)
+
+
+def steady_range(values, batch=BATCH):
+    # (first, last + 1) sample indexes of the steady part of one series. The forward pass only sees
+    # what the backward pass left and the other way round, repeated until neither moves: a teardown
+    # tail left in would pull the warm-up cut early. A tail is short, so the backward pass may cut
+    # at most a quarter of what the warm-up left
+    means = batch_means(values, batch)
+    start, end = 0, len(means)
+    for _ in range(MAX_PASSES):
+        new_start = mser(means[:end])
+        new_end = len(means) - mser(means[new_start:][::-1], max_fraction=0.25)
+        if (new_start, new_end) == (start, end):
+            break
+        start, end = new_start, new_end
+    # a cut is only kept when it clearly lowers the statistic of what the other cut leaves
+    if start and not clear_cut(means[start:end], means[:end]):
+        start = 0
+    if end < len(means) and not clear_cut(means[start:end], means[start:]):
+        end = len(means)
+    return start * batch, min(len(values), end * batch)
+
+
+def steady_window(times, *series, batch=BATCH):
+    # (start, end) times of the window that is steady in every series, None when they do not overlap
+    if not times:
+        return None
+    start, end = 0, len(times)
+    for values in series:
+        first, last = steady_range(values, batch)
+        start, end = max(start, first), min(end, last)
+    if start >= end:
+        return None
+    return times[start], times[end - 1]
+
+
+def within(times, window):
+    # indexes of times inside a window, all of them without one
+    if window is None:
+        return list(range(len(times)))
+    return [i for i, t in enumerate(times) if window[0] <= t <= window[1]]
+
+
+def memtier_window(stats, batch=1):
+    # steady seconds of one memtier / mcload "ALL STATS" entry from its per-second throughput
+    # and average latency
+    series = stats.get("Time-Serie") or {}
+    seconds = sorted(int(s) for s in series)
+    counts = [series[str(s)].get("Count", 0) for s in seconds]
+    latency = [series[str(s)].get("Average Latency", 0.0) for s in seconds]
+    return steady_window(seconds, counts, latency, batch=batch)
+
+
+def check(runs=100):
+    # failures of the window on seeded Gaussian noise (expected: the whole range) and on the same
+    # noise behind a ramp-up (expected: the ramp cut)
+    failures = []
+    for seed in range(runs):
+        rng = random.Random(seed)
+        for n, batch in ((30, 1), (300, BATCH)):
+            noise = [rng.gauss(1000, 50) for _ in range(n)]
+            if steady_range(noise, batch) != (0, n):
+                failures.append(f"stationary n={n} batch={batch} seed={seed}: {steady_range(noise, batch)}")
+            ramp = [1000 * i / (4 * batch) for i in range(4 * batch)] + noise
+            if steady_range(ramp, batch)[0] < 4 * batch:
+                failures.append(f"ramp-up n={n} batch={batch} seed={seed}: {steady_range(ramp, batch)}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Steady-state windows of run time series")
+    sub = parser.add_subparsers(dest="command", required=True)
+    check_parser = sub.add_parser("check", help="check the windows on synthetic series")
+    check_parser.add_argument("--runs", type=int, default=100)
+    args = parser.parse_args()
+
+    failures = check(args.runs)
+    for failure in failures:
+        print(failure)
+    print(f"{len(failures)} failure(s) in {args.runs} runs")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,11 @@
+#include <ctype.h>
 #include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
 #include <time.h>
 
+#define MAX_INPUTS 64
+
 int fibonacci(int n) {
     if(n == 0) {
         return 0;
@@ -11,12 +16,11 @@ int fibonacci(int n) {
     }
 }
 
-int main() {
+void run(int n) {
     struct timespec start, end;
 
     clock_gettime(CLOCK_MONOTONIC, &start);
 
-    int n = 50;
     printf("Fibonacci of %d:\n\n", n);
 
     for(int i = 0; i < n; i++) {
@@ -29,6 +33,35 @@ int main() {
     long elapsed_ns = (end.tv_sec - start.tv_sec) * 1000000000L +
                       (end.tv_nsec - start.tv_nsec);
 
-    printf("Elapsed time: %ld nanoseconds\n", elapsed_ns);
+    printf("Elapsed time: %ld ns\n", elapsed_ns);
+    // stdout is a file or the serial console under harness/batch.py, each result goes out as it is measured
+    fflush(stdout);
+}
+
+// fibonacci [-i iterations] [n ...]
+int main(int argc, char *argv[]) {
+    int inputs[MAX_INPUTS];
+    int count = 0;
+    int iterations = 1;
+
+    for(int a = 1; a < argc; a++) {
+        if(strcmp(argv[a], "-i") == 0 && a + 1 < argc) {
+            iterations = atoi(argv[++a]);
+        } else if(isdigit((unsigned char)argv[a][0]) && count < MAX_INPUTS) {
+            inputs[count++] = atoi(argv[a]);
+        }
+    }
+    if(count == 0) {
+        inputs[count++] = 50;
+    }
+
+    for(int k = 0; k < count; k++) {
+        for(int it = 0; it < iterations; it++) {
+            run(inputs[k]);
+        }
+    }
+    // harness/batch.py shuts the VM down once it sees this
+    printf("Batch done\n");
+    fflush(stdout);
     return 0;
 }
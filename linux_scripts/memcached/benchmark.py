@@ -1,9 +1,28 @@
 # measuring network I/O performance, stressing the request/response cycle while focusing on application-level I/O, particularly memory-based I/O, 
 # since memcached operates entirely on RAM
 
+import os
 import subprocess
+import sys
+
+# RATE=<ops/s> switches to the native open-loop generator (harness/mcload.py), which measures latency
+# from each request's scheduled send time instead of memtier's closed loop
+RATE = float(os.environ.get("RATE", "0"))
+MCLOAD = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "harness", "mcload.py")
 
 for i in range(5):
+    if RATE:
+        subprocess.run([
+            sys.executable, MCLOAD,
+            "-s", "127.0.0.1",
+            "-p", "11211",
+            "--connections=200",
+            "--processes=4",
+            f"--rate={RATE}",
+            "--test-time=30",
+            f"--json-out-file=ubuntu_run1_{i}.json"
+        ])
+        continue
     subprocess.run([
         "memtier_benchmark",
         "-s", "127.0.0.1",
@@ -14,4 +33,3 @@ for i in range(5):
         "--test-time=30",
         f"--json-out-file=ubuntu_run1_{i}.json"
     ])
-
@@ -6,26 +6,65 @@ import csv
 import socket
 import threading
 import signal
+import sys
 
-LOG_DIR = "metrics"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "harness"))
+from proctree import from_popen
+from probe import wait_until_ready
+from sampler import ResourceSampler, steady_averages, usage_averages, usage_rows
+from memacct import MemoryAccountant
+from apptelemetry import AppScraper
+from schedstat import SchedCollector
+from console import ConsoleReader, UBUNTU_MARKERS, UBUNTU_PHASES, write_boot_phases
+from runmeta import update_run_metadata, write_run_metadata
+from overlay import discard, seed_for, take
+from snapshot import boot_mode, disk_path, load_guest, save_guest, state_paths
+from netbackend import GUEST_IP, backend, netdev_args, queues
+
+LOG_DIR = os.environ.get("METRICS_DIR", "metrics")
+SAMPLER_HZ = int(os.environ.get("SAMPLER_HZ", "100"))
+SAMPLER_CPU = int(os.environ["SAMPLER_CPU"]) if os.environ.get("SAMPLER_CPU") else None
+GUEST_MEM_MB = int(os.environ.get("GUEST_MEM_MB", "64"))
+MEMORY_INTERVAL = float(os.environ.get("MEMORY_INTERVAL", "1"))
+APP_STATS_HZ = float(os.environ.get("APP_STATS_HZ", "1"))
+SCHED_HZ = float(os.environ.get("SCHED_HZ", "10"))
+GUEST_BALLOON = os.environ.get("GUEST_BALLOON") == "1"
+BOOT_MODE = boot_mode()
+NET_BACKEND = backend()
+NET_QUEUES = queues()
+BASE_IMAGE = os.path.abspath("ubuntu.qcow2")
+OVERLAY_POOL = int(os.environ.get("OVERLAY_POOL", "2"))
+HOST_PORT = int(os.environ.get("HOST_PORT", "11211"))
 os.makedirs(LOG_DIR, exist_ok=True)
 DETAILED_LOG_FILE = os.path.join(LOG_DIR, "ubuntu_memcached_metrics.csv")
 SUMMARY_LOG_FILE = os.path.join(LOG_DIR, "metrics_summary.csv")
 TEED_LOG_FILE = os.path.join(LOG_DIR, "ubuntu_full_output.log")
 CPU_LOG_FILE = os.path.join(LOG_DIR, "cpu_usage_ubuntu.log")
+CONSOLE_LOG_FILE = os.path.join(LOG_DIR, "console_ubuntu.log")
+BOOT_PHASES_FILE = os.path.join(LOG_DIR, "boot_phases.csv")
+MEMORY_LOG_FILE = os.path.join(LOG_DIR, "memory_ubuntu.log")
+CPU_STORE_FILE = os.path.join(LOG_DIR, "cpu_ubuntu.umx")
+MEMORY_STORE_FILE = os.path.join(LOG_DIR, "memory_ubuntu.umx")
+APP_STATS_LOG_FILE = os.path.join(LOG_DIR, "app_stats_ubuntu.log")
+APP_STATS_STORE_FILE = os.path.join(LOG_DIR, "app_stats_ubuntu.umx")
+SCHED_LOG_FILE = os.path.join(LOG_DIR, "sched_ubuntu.log")
+SCHED_STORE_FILE = os.path.join(LOG_DIR, "sched_ubuntu.umx")
+MEMORY_SUMMARY_FILE = os.path.join(LOG_DIR, "memory_summary.csv")
+RUN_META_FILE = os.path.join(LOG_DIR, "run_meta.json")
+QMP_SOCKET = os.path.abspath(os.path.join(LOG_DIR, "qmp.sock"))
+RUN_DISK = os.path.abspath(os.path.join(LOG_DIR, "disk.qcow2"))
+NEXT_DISK = os.path.abspath(os.path.join(LOG_DIR, "disk_after_snapshot.qcow2"))
+STATE_FILE, _ = state_paths(os.getcwd(), GUEST_MEM_MB, ("-balloon" if GUEST_BALLOON else "") + ("-tap" if NET_BACKEND == "tap" else ""))
+GUEST_ADDRESS = (GUEST_IP, 11211) if NET_BACKEND == "tap" else ("127.0.0.1", HOST_PORT)
 STARTUP_TIMES_FILE = os.path.join(LOG_DIR, "startup_times.txt")  
+STARTUP_RESTORE_FILE = os.path.join(LOG_DIR, "startup_times_restore.txt")
 
-full_log_lines = []
-start_time = None  # will be set to the monitoring start time
+# written through line by line, a killed run still leaves its output behind
+teed_log = open(TEED_LOG_FILE, "a", buffering=1)
 
 def buffered_print(message):
     print(message)
-    full_log_lines.append(message)
-
-def tee_print_all():
-    with open(TEED_LOG_FILE, "a") as f:
-        for line in full_log_lines:
-            f.write(line + "\n")
+    teed_log.write(message + "\n")
 
 def port_in_use(port, host="127.0.0.1"):
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
@@ -33,54 +72,67 @@ def port_in_use(port, host="127.0.0.1"):
 
 def disable_host_memcached():
     try:
-        if port_in_use(11211):
-            buffered_print("Port 11211 is in use, trying to stop host memcached")
+        if port_in_use(HOST_PORT):
+            buffered_print(f"Port {HOST_PORT} is in use, trying to stop host memcached")
             subprocess.run(["sudo", "systemctl", "stop", "memcached"], check=False)
             time.sleep(2)
-            if port_in_use(11211):
-                result = subprocess.run(["sudo", "lsof", "-t", "-i:11211"], capture_output=True, text=True)
+            if port_in_use(HOST_PORT):
+                result = subprocess.run(["sudo", "lsof", "-t", f"-i:{HOST_PORT}"], capture_output=True, text=True)
                 for pid in result.stdout.strip().splitlines():
                     buffered_print(f"Killing by pid {pid}")
                     subprocess.run(["sudo", "kill", "-9", pid], check=False)
                 time.sleep(1)
-            if port_in_use(11211):
-                buffered_print("11211 is still in use after all attempts")
+            if port_in_use(HOST_PORT):
+                buffered_print(f"{HOST_PORT} is still in use after all attempts")
                 return False
-            buffered_print("11211 now free.")
+            buffered_print(f"{HOST_PORT} now free.")
         else:
-            buffered_print("11211 was free from the beginning")
+            buffered_print(f"{HOST_PORT} was free from the beginning")
         return True
     except Exception as e:
         buffered_print(f"Error stopping host Memcached: {e}")
         return False
 
 def wait_for_memcached_ready(host="127.0.0.1", port=11211, timeout=20):
-    start = time.time()
-    while time.time() - start < timeout:
-        try:
-            with socket.create_connection((host, port), timeout=0.5):
-                return time.time()
-        except (OSError, ConnectionRefusedError):
-            time.sleep(0.1)
-    return None
-
-def monitor_resource_usage_live(proc, usage_log, stop_event, interval=1):
-    proc.cpu_percent(interval=None)
-    log_lines = ["Time Elapsed,CPU (%),Memory (KB)\n"]
-    while not stop_event.is_set() and proc.is_running():
-        cpu = proc.cpu_percent(interval=interval)
-        mem = proc.memory_info().rss // 1024
-        elapsed = round(time.time() - start_time, 2)
-        log_lines.append(f"{elapsed},{cpu},{mem}\n")
-        usage_log.append([elapsed, cpu, mem])
-    with open(CPU_LOG_FILE, "w") as cpu_log:
-        cpu_log.writelines(log_lines)
+    # ready means the application answered (a memcached VERSION line), not just that slirp accepted the connection
+    return wait_until_ready(host, port, "memcached", timeout)
+
+def monitor_resource_usage_live(pid, stop_event, start_ns=None):
+    # sampling happens in a separate process that streams every sample to CPU_STORE_FILE
+    sampler = ResourceSampler(pid, hz=SAMPLER_HZ, cpu=SAMPLER_CPU, store_path=CPU_STORE_FILE, start_ns=start_ns)
+    sampler.start()
+    stop_event.wait()
+    sampler.stop()
+    try:
+        sampler.write_csv(CPU_LOG_FILE)
+    except Exception as e:
+        buffered_print(f"Failed to write CPU log: {e}")
+    buffered_print(sampler.overhead_report())
+    sampler.close()
+
+def save_ready_snapshot():
+    # the guest is paused while saving, done before the readiness line so the benchmark starts after it
+    try:
+        paused = save_guest(QMP_SOCKET, STATE_FILE, "disk0", NEXT_DISK, BASE_IMAGE)
+    except Exception as e:
+        buffered_print(f"Saving the snapshot failed: {e}")
+        return None
+    if paused is None:
+        buffered_print(f"Another run saved {STATE_FILE} first")
+        return None
+    buffered_print(f"Saved snapshot to {STATE_FILE} (guest paused {round(paused, 3)}s)")
+    return round(paused, 6)
 
 def run_and_monitor_ubuntu_memcached():
-    global start_time
     vm_proc = None
+    restore = None
+    snapshot_save_s = None
+    console = None
+    accountant = None
+    scraper = None
+    sched = None
     qemu_proc = None
-    usage_log = []
+    qemu = None
     startup_time = None
     stop_event = threading.Event()
     end_time = None
@@ -90,12 +142,43 @@ def run_and_monitor_ubuntu_memcached():
         nonlocal end_time
         buffered_print("Interrupt signal received, cleaning up")
         stop_event.set()
+
+        if scraper:
+            scraper.stop()
+            scraper.write_log(APP_STATS_LOG_FILE)
+            buffered_print(scraper.report())
+
+        if sched:
+            sched.stop()
+            sched.write_log(SCHED_LOG_FILE)
+            buffered_print(sched.report())
+
+        if accountant:
+            accountant.stop()
+            accountant.write_log(MEMORY_LOG_FILE)
+            accountant.append_summary(MEMORY_SUMMARY_FILE, run_id, "ubuntu", "memcached")
+            buffered_print(accountant.report())
+
+        if console and not restore:
+            write_boot_phases(BOOT_PHASES_FILE, run_id, "ubuntu", "memcached", console.phases(UBUNTU_PHASES), kraft_start_ns)
+
+        if qemu:
+            # read back from the QEMU command line while it still runs, after the measured part
+            write_run_metadata(RUN_META_FILE, qemu.pid, run_id=run_id, app="memcached", platform="ubuntu", startup_time=startup_time,
+                               boot_mode="restore" if restore else "cold", snapshot_save_s=snapshot_save_s)
         if vm_proc:
             try:
                 os.killpg(os.getpgid(vm_proc.pid), signal.SIGTERM)
             except Exception as e:
                 buffered_print(f"Could not terminate QEMU process group: {e}")
             vm_proc.wait()
+        # the overlays only ever belonged to this run
+        discard(RUN_DISK, NEXT_DISK)
+
+        if monitor_thread and monitor_thread.is_alive():
+            buffered_print("Waiting for monitor thread to finish")
+            monitor_thread.join(timeout=10)
+
         end_time = time.time()
 
         with open(DETAILED_LOG_FILE, "a", newline='') as f:
@@ -103,15 +186,20 @@ def run_and_monitor_ubuntu_memcached():
             if os.stat(DETAILED_LOG_FILE).st_size == 0:
                 writer.writerow(["Time Elapsed", "CPU (%)", "Memory (KB)"])
             if startup_time and isinstance(startup_time, float):
-                for entry in usage_log:
+                for entry in usage_rows(CPU_STORE_FILE):
                     writer.writerow(entry)
 
-        tee_print_all()
         duration = round(end_time - qemu_start, 3)
         buffered_print(f"QEMU duration: {duration}s")
-        if usage_log:
-            cpu_avg = round(sum(cpu for _, cpu, _ in usage_log) / len(usage_log), 2)
-            mem_avg = round(sum(mem for _, _, mem in usage_log) / len(usage_log), 2)
+        samples, cpu_avg, mem_avg = usage_averages(CPU_STORE_FILE)
+        window, steady_samples, steady_cpu, steady_mem = steady_averages(CPU_STORE_FILE, SAMPLER_HZ)
+        if window:
+            # boot and teardown excluded, the whole-run figures are kept for comparison
+            buffered_print(f"Avg CPU: {steady_cpu}% (steady state {window[0]}-{window[1]}s, whole run {cpu_avg}%)")
+            buffered_print(f"Avg Memory: {steady_mem} KB (steady state, whole run {mem_avg} KB)")
+            update_run_metadata(RUN_META_FILE, steady_window_s=list(window), steady_samples=steady_samples,
+                                cpu_avg=cpu_avg, mem_avg_kb=mem_avg, steady_cpu_avg=steady_cpu, steady_mem_avg_kb=steady_mem)
+        elif samples:
             buffered_print(f"Avg CPU: {cpu_avg}%")
             buffered_print(f"Avg Memory: {mem_avg} KB")
         exit(0)
@@ -126,56 +214,82 @@ def run_and_monitor_ubuntu_memcached():
 
         buffered_print("Starting Ubuntu QEMU VM with Memcached")
         kraft_start = time.time()
+        kraft_start_ns = time.monotonic_ns()
+        run_id = time.strftime("%Y%m%d-%H%M%S", time.localtime(kraft_start))
+        restore = load_guest(STATE_FILE, BASE_IMAGE) if BOOT_MODE == "snapshot" else None
+        buffered_print(f"Boot mode: {'restore' if restore else 'cold'}")
+        buffered_print(f"Network: {NET_BACKEND}, guest at {GUEST_ADDRESS[0]}:{GUEST_ADDRESS[1]}")
+        # a fresh overlay of the base, or of the disk saved with the snapshot, the base itself is never written
+        _, pooled = take(disk_path(STATE_FILE) if restore else BASE_IMAGE, RUN_DISK, OVERLAY_POOL)
+        seed = seed_for()
+        buffered_print(f"Booting {'a pooled' if pooled else 'a new'} overlay of {os.path.basename(BASE_IMAGE)} with {os.path.basename(seed)}")
 
         vm_proc = subprocess.Popen(
             [
                 "qemu-system-x86_64",
-                "-m", "64M",
+                "-m", f"{GUEST_MEM_MB}M",
                 "-smp", "cpus=1,threads=1,sockets=1",
                 "-cpu", "host,+x2apic,-pmu",
-                "-netdev", "user,id=net0,hostfwd=tcp::11211-:11211",
-                "-device", "virtio-net-pci,netdev=net0",
-                "-drive", "file=ubuntu.qcow2,format=qcow2",
-                "-cdrom", "seed.iso",
+                # vCPU threads named "CPU n/KVM", for thread placement when QMP is busy
+                "-name", "ubuntu,debug-threads=on",
+            ] + netdev_args("net0", NET_BACKEND, HOST_PORT, 11211, NET_QUEUES) + [
+                "-drive", f"file={RUN_DISK},format=qcow2,id=disk0",
+                "-cdrom", seed,
                 "-enable-kvm",
                 "-nographic",
-                "-serial", "mon:stdio"
-            ],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
+                "-serial", "mon:stdio",
+                "-qmp", f"unix:{QMP_SOCKET},server=on,wait=off"
+            ] + (["-device", "virtio-balloon-pci,id=balloon0"] if GUEST_BALLOON else [])
+              + (["-incoming", f"exec:cat {STATE_FILE}"] if restore else []),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
             stdin=subprocess.DEVNULL,
             preexec_fn=os.setsid
         )
 
-        buffered_print("Waiting for QEMU process to appear")
-        qemu_proc = next((p for p in psutil.process_iter(['pid', 'name', 'cmdline'])
-                          if 'qemu-system-x86_64' in p.info['name']), None)
-
-        if not qemu_proc:
-            buffered_print("Couldn't find QEMU process")
-            return
+        # we exec QEMU ourselves, so the Popen child is the QEMU process
+        qemu = from_popen(vm_proc)
+        # -serial mon:stdio puts the guest serial console on stdout
+        console = ConsoleReader(vm_proc.stdout, UBUNTU_MARKERS, CONSOLE_LOG_FILE)
+        console.mark("qemu_exec", qemu.exec_ns)
+        console.start()
+        qemu_proc = psutil.Process(qemu.pid)
 
-        qemu_start = time.time()
-        start_time = qemu_start  # Start monitoring from same point as Unikraft script
-        buffered_print(f"QEMU started after +{round(qemu_start - kraft_start, 3)}s (PID: {qemu_proc.pid})")
+        qemu_start = qemu.wall_time()
+        buffered_print(f"QEMU started after +{round(qemu.seconds_since(kraft_start_ns), 6)}s (PID: {qemu_proc.pid})")
 
+        # one time base for the resource samples and the application stats
+        clock_ns = time.monotonic_ns()
         monitor_thread = threading.Thread(
             target=monitor_resource_usage_live,
-            args=(qemu_proc, usage_log, stop_event),
+            args=(qemu.pid, stop_event, clock_ns),
             daemon=True
         )
         monitor_thread.start()
+        accountant = MemoryAccountant(qemu.pid, GUEST_MEM_MB, MEMORY_INTERVAL, QMP_SOCKET if GUEST_BALLOON else None, MEMORY_STORE_FILE)
+        accountant.start()
+        if SCHED_HZ > 0:
+            sched = SchedCollector(qemu.pid, SCHED_HZ, clock_ns, SCHED_STORE_FILE)
+            sched.start()
         buffered_print("Started resource monitoring immediately after QEMU detection.")
 
         buffered_print("Waiting for Memcached to accept connections")
-        ready_time = wait_for_memcached_ready("127.0.0.1", 11211, timeout=30)
+        probe = wait_for_memcached_ready(*GUEST_ADDRESS, timeout=30)
 
-        if ready_time:
-            startup_time = round(ready_time - qemu_start, 3)
+        if probe.ready_ns is not None:
+            milestones = probe.since(qemu.exec_ns)
+            startup_time = round(milestones["ready"], 6)
+            console.mark("first_request", probe.ready_ns)
+            buffered_print(f"Memcached accepted after +{round(milestones['accept'], 6)}s, first byte after +{round(milestones['first_byte'], 6)}s ({probe.attempts} probes)")
+            if BOOT_MODE == "snapshot" and not restore:
+                snapshot_save_s = save_ready_snapshot()
+            if APP_STATS_HZ > 0:
+                scraper = AppScraper("memcached", *GUEST_ADDRESS, APP_STATS_HZ, clock_ns, APP_STATS_STORE_FILE)
+                scraper.start()
             buffered_print(f"Memcached is ready at +{startup_time}s")
 
-            # Append to startup_times.txt
-            with open(STARTUP_TIMES_FILE, "a") as f:
+            # Append to startup_times.txt, restores go to their own file
+            with open(STARTUP_RESTORE_FILE if restore else STARTUP_TIMES_FILE, "a") as f:
                 f.write(f"{startup_time}\n")
         else:
             buffered_print("Memcached did not start in time.")
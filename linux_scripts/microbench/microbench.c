@@ -0,0 +1,300 @@
+// Microbenchmarks of the primitive operations applications lean on: system calls, the allocator,
+// memcpy, file I/O through the VFS, TCP over loopback and threads. Same tests and output as
+// Unikraft_scripts/microbench/microbench.c, timed with clock_gettime instead of
+// ukplat_monotonic_clock.
+//
+// Every test runs one warm-up round and ROUNDS timed rounds, then prints one line with the median
+// and the best round:
+//
+//   BENCH test=malloc_free param=4096 iters=100000 rounds=5 ns_per_op=21.37 min_ns_per_op=20.90
+//
+// Copy tests add mb_per_s. A test that fails prints error=<errno> instead of timings, and a line with
+// suite= starts every run. resultsdb.py reads the BENCH lines.
+//
+//   gcc -O2 -pthread -o microbench microbench.c && ./microbench
+
+#define _GNU_SOURCE
+#include <arpa/inet.h>
+#include <errno.h>
+#include <fcntl.h>
+#include <netinet/in.h>
+#include <netinet/tcp.h>
+#include <pthread.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/socket.h>
+#include <sys/syscall.h>
+#include <time.h>
+#include <unistd.h>
+
+#define PLATFORM "ubuntu"
+#define CLOCK_NAME "clock_gettime"
+#define FILE_PATH "/tmp/microbench.dat"
+#define ROUNDS 5
+#define FILE_BLOCK 4096
+#define FILE_BLOCKS 256
+#define COPY_MAX (16 << 20)
+#define COPY_BYTES (256 << 20)
+
+// keeps the compiler from dropping work whose result is never read
+#define KEEP(p) __asm__ volatile("" : : "r"(p) : "memory")
+
+static unsigned long long now_ns(void)
+{
+    struct timespec ts;
+
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec * 1000000000ULL + ts.tv_nsec;
+}
+
+static char *copy_src, *copy_dst;
+static char file_buf[FILE_BLOCK];
+static int file_fd = -1;
+static int client_fd = -1, server_fd = -1;
+
+static int full_io(int fd, char *buf, long n, int writing)
+{
+    long done = 0;
+
+    while (done < n) {
+        long r = writing ? write(fd, buf + done, n - done) : read(fd, buf + done, n - done);
+        if (r <= 0)
+            return -1;
+        done += r;
+    }
+    return 0;
+}
+
+static int null_syscall(long iters, long param)
+{
+    for (long i = 0; i < iters; i++)
+        syscall(SYS_getppid);
+    return 0;
+}
+
+static int getpid_call(long iters, long param)
+{
+    for (long i = 0; i < iters; i++) {
+        pid_t pid = getpid();
+        KEEP(pid);
+    }
+    return 0;
+}
+
+static int clock_gettime_call(long iters, long param)
+{
+    struct timespec ts;
+
+    for (long i = 0; i < iters; i++) {
+        clock_gettime(CLOCK_MONOTONIC, &ts);
+        KEEP(&ts);
+    }
+    return 0;
+}
+
+static int malloc_free(long iters, long size)
+{
+    for (long i = 0; i < iters; i++) {
+        char *p = malloc(size);
+        if (!p)
+            return -1;
+        // one write, so the allocator has to hand out memory that is really there
+        p[0] = 0;
+        KEEP(p);
+        free(p);
+    }
+    return 0;
+}
+
+static int memcpy_copy(long iters, long size)
+{
+    for (long i = 0; i < iters; i++) {
+        memcpy(copy_dst, copy_src, size);
+        KEEP(copy_dst);
+    }
+    return 0;
+}
+
+static int file_open_close(long iters, long param)
+{
+    for (long i = 0; i < iters; i++) {
+        int fd = open(FILE_PATH, O_RDONLY);
+        if (fd < 0)
+            return -1;
+        close(fd);
+    }
+    return 0;
+}
+
+static int file_write(long iters, long size)
+{
+    for (long i = 0; i < iters; i++)
+        if (pwrite(file_fd, file_buf, size, (i % FILE_BLOCKS) * FILE_BLOCK) != size)
+            return -1;
+    return 0;
+}
+
+static int file_read(long iters, long size)
+{
+    for (long i = 0; i < iters; i++)
+        if (pread(file_fd, file_buf, size, (i % FILE_BLOCKS) * FILE_BLOCK) != size)
+            return -1;
+    return 0;
+}
+
+static int tcp_rtt(long iters, long size)
+{
+    // client -> server -> client over one loopback connection, both ends in this thread
+    for (long i = 0; i < iters; i++)
+        if (full_io(client_fd, file_buf, size, 1) || full_io(server_fd, file_buf, size, 0)
+            || full_io(server_fd, file_buf, size, 1) || full_io(client_fd, file_buf, size, 0))
+            return -1;
+    return 0;
+}
+
+static void *noop(void *arg)
+{
+    return arg;
+}
+
+static int thread_create_join(long iters, long param)
+{
+    pthread_t thread;
+
+    for (long i = 0; i < iters; i++) {
+        if (pthread_create(&thread, NULL, noop, NULL))
+            return -1;
+        pthread_join(thread, NULL);
+    }
+    return 0;
+}
+
+static int compare_double(const void *a, const void *b)
+{
+    double x = *(const double *)a, y = *(const double *)b;
+
+    return (x > y) - (x < y);
+}
+
+static void measure(const char *test, int (*fn)(long, long), long param, long iters, int copies)
+{
+    double per_op[ROUNDS];
+
+    errno = 0;
+    if (fn(iters / 10 + 1, param)) {
+        printf("BENCH test=%s param=%ld error=%d\n", test, param, errno);
+        return;
+    }
+    for (int r = 0; r < ROUNDS; r++) {
+        unsigned long long start = now_ns();
+        if (fn(iters, param)) {
+            printf("BENCH test=%s param=%ld error=%d\n", test, param, errno);
+            return;
+        }
+        per_op[r] = (double)(now_ns() - start) / iters;
+    }
+    qsort(per_op, ROUNDS, sizeof(per_op[0]), compare_double);
+    printf("BENCH test=%s param=%ld iters=%ld rounds=%d ns_per_op=%.2f min_ns_per_op=%.2f", test, param, iters, ROUNDS,
+           per_op[ROUNDS / 2], per_op[0]);
+    if (copies)
+        printf(" mb_per_s=%.1f", param / per_op[ROUNDS / 2] * 1000.0);
+    printf("\n");
+}
+
+static int setup_file(void)
+{
+    memset(file_buf, 'x', sizeof(file_buf));
+    file_fd = open(FILE_PATH, O_RDWR | O_CREAT | O_TRUNC, 0644);
+    if (file_fd < 0)
+        return -1;
+    for (int i = 0; i < FILE_BLOCKS; i++)
+        if (write(file_fd, file_buf, FILE_BLOCK) != FILE_BLOCK)
+            return -1;
+    return 0;
+}
+
+static int setup_tcp(void)
+{
+    struct sockaddr_in addr;
+    socklen_t len = sizeof(addr);
+    int one = 1;
+    int listen_fd = socket(AF_INET, SOCK_STREAM, 0);
+
+    if (listen_fd < 0)
+        return -1;
+    memset(&addr, 0, sizeof(addr));
+    addr.sin_family = AF_INET;
+    addr.sin_addr.s_addr = htonl(INADDR_LOOPBACK);
+    if (bind(listen_fd, (struct sockaddr *)&addr, sizeof(addr)) || listen(listen_fd, 1)
+        || getsockname(listen_fd, (struct sockaddr *)&addr, &len))
+        goto fail;
+    client_fd = socket(AF_INET, SOCK_STREAM, 0);
+    if (client_fd < 0 || connect(client_fd, (struct sockaddr *)&addr, sizeof(addr)))
+        goto fail;
+    server_fd = accept(listen_fd, NULL, NULL);
+    if (server_fd < 0)
+        goto fail;
+    setsockopt(client_fd, IPPROTO_TCP, TCP_NODELAY, &one, sizeof(one));
+    setsockopt(server_fd, IPPROTO_TCP, TCP_NODELAY, &one, sizeof(one));
+    close(listen_fd);
+    return 0;
+fail:
+    close(listen_fd);
+    return -1;
+}
+
+int main(void)
+{
+    static const long malloc_sizes[] = {16, 256, 4096, 65536, 1 << 20};
+    static const long copy_sizes[] = {4096, 65536, 1 << 20, COPY_MAX};
+    static const long tcp_sizes[] = {64, 1024};
+
+    printf("BENCH suite=microbench platform=%s clock=%s rounds=%d\n", PLATFORM, CLOCK_NAME, ROUNDS);
+
+    measure("null_syscall", null_syscall, 0, 1000000, 0);
+    measure("getpid", getpid_call, 0, 1000000, 0);
+    measure("clock_gettime", clock_gettime_call, 0, 1000000, 0);
+    for (unsigned i = 0; i < sizeof(malloc_sizes) / sizeof(malloc_sizes[0]); i++)
+        measure("malloc_free", malloc_free, malloc_sizes[i], 100000, 0);
+
+    copy_src = malloc(COPY_MAX);
+    copy_dst = malloc(COPY_MAX);
+    if (copy_src && copy_dst) {
+        // touch both buffers first, page faults are not part of the copy
+        memset(copy_src, 1, COPY_MAX);
+        memset(copy_dst, 0, COPY_MAX);
+        for (unsigned i = 0; i < sizeof(copy_sizes) / sizeof(copy_sizes[0]); i++)
+            measure("memcpy", memcpy_copy, copy_sizes[i], COPY_BYTES / copy_sizes[i], 1);
+    } else {
+        printf("BENCH test=memcpy param=0 error=%d\n", ENOMEM);
+    }
+    free(copy_src);
+    free(copy_dst);
+
+    if (setup_file() == 0) {
+        measure("file_open_close", file_open_close, 0, 100000, 0);
+        measure("file_write", file_write, FILE_BLOCK, 100000, 1);
+        measure("file_read", file_read, FILE_BLOCK, 100000, 1);
+    } else {
+        printf("BENCH test=file param=0 error=%d\n", errno);
+    }
+    if (file_fd >= 0)
+        close(file_fd);
+    unlink(FILE_PATH);
+
+    if (setup_tcp() == 0) {
+        for (unsigned i = 0; i < sizeof(tcp_sizes) / sizeof(tcp_sizes[0]); i++)
+            measure("tcp_rtt", tcp_rtt, tcp_sizes[i], 10000, 0);
+    } else {
+        printf("BENCH test=tcp param=0 error=%d\n", errno);
+    }
+    if (client_fd >= 0)
+        close(client_fd);
+    if (server_fd >= 0)
+        close(server_fd);
+
+    measure("thread_create_join", thread_create_join, 0, 2000, 0);
+    printf("BENCH done\n");
+    return 0;
+}
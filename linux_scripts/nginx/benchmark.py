@@ -1,11 +1,21 @@
+import os
 import subprocess
+import sys
+
+# RATE=<req/s> switches to the native fixed-rate generator (harness/httpload.py), which prints the same
+# summary as wrk and also writes the full latency histogram to a json next to the txt
+RATE = float(os.environ.get("RATE", "0"))
+HTTPLOAD = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "harness", "httpload.py")
 
 for i in range(5):
     out_file = f"nginx_ubuntu_run_100_{i}.txt"
+    if RATE:
+        cmd = [sys.executable, HTTPLOAD, "http://localhost:8080/", "-c100", "-t4", "-d30", f"--rate={RATE}",
+               f"--json-out-file=nginx_ubuntu_run_100_{i}.json"]
+    else:
+        cmd = ["wrk", "-t4", "-c100", "-d30s", "http://localhost:8080/"]
     with open(out_file, "w") as f:
         subprocess.run(
-            ["wrk", "-t4", "-c100", "-d30s", "http://localhost:8080/"],
+            cmd,
             stdout=f
         )
-
-
@@ -3,75 +3,108 @@ import psutil
 import time
 import os
 import csv
-import socket
 import threading
 import signal
 import sys
 
-LOG_DIR = "metrics"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "harness"))
+from proctree import from_popen
+from probe import wait_until_ready
+from sampler import ResourceSampler, steady_averages, usage_averages, usage_rows
+from memacct import MemoryAccountant
+from apptelemetry import AppScraper
+from schedstat import SchedCollector
+from console import ConsoleReader, UBUNTU_MARKERS, UBUNTU_PHASES, write_boot_phases
+from runmeta import update_run_metadata, write_run_metadata
+from overlay import discard, seed_for, take
+from snapshot import boot_mode, disk_path, load_guest, save_guest, state_paths
+from netbackend import GUEST_IP, backend, netdev_args, queues
+
+LOG_DIR = os.environ.get("METRICS_DIR", "metrics")
+SAMPLER_HZ = int(os.environ.get("SAMPLER_HZ", "100"))
+SAMPLER_CPU = int(os.environ["SAMPLER_CPU"]) if os.environ.get("SAMPLER_CPU") else None
+GUEST_MEM_MB = int(os.environ.get("GUEST_MEM_MB", "128"))
+MEMORY_INTERVAL = float(os.environ.get("MEMORY_INTERVAL", "1"))
+APP_STATS_HZ = float(os.environ.get("APP_STATS_HZ", "1"))
+SCHED_HZ = float(os.environ.get("SCHED_HZ", "10"))
+GUEST_BALLOON = os.environ.get("GUEST_BALLOON") == "1"
+BOOT_MODE = boot_mode()
+NET_BACKEND = backend()
+NET_QUEUES = queues()
+BASE_IMAGE = os.path.abspath("ubuntu.qcow2")
+OVERLAY_POOL = int(os.environ.get("OVERLAY_POOL", "2"))
+HOST_PORT = int(os.environ.get("HOST_PORT", "8080"))
+# raw image attached read-only as a second virtio disk (harness/fsbench.py), mounted by its user-data
+DOCROOT_DISK = os.environ.get("DOCROOT_DISK")
 os.makedirs(LOG_DIR, exist_ok=True)
 METRICS_FILE = os.path.join(LOG_DIR, "ubuntu_nginx_metrics.csv")
 TEED_LOG_FILE = os.path.join(LOG_DIR, "ubuntu_full_output.log")
 CPU_LOG_FILE = os.path.join(LOG_DIR, "cpu_usage_ubuntu.log")
+CONSOLE_LOG_FILE = os.path.join(LOG_DIR, "console_ubuntu.log")
+BOOT_PHASES_FILE = os.path.join(LOG_DIR, "boot_phases.csv")
+MEMORY_LOG_FILE = os.path.join(LOG_DIR, "memory_ubuntu.log")
+CPU_STORE_FILE = os.path.join(LOG_DIR, "cpu_ubuntu.umx")
+MEMORY_STORE_FILE = os.path.join(LOG_DIR, "memory_ubuntu.umx")
+APP_STATS_LOG_FILE = os.path.join(LOG_DIR, "app_stats_ubuntu.log")
+APP_STATS_STORE_FILE = os.path.join(LOG_DIR, "app_stats_ubuntu.umx")
+SCHED_LOG_FILE = os.path.join(LOG_DIR, "sched_ubuntu.log")
+SCHED_STORE_FILE = os.path.join(LOG_DIR, "sched_ubuntu.umx")
+MEMORY_SUMMARY_FILE = os.path.join(LOG_DIR, "memory_summary.csv")
+RUN_META_FILE = os.path.join(LOG_DIR, "run_meta.json")
+QMP_SOCKET = os.path.abspath(os.path.join(LOG_DIR, "qmp.sock"))
+RUN_DISK = os.path.abspath(os.path.join(LOG_DIR, "disk.qcow2"))
+NEXT_DISK = os.path.abspath(os.path.join(LOG_DIR, "disk_after_snapshot.qcow2"))
+STATE_FILE, _ = state_paths(os.getcwd(), GUEST_MEM_MB, ("-balloon" if GUEST_BALLOON else "") + ("-tap" if NET_BACKEND == "tap" else ""))
+GUEST_ADDRESS = (GUEST_IP, 80) if NET_BACKEND == "tap" else ("127.0.0.1", HOST_PORT)
 
-start_time = None
-full_log_lines = []
+# written through line by line, a killed run still leaves its output behind
+teed_log = open(TEED_LOG_FILE, "a", buffering=1)
 
 def buffered_print(message):
     print(message)
-    full_log_lines.append(message)
-
-def tee_print_all():
-    with open(TEED_LOG_FILE, "a") as f:
-        for line in full_log_lines:
-            f.write(line + "\n")
+    teed_log.write(message + "\n")
 
 def wait_for_nginx_ready(host="127.0.0.1", port=8080, timeout=30):
-    start = time.time()
-    while time.time() - start < timeout:
-        try:
-            with socket.create_connection((host, port), timeout=0.5):
-                return time.time()
-        except (OSError, ConnectionRefusedError):
-            time.sleep(0.1)
-    return None
-
-def monitor_resource_usage_live(proc, usage_log, stop_event, interval=1):
-    try:
-        proc.cpu_percent(interval=None)
-    except psutil.NoSuchProcess:
-        buffered_print("aborted: QEMU exited before warm-up.")
-        return
-
-    log_lines = ["Time Elapsed,CPU (%),Memory (KB)\n"]
-    while not stop_event.is_set():
-        try:
-            if not proc.is_running():
-                break
-            cpu = proc.cpu_percent(interval=interval)
-            mem = proc.memory_info().rss // 1024
-            elapsed = round(time.time() - start_time, 2)
-            log_lines.append(f"{elapsed},{cpu},{mem}\n")
-            usage_log.append((elapsed, cpu, mem))
-        except psutil.NoSuchProcess:
-            buffered_print("QEMU exited during monitoring.")
-            break
-        except Exception as e:
-            buffered_print(f"Monitoring error: {e}")
-            break
+    # ready means the application answered (HTTP 200), not just that slirp accepted the connection
+    return wait_until_ready(host, port, "http", timeout)
 
+def monitor_resource_usage_live(pid, stop_event, start_ns=None):
+    # sampling happens in a separate process that streams every sample to CPU_STORE_FILE
+    sampler = ResourceSampler(pid, hz=SAMPLER_HZ, cpu=SAMPLER_CPU, store_path=CPU_STORE_FILE, start_ns=start_ns)
+    sampler.start()
+    stop_event.wait()
+    sampler.stop()
     try:
-        with open(CPU_LOG_FILE, "w") as cpu_log:
-            cpu_log.writelines(log_lines)
+        sampler.write_csv(CPU_LOG_FILE)
     except Exception as e:
         buffered_print(f"Failed to write CPU log: {e}")
+    buffered_print(sampler.overhead_report())
+    sampler.close()
+
+def save_ready_snapshot():
+    # the guest is paused while saving, done before the readiness line so the benchmark starts after it
+    try:
+        paused = save_guest(QMP_SOCKET, STATE_FILE, "disk0", NEXT_DISK, BASE_IMAGE)
+    except Exception as e:
+        buffered_print(f"Saving the snapshot failed: {e}")
+        return None
+    if paused is None:
+        buffered_print(f"Another run saved {STATE_FILE} first")
+        return None
+    buffered_print(f"Saved snapshot to {STATE_FILE} (guest paused {round(paused, 3)}s)")
+    return round(paused, 6)
 
 def run_and_monitor_ubuntu_nginx():
-    global start_time
     vm_proc = None
+    restore = None
+    snapshot_save_s = None
+    console = None
+    accountant = None
+    scraper = None
+    sched = None
     qemu_proc = None
+    qemu = None
     qemu_start = None
-    usage_log = []
     startup_time = None
     stop_event = threading.Event()
     monitor_thread = None
@@ -82,12 +115,38 @@ def run_and_monitor_ubuntu_nginx():
         buffered_print("Interruptedddddddddddd-----")
         stop_event.set()
 
+        if scraper:
+            scraper.stop()
+            scraper.write_log(APP_STATS_LOG_FILE)
+            buffered_print(scraper.report())
+
+        if sched:
+            sched.stop()
+            sched.write_log(SCHED_LOG_FILE)
+            buffered_print(sched.report())
+
+        if accountant:
+            accountant.stop()
+            accountant.write_log(MEMORY_LOG_FILE)
+            accountant.append_summary(MEMORY_SUMMARY_FILE, run_id, "ubuntu", "nginx")
+            buffered_print(accountant.report())
+
+        if console and not restore:
+            write_boot_phases(BOOT_PHASES_FILE, run_id, "ubuntu", "nginx", console.phases(UBUNTU_PHASES), kraft_start_ns)
+
+        if qemu:
+            # read back from the QEMU command line while it still runs, after the measured part
+            write_run_metadata(RUN_META_FILE, qemu.pid, run_id=run_id, app="nginx", platform="ubuntu", startup_time=startup_time,
+                               boot_mode="restore" if restore else "cold", snapshot_save_s=snapshot_save_s)
+
         if vm_proc and vm_proc.poll() is None:
             try:
                 os.killpg(os.getpgid(vm_proc.pid), signal.SIGTERM)
                 vm_proc.wait(timeout=10)
             except Exception as e:
                 buffered_print(f"Could not terminate QEMU process group: {e}")
+        # the overlays only ever belonged to this run
+        discard(RUN_DISK, NEXT_DISK)
 
         if monitor_thread and monitor_thread.is_alive():
             buffered_print("Waiting for monitor thread to finish")
@@ -101,17 +160,22 @@ def run_and_monitor_ubuntu_nginx():
             if not file_exists:
                 writer.writerow(["Time (s)", "CPU Usage (%)", "Memory Usage (KB)"])
             if isinstance(startup_time, float):
-                for t, cpu, mem in usage_log:
+                for t, cpu, mem in usage_rows(CPU_STORE_FILE):
                     writer.writerow([t, cpu, mem])
 
-        tee_print_all()
         qemu_duration = round(end_time - qemu_start, 3) if qemu_start else 0
         total_duration = round(end_time - kraft_start, 3)
         buffered_print(f"QEMU total duration: {qemu_duration}s")
         buffered_print(f"Total runtime: {total_duration}s")
-        if usage_log:
-            cpu_avg = round(sum(cpu for _, cpu, _ in usage_log) / len(usage_log), 2)
-            mem_avg = round(sum(mem for _, _, mem in usage_log) / len(usage_log), 2)
+        samples, cpu_avg, mem_avg = usage_averages(CPU_STORE_FILE)
+        window, steady_samples, steady_cpu, steady_mem = steady_averages(CPU_STORE_FILE, SAMPLER_HZ)
+        if window:
+            # boot and teardown excluded, the whole-run figures are kept for comparison
+            buffered_print(f"Avg CPU: {steady_cpu}% (steady state {window[0]}-{window[1]}s, whole run {cpu_avg}%)")
+            buffered_print(f"Avg Memory: {steady_mem} KB (steady state, whole run {mem_avg} KB)")
+            update_run_metadata(RUN_META_FILE, steady_window_s=list(window), steady_samples=steady_samples,
+                                cpu_avg=cpu_avg, mem_avg_kb=mem_avg, steady_cpu_avg=steady_cpu, steady_mem_avg_kb=steady_mem)
+        elif samples:
             buffered_print(f"Avg CPU: {cpu_avg}%")
             buffered_print(f"Avg Memory: {mem_avg} KB")
 
@@ -123,61 +187,78 @@ def run_and_monitor_ubuntu_nginx():
     try:
         buffered_print("Starting Ubuntu QEMU VM with Nginx")
         kraft_start = time.time()
+        kraft_start_ns = time.monotonic_ns()
+        run_id = time.strftime("%Y%m%d-%H%M%S", time.localtime(kraft_start))
+        restore = load_guest(STATE_FILE, BASE_IMAGE) if BOOT_MODE == "snapshot" else None
+        buffered_print(f"Boot mode: {'restore' if restore else 'cold'}")
+        buffered_print(f"Network: {NET_BACKEND}, guest at {GUEST_ADDRESS[0]}:{GUEST_ADDRESS[1]}")
+        # a fresh overlay of the base, or of the disk saved with the snapshot, the base itself is never written
+        _, pooled = take(disk_path(STATE_FILE) if restore else BASE_IMAGE, RUN_DISK, OVERLAY_POOL)
+        seed = seed_for()
+        buffered_print(f"Booting {'a pooled' if pooled else 'a new'} overlay of {os.path.basename(BASE_IMAGE)} with {os.path.basename(seed)}")
 
         vm_proc = subprocess.Popen(
             [
                 "qemu-system-x86_64",
-                "-m", "128M",
+                "-m", f"{GUEST_MEM_MB}M",
                 "-smp", "cpus=1,threads=1,sockets=1",
                 "-cpu", "host,+x2apic,-pmu",
-                "-netdev", "user,id=net0,hostfwd=tcp::8080-:80",
-                "-device", "virtio-net-pci,netdev=net0",
-                "-drive", "file=ubuntu.qcow2,format=qcow2",
-                "-cdrom", "seed.iso",
+                # vCPU threads named "CPU n/KVM", for thread placement when QMP is busy
+                "-name", "ubuntu,debug-threads=on",
+            ] + netdev_args("net0", NET_BACKEND, HOST_PORT, 80, NET_QUEUES) + [
+                "-drive", f"file={RUN_DISK},format=qcow2,id=disk0",
+                "-cdrom", seed,
                 "-enable-kvm",
                 "-nographic",
-                "-serial", "mon:stdio"
-            ],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
+                "-serial", "mon:stdio",
+                "-qmp", f"unix:{QMP_SOCKET},server=on,wait=off"
+            ] + (["-device", "virtio-balloon-pci,id=balloon0"] if GUEST_BALLOON else [])
+              + (["-drive", f"file={DOCROOT_DISK},format=raw,if=virtio,readonly=on"] if DOCROOT_DISK else [])
+              + (["-incoming", f"exec:cat {STATE_FILE}"] if restore else []),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
             stdin=subprocess.DEVNULL,
             preexec_fn=os.setsid
         )
 
-        buffered_print("Waiting for QEMU process to appear")
-        deadline = time.time() + 15
-        while time.time() < deadline:
-            for p in psutil.process_iter(['pid', 'name', 'cmdline']):
-                try:
-                    if p.name().startswith('qemu-system') and "8080" in ' '.join(p.cmdline()):
-                        qemu_proc = p
-                        break
-                except (psutil.NoSuchProcess, psutil.AccessDenied):
-                    continue
-            if qemu_proc:
-                break
-            time.sleep(0.5)
-
-        if not qemu_proc:
-            buffered_print("Couldn't find QEMU process.")
-            return
-
-        qemu_start = time.time()
-        start_time = time.time()
-        buffered_print(f"QEMU started after +{round(qemu_start - kraft_start, 3)}s (PID: {qemu_proc.pid})")
+        # we exec QEMU ourselves, so the Popen child is the QEMU process
+        qemu = from_popen(vm_proc)
+        # -serial mon:stdio puts the guest serial console on stdout
+        console = ConsoleReader(vm_proc.stdout, UBUNTU_MARKERS, CONSOLE_LOG_FILE)
+        console.mark("qemu_exec", qemu.exec_ns)
+        console.start()
+        qemu_proc = psutil.Process(qemu.pid)
+
+        qemu_start = qemu.wall_time()
+        buffered_print(f"QEMU started after +{round(qemu.seconds_since(kraft_start_ns), 6)}s (PID: {qemu_proc.pid})")
 
+        # one time base for the resource samples and the application stats
+        clock_ns = time.monotonic_ns()
         monitor_thread = threading.Thread(
             target=monitor_resource_usage_live,
-            args=(qemu_proc, usage_log, stop_event),
+            args=(qemu.pid, stop_event, clock_ns),
             daemon=True
         )
         monitor_thread.start()
+        accountant = MemoryAccountant(qemu.pid, GUEST_MEM_MB, MEMORY_INTERVAL, QMP_SOCKET if GUEST_BALLOON else None, MEMORY_STORE_FILE)
+        accountant.start()
+        if SCHED_HZ > 0:
+            sched = SchedCollector(qemu.pid, SCHED_HZ, clock_ns, SCHED_STORE_FILE)
+            sched.start()
 
         buffered_print("Waiting for Nginx")
-        ready_time = wait_for_nginx_ready("127.0.0.1", 8080)
+        probe = wait_for_nginx_ready(*GUEST_ADDRESS)
 
-        if ready_time:
-            startup_time = round(ready_time - qemu_start, 3)
+        if probe.ready_ns is not None:
+            milestones = probe.since(qemu.exec_ns)
+            startup_time = round(milestones["ready"], 6)
+            console.mark("first_request", probe.ready_ns)
+            buffered_print(f"Nginx accepted after +{round(milestones['accept'], 6)}s, first byte after +{round(milestones['first_byte'], 6)}s ({probe.attempts} probes)")
+            if BOOT_MODE == "snapshot" and not restore:
+                snapshot_save_s = save_ready_snapshot()
+            if APP_STATS_HZ > 0:
+                scraper = AppScraper("nginx", *GUEST_ADDRESS, APP_STATS_HZ, clock_ns, APP_STATS_STORE_FILE)
+                scraper.start()
             buffered_print(f"Nginx is ready at +{startup_time}s")
         else:
             buffered_print("Nginx did not start in time.")
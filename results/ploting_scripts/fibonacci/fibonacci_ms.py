@@ -1,17 +1,15 @@
+import glob
 import os
 import re
+import sys
+import matplotlib
+if not os.environ.get("DISPLAY"):
+    matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import pandas as pd
 
-# List of input files with .txt extension
-files = [
-    # 'fibonacci_5_ubuntu.txt',
-    # 'fibonacci_5_unikraft.txt',
-    # 'fibonacci_30_ubuntu.txt',
-    # 'fibonacci_30_unikraft.txt',
-    'fibonacci_50_ubuntu.txt',
-    'fibonacci_50_unikraft.txt'
-]
+# Input files given on the command line, else every fibonacci_<n>_<platform>.txt here (harness/batch.py appends to them)
+files = sys.argv[1:] or sorted(glob.glob('fibonacci_*_*.txt'))
 
 # Regex pattern to extract time from lines
 pattern = re.compile(r"Elapsed time:\s+(\d+)\s+ns")
@@ -32,7 +30,7 @@ for file in files:
             avg_ns = sum(times_ns) / len(times_ns)
             avg_ms = avg_ns / 1_000_000  # Convert to milliseconds
 
-            parts = file.replace('.txt', '').split('_')
+            parts = os.path.basename(file).replace('.txt', '').split('_')
             fib_input = parts[1]
             platform = parts[2]
 
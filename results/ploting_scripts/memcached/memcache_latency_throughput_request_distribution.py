@@ -1,41 +1,75 @@
 import json
 import os
+import sys
+import matplotlib
+if not os.environ.get("DISPLAY"):
+    matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 from collections import defaultdict
 
-def load_metric(prefix, count, metric_key, max_time=30):
-    metric_data = defaultdict(list)
-    time_keys = set()
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "harness"))
+from latagg import aggregate
+from steady import memtier_window
 
+def run_files(prefix, count):
+    files = []
     for i in range(count):
         filename = f"{prefix}_run1_{i}.json"
-        if not os.path.exists(filename):
+        if os.path.exists(filename):
+            files.append(filename)
+        else:
             print(f"Missing file: {filename}")
-            continue
+    return files
+
+def load_metric(prefix, count, metric_key, max_time=30, op="Gets"):
+    # per-second mean across runs; average latencies are weighted by each run's request count in that second
+    metric_data = defaultdict(list)
+    time_keys = set()
+
+    for filename in run_files(prefix, count):
         try:
             with open(filename) as f:
                 data = json.load(f)
-            time_series = data.get("ALL STATS", {}).get("Gets", {}).get("Time-Serie", {})
+            time_series = data.get("ALL STATS", {}).get(op, {}).get("Time-Serie", {})
+            # warm-up and teardown seconds are left out (see harness/steady.py)
+            window = memtier_window(data.get("ALL STATS", {}).get("Totals", {})) or (0, max_time)
             for t, stats in time_series.items():
                 t_int = int(t)
-                if t_int > max_time:
+                if t_int > max_time or not window[0] <= t_int <= window[1]:
                     continue
                 if metric_key in stats:
-                    metric_data[t_int].append(stats[metric_key])
+                    weight = stats.get("Count", 0) if metric_key == "Average Latency" else 1
+                    metric_data[t_int].append((stats[metric_key], weight))
                     time_keys.add(t_int)
         except Exception as e:
             print(f"Error reading {filename}: {e}")
 
-    x = sorted(time_keys)
-    y = [sum(metric_data[t]) / len(metric_data[t]) for t in x if metric_data[t]]
+    x = [t for t in sorted(time_keys) if sum(w for _, w in metric_data[t])]
+    y = [sum(v * w for v, w in metric_data[t]) / sum(w for _, w in metric_data[t]) for t in x]
     return x, y
 
+def load_percentile(prefix, count, percentile, max_time=30, op="Gets"):
+    # merged from the runs' latency histograms instead of averaging per-run percentiles (see harness/latagg.py)
+    result = aggregate(run_files(prefix, count), op, (percentile,), max_time=max_time, steady=True)
+    key = f"p{percentile:.2f}"
+    windows = result["windows"]
+    x = [w["start"] for w in windows]
+    y = [w["percentiles_ms"][key] for w in windows]
+    band = ([w["band_ms"][key][0] for w in windows], [w["band_ms"][key][1] for w in windows])
+    print(f"{prefix} {op} {key}: {result['percentiles_ms'][key]:.3f}ms over the whole run "
+          f"({result['band_ms'][key][0]:.3f} - {result['band_ms'][key][1]:.3f}ms, 95% CI over {result['runs']} runs)")
+    return x, y, band
+
 def plot_metric(unikraft_xy, ubuntu_xy, ylabel, title, filename, labels):
     plt.figure(figsize=(12, 6))
     if unikraft_xy[0] and unikraft_xy[1]:
         plt.plot(unikraft_xy[0], unikraft_xy[1], label=labels[0], marker='o')
+        if len(unikraft_xy) > 2:
+            plt.fill_between(unikraft_xy[0], *unikraft_xy[2], alpha=0.2)
     if ubuntu_xy[0] and ubuntu_xy[1]:
         plt.plot(ubuntu_xy[0], ubuntu_xy[1], label=labels[1], marker='x')
+        if len(ubuntu_xy) > 2:
+            plt.fill_between(ubuntu_xy[0], *ubuntu_xy[2], alpha=0.2)
     plt.xlabel("Time Interval (s)")
     plt.ylabel(ylabel)
     plt.title(title)
@@ -55,8 +89,8 @@ def plot_combined_overview(
     # --- Latency Metrics ---
     axs[0].plot(*unikraft_avg_lat, label="Unikraft - Avg Latency", marker='o')
     axs[0].plot(*ubuntu_avg_lat, label="Ubuntu - Avg Latency", marker='x')
-    axs[0].plot(*unikraft_p95, label="Unikraft - p99 Latency", marker='o')
-    axs[0].plot(*ubuntu_p95, label="Ubuntu - p99 Latency", marker='x')
+    axs[0].plot(*unikraft_p95[:2], label="Unikraft - p99 Latency", marker='o')
+    axs[0].plot(*ubuntu_p95[:2], label="Ubuntu - p99 Latency", marker='x')
     axs[0].plot(*unikraft_max_lat, label="Unikraft - Max Latency", marker='o')
     axs[0].plot(*ubuntu_max_lat, label="Ubuntu - Max Latency", marker='x')
     axs[0].set_ylabel("Latency (ms)")
@@ -102,10 +136,14 @@ ubuntu_avg_lat = load_metric("ubuntu", runs, "Average Latency", max_time)
 plot_metric(unikraft_avg_lat, ubuntu_avg_lat, "Latency (ms)", "Average Latency Over Time", "avg_latency_plot.png",
             ["Unikraft - Avg Latency", "Ubuntu - Avg Latency"])
 
-# p95 Latency
-unikraft_p95 = load_metric("unikraft", runs, "p99.00", max_time)
-ubuntu_p95 = load_metric("ubuntu", runs, "p99.00", max_time)
-plot_metric(unikraft_p95, ubuntu_p95, "Latency (ms)", "p99 Latency Over Time", "p99_latency_plot.png",
+# p99 Latency, Gets and Sets separately, with the spread across runs as a band
+unikraft_p95 = load_percentile("unikraft", runs, 99.0, max_time)
+ubuntu_p95 = load_percentile("ubuntu", runs, 99.0, max_time)
+plot_metric(unikraft_p95, ubuntu_p95, "Latency (ms)", "p99 Latency Over Time (Gets)", "p99_latency_plot.png",
+            ["Unikraft - p99 Latency", "Ubuntu - p99 Latency"])
+unikraft_sets_p99 = load_percentile("unikraft", runs, 99.0, max_time, op="Sets")
+ubuntu_sets_p99 = load_percentile("ubuntu", runs, 99.0, max_time, op="Sets")
+plot_metric(unikraft_sets_p99, ubuntu_sets_p99, "Latency (ms)", "p99 Latency Over Time (Sets)", "p99_latency_sets_plot.png",
             ["Unikraft - p99 Latency", "Ubuntu - p99 Latency"])
 
 # Max Latency
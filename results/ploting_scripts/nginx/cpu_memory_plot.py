@@ -1,8 +1,15 @@
+import os
+import matplotlib
+if not os.environ.get("DISPLAY"):
+    matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import csv
 
 ubuntu_path = "../../../../../metrics/cpu_usage_ubuntu.log"
 unikraft_path = "cpu_usage_unikraft.log"
+# written by the harness memory accounting, preferred over host RSS when present
+ubuntu_memory_path = "memory_ubuntu.log"
+unikraft_memory_path = "memory_unikraft.log"
 
 def read_cpu_mem_log(path):
     times, cpus, mems = [], [], []
@@ -22,8 +29,24 @@ def read_cpu_mem_log(path):
                 continue
     return times, cpus, mems
 
+def read_guest_memory_log(path):
+    if not os.path.exists(path):
+        return None
+    times, touched, overhead = [], [], []
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            try:
+                times.append(float(row["Time Elapsed"]))
+                touched.append(float(row["Guest Touched (KB)"]))
+                overhead.append(float(row["QEMU Overhead (KB)"]))
+            except (KeyError, ValueError):
+                continue
+    return times, touched, overhead
+
 ubuntu_time, ubuntu_cpu, ubuntu_mem = read_cpu_mem_log(ubuntu_path)
 unikraft_time, unikraft_cpu, unikraft_mem = read_cpu_mem_log(unikraft_path)
+ubuntu_guest = read_guest_memory_log(ubuntu_memory_path)
+unikraft_guest = read_guest_memory_log(unikraft_memory_path)
 
 fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(10, 8), sharex=True)
 
@@ -34,10 +57,18 @@ ax1.set_title("CPU and Memory Usage of QEMU During 5 Consecutive Benchmarks (4 t
 ax1.legend()
 ax1.grid(True)
 
-ax2.plot(ubuntu_time, ubuntu_mem, label="Ubuntu VM", marker='o')
-ax2.plot(unikraft_time, unikraft_mem, label="Unikraft", marker='x')
+if ubuntu_guest and unikraft_guest:
+    # pages the guest actually touched, QEMU's own heap and libraries shown separately
+    ax2.plot(ubuntu_guest[0], ubuntu_guest[1], label="Ubuntu VM - guest touched", marker='o')
+    ax2.plot(unikraft_guest[0], unikraft_guest[1], label="Unikraft - guest touched", marker='x')
+    ax2.plot(ubuntu_guest[0], ubuntu_guest[2], label="Ubuntu VM - QEMU overhead", linestyle='--')
+    ax2.plot(unikraft_guest[0], unikraft_guest[2], label="Unikraft - QEMU overhead", linestyle='--')
+    ax2.set_ylabel("Guest Memory (KB)")
+else:
+    ax2.plot(ubuntu_time, ubuntu_mem, label="Ubuntu VM", marker='o')
+    ax2.plot(unikraft_time, unikraft_mem, label="Unikraft", marker='x')
+    ax2.set_ylabel("Memory Usage (KB)")
 ax2.set_xlabel("Time (s)")
-ax2.set_ylabel("Memory Usage (KB)")
 ax2.legend()
 ax2.grid(True)
 
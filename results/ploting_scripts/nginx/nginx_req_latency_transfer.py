@@ -1,6 +1,10 @@
+import json
 import re
-import matplotlib.pyplot as plt
 import os
+import matplotlib
+if not os.environ.get("DISPLAY"):
+    matplotlib.use("Agg")
+import matplotlib.pyplot as plt
 
 # Parameters
 runs = 5
@@ -10,13 +14,13 @@ unikraft_prefix = f"nginx_unikraft_run_{concurrency}_"
 
 # Data storage
 results = {
-    "ubuntu": {"requests_per_sec": [], "latency_avg_ms": [], "transfer_per_sec_MB": []},
-    "unikraft": {"requests_per_sec": [], "latency_avg_ms": [], "transfer_per_sec_MB": []},
+    "ubuntu": {"requests_per_sec": [], "latency_avg_ms": [], "transfer_per_sec_MB": [], "latency_p99_ms": [], "latency_p999_ms": []},
+    "unikraft": {"requests_per_sec": [], "latency_avg_ms": [], "transfer_per_sec_MB": [], "latency_p99_ms": [], "latency_p999_ms": []},
 }
 
 # Regex patterns
 req_sec_re = re.compile(r"Requests/sec:\s+([\d.]+)")
-latency_re = re.compile(r"Latency\s+([\d.]+)ms")
+latency_re = re.compile(r"Latency\s+([\d.]+)(us|ms|s)\b")
 transfer_re = re.compile(r"Transfer/sec:\s+([\d.]+)([KMG]B)")
 
 # Helper to extract metrics from a file
@@ -36,7 +40,8 @@ def extract_metrics(filepath):
         raise ValueError(f"Transfer/sec not found in {filepath}")
 
     req_sec = float(req_sec_match.group(1))
-    latency = float(latency_match.group(1))
+    # wrk picks the unit that fits the value
+    latency = float(latency_match.group(1)) * {"us": 0.001, "ms": 1, "s": 1000}[latency_match.group(2)]
 
     transfer_val = float(transfer_match.group(1))
     transfer_unit = transfer_match.group(2)
@@ -53,11 +58,27 @@ def extract_metrics(filepath):
 
     return req_sec, latency, transfer
 
+# httpload.py writes a json next to the text summary with the full latency distribution
+def extract_json_metrics(filepath):
+    with open(filepath) as f:
+        data = json.load(f)
+    latency = data["latency_ms"]
+    return (data["requests_per_sec"], latency["mean"], data["transfer_per_sec"] / (1024 * 1024),
+            latency["percentiles"]["p99.00"], latency["percentiles"]["p99.90"])
+
 # Read files for both setups
 for i in range(runs):
     for platform, prefix in [("ubuntu", ubuntu_prefix), ("unikraft", unikraft_prefix)]:
         filename = f"{prefix}{i}.txt"
-        if os.path.exists(filename):
+        json_filename = f"{prefix}{i}.json"
+        if os.path.exists(json_filename):
+            req_sec, latency, transfer, p99, p999 = extract_json_metrics(json_filename)
+            results[platform]["requests_per_sec"].append(req_sec)
+            results[platform]["latency_avg_ms"].append(latency)
+            results[platform]["transfer_per_sec_MB"].append(transfer)
+            results[platform]["latency_p99_ms"].append(p99)
+            results[platform]["latency_p999_ms"].append(p999)
+        elif os.path.exists(filename):
             try:
                 req_sec, latency, transfer = extract_metrics(filename)
                 results[platform]["requests_per_sec"].append(req_sec)
@@ -70,10 +91,12 @@ for i in range(runs):
 
 # Plotting function for individual metrics
 def plot_metric(metric_key, ylabel):
+    if not any(results[platform][metric_key] for platform in results):
+        return
     plt.figure(figsize=(8, 5))
     for platform in ["ubuntu", "unikraft"]:
         plt.plot(
-            range(1, runs + 1),
+            range(1, len(results[platform][metric_key]) + 1),
             results[platform][metric_key],
             marker="o",
             label=platform.capitalize()
@@ -91,6 +114,8 @@ def plot_metric(metric_key, ylabel):
 plot_metric("requests_per_sec", "Requests per Second")
 plot_metric("latency_avg_ms", "Average Latency (ms)")
 plot_metric("transfer_per_sec_MB", "Transfer per Second (MB)")
+plot_metric("latency_p99_ms", "p99 Latency (ms)")
+plot_metric("latency_p999_ms", "p99.9 Latency (ms)")
 
 # Combined subplot figure
 fig, axs = plt.subplots(3, 1, figsize=(10, 12))
@@ -105,7 +130,7 @@ for i, (metric_key, ylabel) in enumerate(metrics):
     ax = axs[i]
     for platform in ["ubuntu", "unikraft"]:
         ax.plot(
-            range(1, runs + 1),
+            range(1, len(results[platform][metric_key]) + 1),
             results[platform][metric_key],
             marker="o",
             label=platform.capitalize()
@@ -1,3 +1,7 @@
+import os
+import matplotlib
+if not os.environ.get("DISPLAY"):
+    matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 
 def read_times_from_file(filepath, strip_s=False):
@@ -0,0 +1,334 @@
+# Builds every comparison figure from the results store (harness/resultsdb.py) into one static
+# report: results/report/index.html plus one PNG per figure.
+#
+# Figures are described by their input data, which is queried from results.sqlite up front, and
+# rendered in a process pool with the non-interactive Agg backend, so no display is needed and
+# nothing blocks. Each figure is cached under a hash of its data, its parameters and this file:
+# a figure whose runs did not change is not drawn again, so after a new run only the figures
+# that include it are redrawn.
+#
+#   python3 results/ploting_scripts/report.py            # ingest new results, redraw what changed
+#   python3 results/ploting_scripts/report.py --force    # redraw everything
+
+import argparse
+import hashlib
+import html
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+matplotlib.use("Agg")
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.join(SCRIPT_DIR, "..", "..")
+sys.path.insert(0, os.path.join(REPO_ROOT, "harness"))
+from resultsdb import DEFAULT_DB, ResultsDB
+
+RESULTS_DIR = os.path.join(REPO_ROOT, "results")
+DEFAULT_OUT = os.path.join(RESULTS_DIR, "report")
+PLATFORM_COLORS = {"unikraft": "tab:green", "ubuntu": "tab:blue", None: "tab:gray"}
+NGINX_METRICS = (
+    ("requests_per_sec", "Requests/sec"),
+    ("latency_avg_ms", "Average latency (ms)"),
+    ("latency_p99_ms", "p99 latency (ms)"),
+    ("transfer_per_sec_bytes", "Transfer/sec (bytes)"),
+)
+MEMCACHED_METRICS = (
+    ("totals_ops_per_sec_steady", "Ops/sec (steady state)"),
+    ("totals_latency_avg_ms_steady", "Average latency, steady state (ms)"),
+)
+PERCENTILES = (50.0, 99.0, 99.9)
+
+
+def source_hash():
+    with open(os.path.abspath(__file__), "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def metric_groups(db, app, name):
+    # {platform: {level: [values]}}
+    _, rows = db.query("SELECT r.platform, r.level, m.value FROM metrics m JOIN runs r ON r.id = m.run_id "
+                       "WHERE r.app = ? AND m.name = ? ORDER BY r.platform, r.level, r.rep", (app, name))
+    groups = {}
+    for platform, level, value in rows:
+        groups.setdefault(platform or "unlabelled", {}).setdefault(str(level), []).append(value)
+    return groups
+
+
+def startup_groups(db, app):
+    # {platform: {strategy: [values]}}, cold boots next to snapshot restores
+    groups = {}
+    for name, strategy in (("startup_s", "cold boot"), ("startup_restore_s", "snapshot restore")):
+        for platform, levels in metric_groups(db, app, name).items():
+            groups.setdefault(platform, {})[strategy] = [v for values in levels.values() for v in values]
+    return groups
+
+
+def histogram_groups(db, app, name):
+    _, rows = db.query("SELECT r.platform, r.level, h.encoded FROM histograms h JOIN runs r ON r.id = h.run_id "
+                       "WHERE r.app = ? AND h.name = ? ORDER BY r.platform, r.level, r.rep", (app, name))
+    groups = {}
+    for platform, level, encoded in rows:
+        groups.setdefault(platform or "unlabelled", {}).setdefault(str(level), []).append(encoded)
+    return groups
+
+
+def series_groups(db, app, series, level):
+    # {platform: {t: [values of all runs]}}
+    _, rows = db.query("SELECT r.platform, s.t, s.value FROM samples s JOIN runs r ON r.id = s.run_id "
+                       "WHERE r.app = ? AND s.series = ? AND r.level IS ? ORDER BY r.platform, s.t", (app, series, level))
+    groups = {}
+    for platform, t, value in rows:
+        groups.setdefault(platform or "unlabelled", {}).setdefault(round(t, 1), []).append(value)
+    return groups
+
+
+def levels_with(db, app, series):
+    _, rows = db.query("SELECT DISTINCT r.level FROM samples s JOIN runs r ON r.id = s.run_id "
+                       "WHERE r.app = ? AND s.series = ? ORDER BY r.level", (app, series))
+    return [row[0] for row in rows]
+
+
+def collect_figures(db):
+    # [(name, section, kind, params, data)]
+    figures = []
+    for app in ("nginx", "memcached"):
+        data = startup_groups(db, app)
+        if data:
+            figures.append((f"{app}_startup", app, "box", {"title": f"{app} startup time", "ylabel": "seconds"}, data))
+        phases = {}
+        _, rows = db.query("SELECT r.platform, m.name, avg(m.value) FROM metrics m JOIN runs r ON r.id = m.run_id "
+                           "WHERE r.app = ? AND m.name LIKE 'boot\\_%\\_s' ESCAPE '\\' GROUP BY 1, 2 ORDER BY 1, 2", (app,))
+        for platform, name, value in rows:
+            phases.setdefault(platform, {})[name[5:-2]] = value
+        if phases:
+            figures.append((f"{app}_boot_phases", app, "stacked", {"title": f"{app} boot phases", "ylabel": "seconds"}, phases))
+
+    for name, label in NGINX_METRICS:
+        data = metric_groups(db, "nginx", name)
+        if data:
+            figures.append((f"nginx_{name}", "nginx", "bars", {"title": f"nginx {label}", "ylabel": label, "xlabel": "connections"}, data))
+    for name, label in MEMCACHED_METRICS:
+        data = metric_groups(db, "memcached", name)
+        if data:
+            figures.append((f"memcached_{name}", "memcached", "bars",
+                            {"title": f"memcached {label}", "ylabel": label, "xlabel": "connections"}, data))
+    for op in ("gets", "sets"):
+        data = histogram_groups(db, "memcached", op)
+        if data:
+            figures.append((f"memcached_{op}_percentiles", "memcached", "percentiles",
+                            {"title": f"memcached {op} latency, merged over runs", "ylabel": "ms", "xlabel": "connections",
+                             "percentiles": PERCENTILES}, data))
+    for level in levels_with(db, "memcached", "totals_count"):
+        data = series_groups(db, "memcached", "totals_count", level)
+        figures.append((f"memcached_throughput_{level}", "memcached", "series",
+                        {"title": f"memcached ops per second, {level} connections (mean of runs)", "ylabel": "ops/s",
+                         "xlabel": "seconds"}, data))
+    for app in ("nginx", "memcached"):
+        for level in levels_with(db, app, "cpu_percent"):
+            data = series_groups(db, app, "cpu_percent", level)
+            figures.append((f"{app}_cpu_{level}", app, "series",
+                            {"title": f"{app} QEMU CPU, {level} connections (mean of runs)", "ylabel": "CPU %", "xlabel": "seconds"}, data))
+
+    data = metric_groups(db, "fibonacci", "elapsed_ns")
+    if data:
+        figures.append(("fibonacci_elapsed", "fibonacci", "bars",
+                        {"title": "fibonacci execution time", "ylabel": "ns", "xlabel": "n", "log": True}, data))
+    data = microbench_groups(db)
+    if data:
+        figures.append(("microbench_ns_per_op", "microbench", "bars",
+                        {"title": "microbenchmarks, time per operation", "ylabel": "ns", "xlabel": "test", "log": True,
+                         "rotate": True}, data))
+    for count, data in sorted(fs_groups(db, "requests_per_sec").items()):
+        figures.append((f"nginx_fs_{count}_requests_per_sec", "nginx_fs", "bars",
+                        {"title": f"nginx static files by root filesystem, {count} file(s) per size", "ylabel": "Requests/sec",
+                         "xlabel": "file size (bytes)", "log": True}, data))
+    for count, data in sorted(fs_groups(db, "transfer_per_sec_bytes").items()):
+        figures.append((f"nginx_fs_{count}_transfer_per_sec", "nginx_fs", "bars",
+                        {"title": f"nginx static file throughput by root filesystem, {count} file(s) per size",
+                         "ylabel": "Transfer/sec (bytes)", "xlabel": "file size (bytes)", "log": True}, data))
+    return figures
+
+
+def fs_groups(db, name):
+    # {file count: {backend: {file size: [values]}}} from the <backend>_<count> labels of fsbench.py runs
+    _, rows = db.query("SELECT r.label, r.level, m.value FROM metrics m JOIN runs r ON r.id = m.run_id "
+                       "WHERE r.app = 'nginx_fs' AND m.name = ? ORDER BY r.label, r.level, r.rep", (name,))
+    groups = {}
+    for label, level, value in rows:
+        backend, _, count = label.rpartition("_")
+        groups.setdefault(int(count), {}).setdefault(backend, {}).setdefault(str(level), []).append(value)
+    return groups
+
+
+def microbench_groups(db):
+    # {platform: {test: [median ns per op of each run]}}
+    _, rows = db.query("SELECT r.platform, m.name, m.value FROM metrics m JOIN runs r ON r.id = m.run_id "
+                       "WHERE r.app = 'microbench' ORDER BY r.platform, m.name, r.rep")
+    groups = {}
+    for platform, name, value in rows:
+        if name.endswith("_ns_per_op") and not name.endswith("_min_ns_per_op"):
+            groups.setdefault(platform or "unlabelled", {}).setdefault(name[:-len("_ns_per_op")], []).append(value)
+    return groups
+
+
+def level_key(level):
+    # numeric levels in order, then named ones (microbench tests) alphabetically
+    if level == "None":
+        return 0, -1.0, ""
+    try:
+        return 0, float(level), ""
+    except ValueError:
+        return 1, 0.0, level
+
+
+def figure_key(kind, params, data, code):
+    payload = json.dumps([kind, params, data], sort_keys=True, default=str)
+    return hashlib.sha256((code + payload).encode()).hexdigest()
+
+
+def render(job):
+    # runs in a pool worker; returns (name, summary rows for the html table)
+    import matplotlib.pyplot as plt
+    import numpy as np
+
+    name, kind, params, data, path = job
+    fig, ax = plt.subplots(figsize=(10, 5.5))
+    rows = []
+    platforms = sorted(data, key=str)
+    if kind == "box":
+        values = [data[p][k] for p in platforms for k in data[p]]
+        labels = [f"{p}" + (f" ({k})" if k != "None" else "") for p in platforms for k in data[p]]
+        ax.boxplot(values, showmeans=True)
+        ax.set_xticks(range(1, len(labels) + 1), labels)
+        rows = [[label, len(v), np.mean(v), np.median(v)] for label, v in zip(labels, values)]
+    elif kind == "stacked":
+        phases = sorted({phase for p in platforms for phase in data[p]})
+        bottom = np.zeros(len(platforms))
+        for phase in phases:
+            heights = np.array([data[p].get(phase, 0.0) for p in platforms])
+            ax.bar(platforms, heights, bottom=bottom, label=phase)
+            bottom += heights
+        ax.legend()
+        rows = [[p, None, sum(data[p].values()), None] for p in platforms]
+    elif kind in ("bars", "percentiles"):
+        levels = sorted({k for p in platforms for k in data[p]}, key=level_key)
+        groups = [(p, None) for p in platforms] if kind == "bars" else \
+            [(p, q) for p in platforms for q in params["percentiles"]]
+        width = 0.8 / max(1, len(groups))
+        x = np.arange(len(levels))
+        if kind == "percentiles":
+            from latagg import Distribution, merge
+        for i, (platform, pct) in enumerate(groups):
+            heights, errors = [], []
+            for level in levels:
+                values = data[platform].get(level, [])
+                if kind == "bars":
+                    heights.append(np.mean(values) if values else np.nan)
+                    errors.append(np.std(values, ddof=1) if len(values) > 1 else 0.0)
+                    rows.append([f"{platform} {level}", len(values), heights[-1], np.median(values) if values else None])
+                else:
+                    merged = merge(Distribution.decode(v) for v in values)
+                    heights.append(merged.percentiles((pct,))[0] / 1000 if values else np.nan)
+                    rows.append([f"{platform} {level} p{pct:g}", len(values), heights[-1], None])
+            label = platform if pct is None else f"{platform} p{pct:g}"
+            ax.bar(x + i * width - 0.4 + width / 2, heights, width, yerr=errors if kind == "bars" else None, capsize=3, label=label,
+                   color=PLATFORM_COLORS.get(platform) if pct is None else None)
+        ax.set_xticks(x, levels)
+        if params.get("rotate"):
+            plt.setp(ax.get_xticklabels(), rotation=60, ha="right")
+        ax.legend()
+    elif kind == "series":
+        for platform in platforms:
+            ts = sorted(data[platform], key=float)
+            means = [np.mean(data[platform][t]) for t in ts]
+            ax.plot([float(t) for t in ts], means, label=platform, color=PLATFORM_COLORS.get(platform))
+            rows.append([platform, len(ts), float(np.mean(means)) if means else None, float(np.median(means)) if means else None])
+        ax.legend()
+    if params.get("log"):
+        ax.set_yscale("log")
+    ax.set_title(params["title"])
+    ax.set_ylabel(params.get("ylabel", ""))
+    ax.set_xlabel(params.get("xlabel", ""))
+    ax.grid(True, alpha=0.3)
+    fig.tight_layout()
+    fig.savefig(path, dpi=120)
+    plt.close(fig)
+    return name, [[None if v is None or (isinstance(v, float) and v != v) else v for v in row] for row in rows]
+
+
+def write_html(out_dir, figures, summaries):
+    parts = ["<!DOCTYPE html><html><head><meta charset='utf-8'><title>Unikraft vs Ubuntu</title>",
+             "<style>body{font-family:sans-serif;max-width:1100px;margin:auto}img{max-width:100%}"
+             "table{border-collapse:collapse;margin-bottom:2em}td,th{border:1px solid #ccc;padding:2px 8px;text-align:right}</style>",
+             f"</head><body><h1>Unikraft vs Ubuntu</h1><p>Generated {time.strftime('%Y-%m-%d %H:%M:%S')}</p>"]
+    section = None
+    for name, fig_section, _, params, _ in figures:
+        if fig_section != section:
+            section = fig_section
+            parts.append(f"<h2>{html.escape(section)}</h2>")
+        parts.append(f"<h3>{html.escape(params['title'])}</h3><img src='{name}.png' alt='{html.escape(name)}'>")
+        rows = summaries.get(name) or []
+        if rows:
+            parts.append("<table><tr><th>group</th><th>n</th><th>mean</th><th>median</th></tr>")
+            for label, n, mean, median in rows:
+                cells = [html.escape(str(label)), "" if n is None else str(n)] + ["" if v is None else f"{v:.6g}" for v in (mean, median)]
+                parts.append("<tr>" + "".join(f"<td>{c}</td>" for c in cells) + "</tr>")
+            parts.append("</table>")
+    parts.append("</body></html>")
+    with open(os.path.join(out_dir, "index.html"), "w") as f:
+        f.write("\n".join(parts))
+
+
+def build(db_path=DEFAULT_DB, out_dir=DEFAULT_OUT, ingest=True, force=False, workers=None):
+    os.makedirs(out_dir, exist_ok=True)
+    with ResultsDB(db_path) as db:
+        if ingest:
+            db.ingest(RESULTS_DIR)
+        figures = collect_figures(db)
+
+    manifest_path = os.path.join(out_dir, "manifest.json")
+    manifest = {}
+    if os.path.exists(manifest_path) and not force:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    code = source_hash()
+    jobs, summaries, keys = [], {}, {}
+    for name, _, kind, params, data in figures:
+        key = keys[name] = figure_key(kind, params, data, code)
+        path = os.path.join(out_dir, f"{name}.png")
+        cached = manifest.get(name)
+        if cached and cached["key"] == key and os.path.exists(path):
+            summaries[name] = cached["summary"]
+        else:
+            jobs.append((name, kind, params, data, path))
+
+    start = time.monotonic()
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for name, summary in pool.map(render, jobs):
+                summaries[name] = summary
+    manifest = {name: {"key": keys[name], "summary": summaries[name]} for name in keys}
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=1)
+    write_html(out_dir, figures, summaries)
+    return len(figures), len(jobs), time.monotonic() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render the results report from results.sqlite")
+    parser.add_argument("--db", default=DEFAULT_DB)
+    parser.add_argument("--out", default=DEFAULT_OUT)
+    parser.add_argument("--no-ingest", dest="ingest", action="store_false", help="use the store as it is")
+    parser.add_argument("--force", action="store_true", help="redraw every figure")
+    parser.add_argument("-j", "--workers", type=int, help="render processes (default: one per CPU)")
+    args = parser.parse_args()
+    total, drawn, elapsed = build(args.db, args.out, args.ingest, args.force, args.workers)
+    print(f"{drawn} of {total} figures redrawn in {round(elapsed, 2)}s -> {os.path.join(args.out, 'index.html')}")
+
+
+if __name__ == "__main__":
+    main()